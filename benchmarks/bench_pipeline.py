@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the boundary (Segment) and IC steps on synthetic GLORYS-like data.
+
+No files from /work are needed: a GLORYS-like source (temperature, salinity, SSH and
+currents on a regular lon/lat grid with a coastline and bathymetry) and an
+ocean_hgrid.nc-style supergrid are generated in memory for each scale.
+
+How to use
+./bench_pipeline.py --scales quarter twelfth --output bench_results.json
+./bench_pipeline.py --scales 3km --benchmarks regrid_tracer write --repeat 5
+
+Results (min/median wall time per benchmark and scale, plus the git commit)
+are written to JSON, so runs can be compared across commits.
+"""
+
+# author: 'Jing Chen'
+# description: 'Benchmarks of boundary and IC generation on synthetic GLORYS-like grids'
+# created: '2025-08-05'
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import xarray
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+sys.path.append(os.path.join(repo_dir, 'boundary'))
+sys.path.append(os.path.join(repo_dir, 'initial'))
+
+# Source and model grid spacing in degrees for each scale
+SCALES = {
+    'quarter': 0.25,
+    'twelfth': 1 / 12,
+    '3km': 0.027,
+}
+
+
+def glorys_depths(nz=50, max_depth=5700.0):
+    """Stretched depth levels resembling GLORYS (about 0.5 m at the top, 5700 m at the bottom)."""
+    s = np.linspace(0, 1, nz)
+    return 0.5 + (max_depth - 0.5) * s ** 3
+
+
+def synthetic_source(res, extent=10.0, nz=50, nt=1, lon0=-80.0, lat0=20.0, seed=0):
+    """GLORYS-like daily source on a regular grid.
+
+    Land is the region west of a meandering coastline, and the bathymetry deepens
+    offshore, so deep levels near the coast are missing as in GLORYS.
+
+    Args:
+        res (float): Grid spacing in degrees.
+        extent (float, optional): Width and height of the domain in degrees. Defaults to 10.
+        nz (int, optional): Number of depth levels. Defaults to 50.
+        nt (int, optional): Number of time records. Defaults to 1.
+
+    Returns:
+        xarray.Dataset: thetao, so, uo, vo on (time, z, lat, lon) and zos on (time, lat, lon).
+    """
+    rng = np.random.default_rng(seed)
+    lon = lon0 + np.arange(0, extent, res)
+    lat = lat0 + np.arange(0, extent, res)
+    z = glorys_depths(nz)
+    time_ = np.arange(nt, dtype='float64') * 24.0
+
+    x, y = np.meshgrid(lon, lat)
+    coast = lon0 + 0.2 * extent + 0.05 * extent * np.sin(2 * np.pi * (y - lat0) / extent)
+    offshore = np.clip(x - coast, 0, None)
+    bottom = np.where(offshore > 0, 50.0 + 5000.0 * np.tanh(offshore / (0.2 * extent)), 0.0)
+    wet = z[:, None, None] < bottom[None]
+
+    def field(base, scale, decay):
+        values = base + scale * np.exp(-z / decay)[:, None, None] * np.cos(np.radians(y))[None]
+        values = values[None] + 0.01 * rng.standard_normal((nt, nz) + x.shape)
+        return np.where(wet[None], values, np.nan).astype('float32')
+
+    dims3 = ['time', 'z', 'lat', 'lon']
+    dims2 = ['time', 'lat', 'lon']
+    zos = 0.5 * np.sin(np.radians(x))[None] + 0.01 * rng.standard_normal((nt,) + x.shape)
+    return xarray.Dataset(
+        {
+            'thetao': (dims3, field(2.0, 25.0, 500.0)),
+            'so': (dims3, field(34.5, 1.5, 800.0)),
+            'uo': (dims3, field(0.0, 0.5, 300.0)),
+            'vo': (dims3, field(0.0, 0.3, 300.0)),
+            'zos': (dims2, np.where(wet[0][None], zos, np.nan).astype('float32')),
+        },
+        coords={'time': ('time', time_, {'units': 'hours since 1950-01-01', 'calendar': 'gregorian'}),
+                'z': z, 'lat': lat, 'lon': lon},
+    )
+
+
+def synthetic_hgrid(res, extent=10.0, lon0=-80.0, lat0=20.0, margin=1.0):
+    """ocean_hgrid.nc-style supergrid (twice the model resolution) inside the source domain."""
+    nx = int((extent - 2 * margin) / res)
+    ny = int((extent - 2 * margin) / res)
+    xs = lon0 + margin + np.linspace(0, nx * res, 2 * nx + 1)
+    ys = lat0 + margin + np.linspace(0, ny * res, 2 * ny + 1)
+    x, y = np.meshgrid(xs, ys)
+    # A slight rotation so that the velocity rotation is exercised
+    angle = np.full(x.shape, np.radians(2.0))
+    return xarray.Dataset({
+        'x': (('nyp', 'nxp'), x, {'units': 'degree_east'}),
+        'y': (('nyp', 'nxp'), y, {'units': 'degree_north'}),
+        'angle_dx': (('nyp', 'nxp'), angle, {'units': 'radians'}),
+    })
+
+
+class Case():
+    """Synthetic inputs for one scale, built lazily and shared by the benchmarks."""
+
+    def __init__(self, scale, extent, nz, nt, tmpdir):
+        self.scale = scale
+        self.res = SCALES[scale]
+        self.source = synthetic_source(self.res, extent, nz, nt)
+        self.hgrid = synthetic_hgrid(self.res, extent)
+        self.tmpdir = tmpdir
+        self._segment = None
+        self._tracer = None
+        self._remap_segment = None
+
+    def segment(self, **kwargs):
+        from boundary import Segment
+        if self._segment is None or kwargs:
+            segment = Segment(1, 'south', self.hgrid, output_dir=self.tmpdir, **kwargs)
+            if kwargs:
+                return segment
+            self._segment = segment
+        return self._segment
+
+    def tracer(self):
+        """A regridded boundary tracer dataset, as written to file."""
+        if self._tracer is None:
+            self._tracer = self.segment().regrid_tracer(self.source['thetao'], write=False)
+        return self._tracer
+
+    def ic_source(self):
+        """Source subset the way write_initial prepares it (depth named 'depth')."""
+        return self.source.rename({'z': 'depth'})
+
+
+def bench_regrid_tracer(case):
+    case.segment().regrid_tracer(case.source['thetao'], write=False)
+
+
+def bench_regrid_velocity(case):
+    case.segment().regrid_velocity(case.source['uo'], case.source['vo'], write=False)
+
+
+def bench_fill_missing(case):
+    from boundary import fill_missing
+    # The boundary strip as it comes out of the regridder, before filling
+    regridded = case.source['thetao'].isel(lat=len(case.source.lat) // 2).rename({'lon': 'locations'})
+    fill_missing(regridded.to_dataset(), fill='b')
+
+
+def bench_flood(case):
+    from boundary import flood_missing
+    window = case.segment().source_window(case.source['thetao'])
+    flood_missing(window, xdim='lon', ydim='lat', zdim='z').load()
+
+
+def bench_vertical_interp(case):
+    from depths import vgrid_to_layers
+    vgrid = xarray.open_dataarray(os.path.join(repo_dir, 'grid', 'vgrid_75_2m.nc'))
+    z = vgrid_to_layers(vgrid)
+    ztarget = xarray.DataArray(z, name='zl', dims=['zl'], coords={'zl': z})
+    case.ic_source()[['thetao', 'so', 'uo', 'vo']].interp(depth=ztarget).load()
+
+
+def bench_deep_fill(case):
+    from write_glorys_IC_3200_3km_20240920_fill_at_the_end import fill_from_deepest_valid
+    temp = case.ic_source()['thetao'].rename({'depth': 'zl'})
+    xarray.apply_ufunc(
+        fill_from_deepest_valid,
+        temp,
+        input_core_dims=[['zl']],
+        output_core_dims=[['zl']],
+        vectorize=True,
+        output_dtypes=[temp.dtype]
+    ).load()
+
+
+def bench_vertical_remap(case):
+    from boundary import fill_missing
+    from depths import vgrid_to_interfaces
+    if case._remap_segment is None:
+        vgrid = xarray.open_dataarray(os.path.join(repo_dir, 'grid', 'vgrid_75_2m.nc'))
+        case._remap_segment = case.segment(interfaces=vgrid_to_interfaces(vgrid))
+    # Filled boundary columns on the source levels, as they come out of regrid_tracer
+    columns = case.source[['thetao']].isel(lat=len(case.source.lat) // 2).rename({'lon': 'locations'})
+    columns = fill_missing(columns).transpose('time', 'z', 'locations')
+    case._remap_segment.remap_vertical(columns)
+
+
+def bench_write(case):
+    case.segment().to_netcdf(case.tracer().copy(), 'thetao', suffix='bench')
+
+
+def bench_write_compressed(case):
+    from nc_writer import load_output_policy
+    policy = load_output_policy({'output_policy': {'complevel': 4}})
+    case.segment(output_policy=policy).to_netcdf(case.tracer().copy(), 'thetao', suffix='bench_z')
+
+
+BENCHMARKS = {
+    'regrid_tracer': bench_regrid_tracer,
+    'regrid_velocity': bench_regrid_velocity,
+    'fill_missing': bench_fill_missing,
+    'flood': bench_flood,
+    'vertical_interp': bench_vertical_interp,
+    'deep_fill': bench_deep_fill,
+    'vertical_remap': bench_vertical_remap,
+    'write': bench_write,
+    'write_compressed': bench_write_compressed,
+}
+
+
+def run_benchmark(fn, case, repeat=3):
+    """Time fn(case) repeat times after one warm-up call (which builds regridders and caches).
+
+    Returns:
+        list: wall times in seconds.
+    """
+    fn(case)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(case)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark boundary and IC steps on synthetic grids.')
+    parser.add_argument('--scales', nargs='+', default=['quarter', 'twelfth'], choices=list(SCALES))
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument('--extent', type=float, default=10.0, help='Domain width and height in degrees')
+    parser.add_argument('--nz', type=int, default=50, help='Source depth levels')
+    parser.add_argument('--nt', type=int, default=1, help='Source time records')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed repetitions per benchmark')
+    parser.add_argument('--output', type=str, default='bench_results.json', help='JSON file for the results')
+    args = parser.parse_args()
+
+    report = {
+        'commit': git_commit(),
+        'date': f"{datetime.now():%Y-%m-%dT%H:%M:%S}",
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'xarray': xarray.__version__,
+        'settings': {'extent': args.extent, 'nz': args.nz, 'nt': args.nt, 'repeat': args.repeat},
+        'results': [],
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for scale in args.scales:
+            case = Case(scale, args.extent, args.nz, args.nt, tmpdir)
+            shape = dict(case.source['thetao'].sizes)
+            print(f"{scale}: source {shape}, hgrid {dict(case.hgrid.sizes)}")
+            for name in args.benchmarks:
+                times = run_benchmark(BENCHMARKS[name], case, args.repeat)
+                result = {
+                    'scale': scale,
+                    'benchmark': name,
+                    'source_shape': shape,
+                    'times': times,
+                    'min': min(times),
+                    'median': statistics.median(times),
+                }
+                report['results'].append(result)
+                print(f"  {name:18s} min {result['min']:.4f} s  median {result['median']:.4f} s")
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=1)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Startup time of the IC, OBC and merge entry points.
+
+Each entry point is imported (or run with --help) in a fresh interpreter, and the
+wall time and the heavy backends it pulled in (xesmf, ESMF, HCtFlood, matplotlib)
+are recorded. Regridding, flooding and plotting backends should load only when
+a run needs them, so none of them should appear here.
+
+How to use
+./bench_startup.py --repeat 5 --output startup_results.json
+"""
+
+# author: 'Jing Chen'
+# description: 'Startup time and heavy imports of the IC, OBC and merge entry points'
+# created: '2025-08-05'
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+
+HEAVY_MODULES = ['xesmf', 'ESMF', 'esmpy', 'HCtFlood', 'matplotlib']
+
+# name: (directory added to sys.path, module imported)
+ENTRY_POINTS = {
+    'boundary': ('boundary', 'boundary'),
+    'obc_cli': ('boundary', 'write_MOM6_glorys_boundary_daily'),
+    'merge_cli': ('boundary', 'merge_Glorys_nc'),
+    'ic_cli': ('initial', 'write_glorys_IC_3200_3km_20240920_fill_at_the_end'),
+}
+
+PROBE = """
+import json, sys
+sys.path[:0] = {paths!r}
+import {module}
+print(json.dumps([m for m in {heavy!r} if m in sys.modules]))
+"""
+
+
+def time_import(directory, module, repeat=3):
+    """Wall times of importing module in fresh interpreters, and the heavy modules it loaded."""
+    paths = [os.path.join(repo_dir, directory), os.path.join(repo_dir, 'boundary')]
+    code = PROBE.format(paths=paths, module=module, heavy=HEAVY_MODULES)
+    times = []
+    loaded = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.join(repo_dir, directory))
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return {'error': result.stderr.strip().splitlines()[-1] if result.stderr else 'failed'}
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return {'times': times, 'min': min(times), 'median': statistics.median(times), 'heavy_imports': loaded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure entry point startup time.')
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per entry point')
+    parser.add_argument('--output', type=str, default='startup_results.json', help='JSON file for the results')
+    args = parser.parse_args()
+
+    baseline = time_import('boundary', 'os', args.repeat)
+    report = {
+        'date': f"{datetime.now():%Y-%m-%dT%H:%M:%S}",
+        'python': sys.version.split()[0],
+        'interpreter': baseline,
+        'results': {},
+    }
+    print(f"{'interpreter':12s} median {baseline['median']:.3f} s")
+    for name, (directory, module) in ENTRY_POINTS.items():
+        result = time_import(directory, module, args.repeat)
+        report['results'][name] = result
+        if 'error' in result:
+            print(f"{name:12s} failed: {result['error']}")
+        else:
+            print(f"{name:12s} median {result['median']:.3f} s  heavy imports: {result['heavy_imports'] or 'none'}")
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=1)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
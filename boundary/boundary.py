@@ -1,11 +1,14 @@
 # author: 'Jing Chen'
 # description: 'Boundary conditions for MOM6, generated from GLORYS PHY fields'
 # created: '2025-08-05'
+import hashlib
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from os import path
 #import warnings
 import xarray as xarray
-import xesmf
+from nc_writer import record_chunks, write_netcdf
+from profiling import stage
 
 # ignore pandas FutureWarnings raised multiple times by xarray
 #warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -45,25 +48,71 @@ def rotate_uv(uearth, vearth, angle_earth_to_model_rad):
     return urot, vrot
 
 
-def fill_missing(arr, xdim='locations', zdim='z', fill='b'):
+def _ffill_axis(a, axis):
+    """Forward-fill NaNs along one axis of a float array, in place.
+    Leading NaNs (with no valid value before them) are left as NaN.
+    """
+    a = np.moveaxis(a, axis, -1)
+    mask = np.isnan(a)
+    if not mask.any():
+        return
+    idx = np.where(mask, 0, np.arange(a.shape[-1]))
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    a[...] = np.take_along_axis(a, idx, axis=-1)
+
+
+def _bfill_axis(a, axis):
+    """Backward-fill NaNs along one axis of a float array, in place."""
+    index = [slice(None)] * a.ndim
+    index[axis] = slice(None, None, -1)
+    _ffill_axis(a[tuple(index)], axis)
+
+
+def _fill_array(a, axis_x, axis_z, fill, zero):
+    """Fill NaNs of a raw array in place: horizontally, then vertically, then with zeros."""
+    if axis_x is not None:
+        if fill == 'f':
+            _ffill_axis(a, axis_x)
+        elif fill == 'b':
+            _bfill_axis(a, axis_x)
+    if axis_z is not None:
+        _ffill_axis(a, axis_z)
+    if zero:
+        np.nan_to_num(a, copy=False, nan=0.0, posinf=np.inf, neginf=-np.inf)
+
+
+def fill_missing(arr, xdim='locations', zdim='z', fill='b', inplace=False):
     """Fill missing data along the boundaries.
     Extrapolates horizontally first, then vertically. 
+    Works directly on the NumPy arrays, like bfill/ffill followed by fillna(0).
    
     Args:
         arr: xarray DataArray or Dataset to be fillled.
         xdim: horizontal dimension of the dataset. 
         zdim: vertical dimension of the dataset.
         fill (str, optional): Method to use for filling data horizontally (b for bfill or f for ffill).
+        inplace (bool, optional): Fill the arrays of arr itself instead of a copy. Defaults to False.
     
     Returns:
         Filled DataArray or Dataset.
     """
-    if fill == 'f':
-        filled = arr.ffill(dim=xdim, limit=None)
-    elif fill == 'b':
-        filled = arr.bfill(dim=xdim, limit=None)
-    if zdim is not None:
-        filled = filled.ffill(dim=zdim, limit=None).fillna(0)
+    filled = arr if inplace else arr.copy(deep=True)
+    if isinstance(filled, xarray.DataArray):
+        variables = [filled.variable]
+    else:
+        variables = [filled.variables[v] for v in filled.data_vars]
+    for var in variables:
+        if not np.issubdtype(var.dtype, np.floating):
+            continue
+        # Lazily loaded or chunked data give a temporary array here, so the filled
+        # array is always assigned back (a no-op for data already in memory)
+        data = np.asarray(var.data)
+        if not data.flags.writeable:
+            data = data.copy()
+        axis_x = var.dims.index(xdim) if xdim in var.dims else None
+        axis_z = var.dims.index(zdim) if zdim is not None and zdim in var.dims else None
+        _fill_array(data, axis_x, axis_z, fill, zero=zdim is not None)
+        var.values = data
     return filled
 
 
@@ -104,6 +153,158 @@ def flood_missing(arr, **kwargs):
     return flooded
 
 
+def halo_window(source, lon, lat, xdim, ydim, margin=0):
+    """Index window of a source grid covering a set of target points plus a margin.
+
+    The window spans the source points inside the bounding box of the targets grown by
+    one source grid spacing (the reach of a nearest-neighbour stencil), plus margin points
+    in each direction. Target longitudes are shifted into the source's longitude range.
+
+    Args:
+        source: xarray DataArray or Dataset with 'lon' and 'lat' (1D along xdim/ydim, or 2D).
+        lon: target longitudes.
+        lat: target latitudes.
+        xdim (str): name of the source x dimension.
+        ydim (str): name of the source y dimension.
+        margin (int, optional): extra source points to include on each side. Defaults to 0.
+
+    Returns:
+        dict: slices keyed by xdim and ydim, for use with isel.
+    """
+    slon = source['lon']
+    slat = source['lat']
+    if slon.ndim == 1 and slat.ndim == 1:
+        slon_x = slon.values[np.newaxis, :]
+        slat_y = slat.values[:, np.newaxis]
+    else:
+        slon_x = slon.transpose(ydim, xdim).values
+        slat_y = slat.transpose(ydim, xdim).values
+    lon = np.asarray(lon, dtype='float64')
+    lat = np.asarray(lat, dtype='float64')
+    lon_min_src = float(np.nanmin(slon_x))
+    lon = lon_min_src + np.mod(lon - lon_min_src, 360.0)
+
+    # Grow the bounding box by one source grid spacing: the reach of a nearest-neighbour stencil
+    dlon = np.nanmax(np.abs(np.diff(slon_x, axis=1))) if slon_x.shape[1] > 1 else 0.0
+    dlat = np.nanmax(np.abs(np.diff(slat_y, axis=0))) if slat_y.shape[0] > 1 else 0.0
+    in_lon = (slon_x >= lon.min() - dlon) & (slon_x <= lon.max() + dlon)
+    in_lat = (slat_y >= lat.min() - dlat) & (slat_y <= lat.max() + dlat)
+    inside = in_lon & in_lat
+    iy = np.nonzero(inside.any(axis=1))[0]
+    ix = np.nonzero(inside.any(axis=0))[0]
+
+    nx = source.sizes[xdim]
+    ny = source.sizes[ydim]
+    if ix.size == 0 or iy.size == 0:
+        # Targets are outside the source grid: keep the whole source rather than guess
+        return {xdim: slice(0, nx), ydim: slice(0, ny)}
+    return {
+        xdim: slice(max(int(ix.min()) - margin, 0), min(int(ix.max()) + margin + 1, nx)),
+        ydim: slice(max(int(iy.min()) - margin, 0), min(int(iy.max()) + margin + 1, ny)),
+    }
+
+
+def grow_window(window, margin, sizes):
+    """A window of isel slices grown by margin points on each side, within sizes."""
+    return {dim: slice(max(w.start - margin, 0), min(w.stop + margin, sizes[dim])) for dim, w in window.items()}
+
+
+def union_window(*windows):
+    """The smallest window containing each of the given windows (dicts of isel slices)."""
+    return {dim: slice(min(w[dim].start for w in windows), max(w[dim].stop for w in windows))
+            for dim in windows[0]}
+
+
+def _steps_to_ocean(valid, inner, steps):
+    """Steps between neighbouring points from the inner points of each slice to the nearest ocean point.
+
+    Args:
+        valid (numpy.ndarray <slice, y, x>): True at ocean (not missing) points.
+        inner (tuple): y and x slices of the points to start from.
+        steps (int): most steps to take.
+
+    Returns:
+        (int, numpy.ndarray): steps needed by the slices that reach ocean within `steps`,
+            and a mask of the slices that don't.
+    """
+    reached = valid.copy()
+    done = np.zeros(len(valid), dtype=bool)
+    needed = 0
+    for step in range(steps + 1):
+        now = reached[(slice(None), ) + inner].all(axis=(1, 2))
+        if (now & ~done).any():
+            needed = step
+        done |= now
+        if done.all() or step == steps:
+            break
+        grown = reached.copy()
+        grown[:, 1:] |= reached[:, :-1]
+        grown[:, :-1] |= reached[:, 1:]
+        grown[:, :, 1:] |= reached[:, :, :-1]
+        grown[:, :, :-1] |= reached[:, :, 1:]
+        reached = grown
+    return needed, ~done
+
+
+def flood_window(source, lon, lat, xdim, ydim, name=None):
+    """Smallest source window whose flood gives the same values near a set of targets as flooding all of it.
+
+    flood_kara fills each land point from its neighbours filled in earlier sweeps, so the
+    flooded value of a point only depends on the source within its distance to the nearest
+    ocean point. The window is halo_window (the points the regridding stencil reads) grown by
+    the largest such distance, counted in steps between edge neighbours, which also bounds a
+    flood through diagonal neighbours. Slices of the field (levels, times or constituents)
+    with no ocean anywhere in the source are left out, as flooding leaves them unchanged.
+    Only the mask of a growing window is read, so lazily loaded sources are not read whole.
+
+    Args:
+        source: xarray DataArray, or Dataset with the field `name`, with 'lon' and 'lat'.
+        lon: target longitudes.
+        lat: target latitudes.
+        xdim (str): name of the source x dimension.
+        ydim (str): name of the source y dimension.
+        name (str, optional): field of a Dataset source. Defaults to its only data variable (see find_datavar).
+
+    Returns:
+        dict: slices keyed by xdim and ydim, for use with isel.
+    """
+    field = source if isinstance(source, xarray.DataArray) else source[name or find_datavar(source)]
+    sizes = {xdim: source.sizes[xdim], ydim: source.sizes[ydim]}
+    inner = halo_window(source, lon, lat, xdim, ydim)
+    field = field.transpose(..., ydim, xdim)
+    shape = field.shape[:-2]
+    # Slices known to have no ocean anywhere
+    empty = np.zeros(int(np.prod(shape)), dtype=bool)
+    margin = 1
+    while True:
+        window = grow_window(inner, margin, sizes)
+        whole = all(window[dim] == slice(0, size) for dim, size in sizes.items())
+        valid = field.isel(window).notnull().values
+        valid = valid.reshape((-1, ) + valid.shape[-2:])
+        offsets = tuple(slice(inner[dim].start - window[dim].start, inner[dim].stop - window[dim].start)
+                        for dim in (ydim, xdim))
+        needed, short = _steps_to_ocean(valid[~empty], offsets, margin)
+        if not short.any():
+            return grow_window(inner, needed, sizes)
+        if whole:
+            return window
+        # Look for ocean outside the window only in the slices that didn't reach it
+        failed = np.flatnonzero(~empty)[short]
+        for index in failed:
+            empty[index] = not field[np.unravel_index(index, shape)].notnull().any()
+        if empty[failed].all():
+            return grow_window(inner, needed, sizes)
+        margin *= 2
+
+
+def _flood_constituents(da, xdim, ydim):
+    """Flooded values of a chunk of tidal constituents (see Segment._flood_tidal).
+
+    The constituents take the place of the time dimension of flood_kara.
+    """
+    return flood_missing(da, xdim=xdim, ydim=ydim, tdim='constituent').transpose(*da.dims).values
+
+
 def find_datavar(ds):
     """
     Given an xarray Dataset containing one data variable of interest
@@ -244,27 +445,45 @@ def ep2ap(SEMA, ECC, INC, PHA):
     return ua, va, up, vp
 
 
-def z_to_dz(ds, max_depth=6500.):
+def layer_thickness(z, max_depth=6500.):
+    """Given depths of layer centers, get the 1D array of layer thicknesses.
+
+    Args:
+        z: depths of layer centers.
+        max_depth: Depth of model bottom. Thickness of bottom layer will be stretched to reach this depth. 
+
+    Returns:
+        numpy.ndarray: thickness of each layer.
+    """
+    z = np.asarray(z, dtype='float64')
+    zi = 0.5 * (np.roll(z, shift=-1) + z)
+    zi[-1] = max_depth
+    # dz[0] is the depth of the first interface
+    return np.diff(zi, prepend=0.0)
+
+
+def z_to_dz(ds, max_depth=6500., dz=None):
     """Given depths of layer centers, get layer thicknesses.
     This works for output after regridding to a model boundary using xesmf.
     Derived from https://github.com/ESMG/regionalMOM6_notebooks/blob/master/creating_obc_input_files/panArctic_OBC_from_global_MOM6.ipynb
 
+    The thickness is returned as a read-only broadcast view of the 1D thicknesses,
+    so no <time, z, locations> array is materialised.
+
     Args:
         ds: xarray.DataArray or xarray.Dataset containing variables 'time', 'z', and 'locations'.
         max_depth: Depth of model bottom. Thickness of bottom layer will be stretched to reach this depth. 
+        dz (optional): Precomputed 1D thicknesses from layer_thickness, to reuse for the same vertical grid.
 
     Returns: 
         xarray.DataArray: 3D <time, z, locations> array of thicknesses. 
     """
-    zi = 0.5 * (np.roll(ds['z'], shift=-1) + ds['z'])
-    zi[-1] = max_depth
-    dz = zi - np.roll(zi, shift=1)
-    dz[0] = zi[0]
-    #nt, nz, nx = [v for k, v in ds.dims.items()]
+    if dz is None:
+        dz = layer_thickness(ds['z'].values, max_depth=max_depth)
     nt = len(ds['time'])
     nz = len(ds['z'])
     nx = len(ds['locations']) 
-    dz = np.tile(dz.data[np.newaxis, :, np.newaxis], (nt, 1, nx))
+    dz = np.broadcast_to(dz[np.newaxis, :, np.newaxis], (nt, nz, nx))
     da_dz = xarray.DataArray(
         dz,
         coords=[
@@ -278,7 +497,50 @@ def z_to_dz(ds, max_depth=6500.):
     return da_dz
 
 
+def remap_matrix(src_interfaces, dst_interfaces):
+    """Conservative vertical remapping operator between two sets of layers.
+
+    Each target layer is the thickness-weighted mean of the source layers it overlaps,
+    so vertical integrals over the full column are preserved.
+
+    Args:
+        src_interfaces: depths of the source layer interfaces, from the surface down.
+        dst_interfaces: depths of the target layer interfaces, e.g. from depths.vgrid_to_interfaces.
+
+    Returns:
+        numpy.ndarray: (target layers, source layers) weights; each row sums to 1
+            where the target layer overlaps the source column, and is 0 elsewhere.
+    """
+    src = np.asarray(src_interfaces, dtype='float64')
+    dst = np.asarray(dst_interfaces, dtype='float64')
+    top = np.maximum(dst[:-1, np.newaxis], src[np.newaxis, :-1])
+    bottom = np.minimum(dst[1:, np.newaxis], src[np.newaxis, 1:])
+    overlap = np.clip(bottom - top, 0.0, None)
+    total = overlap.sum(axis=1, keepdims=True)
+    return np.divide(overlap, total, out=np.zeros_like(overlap), where=total > 0)
+
+
+def remap_columns(values, weights, axis):
+    """Apply a remap matrix from remap_matrix along one axis of an array.
+
+    NaNs in a column are left out of the weighted mean; a target layer that only
+    overlaps NaNs is NaN.
+    """
+    values = np.moveaxis(np.asarray(values), axis, -2)
+    if np.issubdtype(values.dtype, np.floating) and np.isnan(values).any():
+        valid = ~np.isnan(values)
+        total = np.matmul(weights, valid.astype(weights.dtype))
+        remapped = np.matmul(weights, np.where(valid, values, 0.0))
+        remapped = np.divide(remapped, total, out=np.full_like(remapped, np.nan), where=total > 0)
+    else:
+        remapped = np.matmul(weights, values)
+    return np.moveaxis(remapped, -2, axis)
+
+
 def reuse_regrid(*args, **kwargs):
+    # xesmf (and ESMF) take seconds to load, so import only when a regridder is needed;
+    # modes that only concatenate or inspect files never pay for it
+    import xesmf
     filename = kwargs.pop('filename', None)
     reuse_weights = kwargs.pop('reuse_weights', False)
 
@@ -293,6 +555,58 @@ def reuse_regrid(*args, **kwargs):
         regrid = xesmf.Regridder(*args, **kwargs)
         return regrid
 
+def grid_key(source, xdim='lon', ydim='lat'):
+    """Key identifying the horizontal grid of a source field, for caching regridders.
+
+    Two fields get the same key when their lon and lat (1D or 2D, as read by xesmf) and
+    the sizes of xdim and ydim are identical, whatever their variables, times or depths.
+    Hashing lon and lat rather than xdim and ydim tells apart curvilinear grids of the
+    same shape, whose dimensions carry no coordinates.
+    """
+    key = [(source.sizes[xdim], source.sizes[ydim])]
+    for name in ('lon', 'lat'):
+        values = np.ascontiguousarray(source[name].values)
+        key.append((source[name].dims, values.shape, hashlib.sha1(values.tobytes()).hexdigest()))
+    return tuple(key)
+
+def border_strip(hgrid, border):
+    """Extract the outer row or column of the supergrid along one border.
+
+    Args:
+        hgrid (xarray.Dataset): dataset from opening ocean_hgrid.nc. Contains 'x', 'y', and 'angle_dx'.
+            May also be a strip already returned by this function or load_border_strips.
+        border (str): north, south, east, or west.
+
+    Returns:
+        xarray.Dataset: 'x', 'y' and 'angle_dx' along the border, loaded into memory.
+            If hgrid was opened lazily, only the strip is read from disk.
+    """
+    index = {'south': {'nyp': 0}, 'north': {'nyp': -1}, 'west': {'nxp': 0}, 'east': {'nxp': -1}}
+    if border not in index:
+        raise ValueError(f'Unknown border {border}. Expected north, south, east, or west.')
+    strip = hgrid[['x', 'y', 'angle_dx']]
+    if strip['x'].ndim == 1:
+        return strip.load()
+    return strip.isel(index[border]).load()
+
+
+def load_border_strips(hgrid_file, borders):
+    """Read only the outer rows and columns of a supergrid file.
+
+    Each strip is read as a hyperslab of 'x', 'y' and 'angle_dx', so startup memory and
+    time do not depend on the size of the grid interior.
+
+    Args:
+        hgrid_file (str): path to ocean_hgrid.nc.
+        borders (list): borders to read (north, south, east, and/or west).
+
+    Returns:
+        dict: strips keyed by border, each an xarray.Dataset that can be passed to Segment as hgrid.
+    """
+    with xarray.open_dataset(hgrid_file) as hgrid:
+        return {border: border_strip(hgrid, border) for border in set(borders)}
+
+
 class Segment():
     """One segment of a MOM6 open boundary.
 
@@ -300,32 +614,63 @@ class Segment():
     but here it is assumed that the segment spans an 
     entire north, south, east, or west border. 
 
+    Only the border row or column of the supergrid is kept, so memory per segment
+    scales with the length of the border rather than the area of the grid.
+    hgrid can be the full ocean_hgrid.nc dataset, or the strip for this border
+    from load_border_strips (which avoids reading the grid interior at all).
+
     Attributes:
         num (int): segment identification number following MOM6 order (1-4).
         border (str): which border of the model grid the segment represents (north, south, east, or west).
-        hgrid: (xarray.Dataset) dataset from opening ocean_hgrid.nc. Contains 'x', 'y', and 'angle_dx'.
         in_degrees: (bool): is angle_dx in hgrid in units of degrees (True) or radians (False)?
         segstr (str): string identifying the segment, used in variable and file names.
         output_dir (str): location to write data for the segment, and location to store xesmf weight files.
         regrid_dir (str): location to save xesmf Regridders. Defaults to output_dir. 
+        writer (NetCDFWriter): background writer for output files; None writes synchronously.
+        output_policy (dict): compression, chunking and precision trimming for output files (see nc_writer).
+        interfaces (numpy.ndarray): depths of the model layer interfaces (see depths.vgrid_to_interfaces).
+            If given, boundary columns are conservatively remapped onto these layers;
+            None keeps the source levels.
         coords (xarray.Dataset): segment coordinates derived from hgrid (lon, lat, angle relative to true north).
+        cos_angle (numpy.ndarray): cosine of the segment angle, precomputed for rotating velocities.
+        sin_angle (numpy.ndarray): sine of the segment angle, precomputed for rotating velocities.
         nx (int): Number of data points in the x direction.
         ny (int): Number of data points in the y direction.
     """
 
-    def __init__(self, num, border, hgrid, in_degrees=False, output_dir='.', regrid_dir=None):
+    def __init__(self, num, border, hgrid, in_degrees=False, output_dir='.', regrid_dir=None, writer=None,
+                 output_policy=None, interfaces=None):
         self.num = num
         self.border = border
-        # Need to make a copy of hgrid so that the original is not modified multiple times 
-        # when creating multiple segments
-        self.hgrid = hgrid.copy(deep=True)
+        # Keep only the border strip; the original hgrid is neither modified nor retained
+        strip = border_strip(hgrid, border)
+        angle = strip['angle_dx'].values.astype('float64')
         # Check if the angle_dx variable in ocean_hgrid has a 'units' attribute
         angle_units = hgrid['angle_dx'].attrs.get('units', None)
         # If the units attribute is degrees, or degrees were manually specified, convert to radians
         if angle_units == 'degrees' or in_degrees:
             print('Converting grid angle from degrees to radians')
-            self.hgrid['angle_dx'] = np.radians(self.hgrid['angle_dx'])
-        check_angle_range(self.hgrid['angle_dx'])
+            angle = np.radians(angle)
+        check_angle_range(angle)
+        dim = 'nxp' if border in ['south', 'north'] else 'nyp'
+        self._coords = xarray.Dataset({
+            'lon': ((dim, ), strip['x'].values, strip['x'].attrs),
+            'lat': ((dim, ), strip['y'].values, strip['y'].attrs),
+            'angle': ((dim, ), angle)
+        })
+        self.cos_angle = np.cos(angle)
+        self.sin_angle = np.sin(angle)
+        # 1D layer thicknesses, keyed by the source vertical grid
+        self._dz = {}
+        # Output encodings, keyed by file name prefix and variables
+        self._encoding = {}
+        # Regridders to this segment, keyed by method and source grid (see grid_key)
+        self._regridders = {}
+        self.interfaces = None if interfaces is None else np.asarray(interfaces, dtype='float64')
+        # Vertical remap matrices, keyed by the source vertical grid
+        self._remap = {}
+        self.writer = writer
+        self.output_policy = output_policy
         self.segstr = f'segment_{self.num:03d}'
         self.output_dir = output_dir
 
@@ -336,36 +681,13 @@ class Segment():
 
     @property
     def coords(self):
-        if self.border == 'south':
-            return xarray.Dataset({
-                'lon': self.hgrid['x'].isel(nyp=0),
-                'lat': self.hgrid['y'].isel(nyp=0),
-                'angle': self.hgrid['angle_dx'].isel(nyp=0)
-            })
-        elif self.border == 'north':
-            return xarray.Dataset({
-                'lon': self.hgrid['x'].isel(nyp=-1),
-                'lat': self.hgrid['y'].isel(nyp=-1),
-                'angle': self.hgrid['angle_dx'].isel(nyp=-1)
-            })
-        elif self.border == 'west':
-            return xarray.Dataset({
-                'lon': self.hgrid['x'].isel(nxp=0),
-                'lat': self.hgrid['y'].isel(nxp=0),
-                'angle': self.hgrid['angle_dx'].isel(nxp=0)
-            })
-        elif self.border == 'east':
-            return xarray.Dataset({
-                'lon': self.hgrid['x'].isel(nxp=-1),
-                'lat': self.hgrid['y'].isel(nxp=-1),
-                'angle': self.hgrid['angle_dx'].isel(nxp=-1)
-            })
+        return self._coords
 
     @property
     def nx(self):
         """Number of data points in the x-direction"""
         if self.border in ['south', 'north']:
-            return len(self.coords['lon'])
+            return self._coords.sizes['nxp']
         elif self.border in ['west', 'east']:
             return 1
     
@@ -375,8 +697,71 @@ class Segment():
         if self.border in ['south', 'north']:
             return 1
         elif self.border in ['west', 'east']:
-            return len(self.coords['lat'])
+            return self._coords.sizes['nyp']
     
+    def thickness(self, ds, max_depth=6500.):
+        """Layer thicknesses for a regridded <time, z, locations> dataset.
+        Computed once per source vertical grid and returned as a broadcast view (see z_to_dz).
+        """
+        if self.interfaces is not None:
+            # Columns were remapped onto the model layers (see remap_vertical)
+            key = 'interfaces'
+            if key not in self._dz:
+                self._dz[key] = np.diff(self.interfaces)
+            return z_to_dz(ds, dz=self._dz[key])
+        key = (tuple(np.asarray(ds['z'].values, dtype='float64').tolist()), max_depth)
+        if key not in self._dz:
+            self._dz[key] = layer_thickness(key[0], max_depth=max_depth)
+        return z_to_dz(ds, max_depth=max_depth, dz=self._dz[key])
+
+    def regridder(self, source, method, periodic, regrid_suffix, xdim='lon', ydim='lat'):
+        """Regridder from the grid of source to this segment.
+
+        Built on first use for each method and source grid and then reused, so every day,
+        variable and domain read from the same source grid shares its weights.
+        """
+        key = (method, periodic, grid_key(source, xdim, ydim))
+        if key not in self._regridders:
+            self._regridders[key] = reuse_regrid(
+                source,
+                self.coords,
+                method=method,
+                locstream_out=True,
+                periodic=periodic,
+                filename=path.join(self.regrid_dir, f'regrid_{self.segstr}_{regrid_suffix}.nc'),
+                reuse_weights=False
+            )
+        return self._regridders[key]
+
+    def remap_vertical(self, ds, max_depth=6500.):
+        """Conservatively remap the variables of ds with a 'z' dimension onto the layers of self.interfaces.
+
+        The source layers are bounded by the midpoints between source levels, as in layer_thickness.
+        The remap matrix is built once per source vertical grid, so each call costs one small
+        matrix product per variable.
+
+        Args:
+            ds (xarray.Dataset): Regridded boundary data on the source levels 'z' (depths of layer centers).
+            max_depth (float, optional): Depth of the bottom of the source column. Defaults to 6500.
+
+        Returns:
+            xarray.Dataset: ds with 'z' replaced by the centers of the model layers.
+        """
+        zsrc = np.asarray(ds['z'].values, dtype='float64')
+        key = (tuple(zsrc.tolist()), max_depth)
+        if key not in self._remap:
+            src_interfaces = np.concatenate([[0.0], np.cumsum(layer_thickness(zsrc, max_depth=max_depth))])
+            self._remap[key] = remap_matrix(src_interfaces, self.interfaces)
+        weights = self._remap[key]
+
+        names = [name for name in ds.data_vars if 'z' in ds[name].dims]
+        remapped = ds.drop_dims('z').assign_coords(
+            z=('z', 0.5 * (self.interfaces[1:] + self.interfaces[:-1]), ds['z'].attrs))
+        for name in names:
+            da = ds[name]
+            remapped[name] = (da.dims, remap_columns(da.values, weights, da.dims.index('z')), da.attrs)
+        return remapped
+
     def to_netcdf(self, ds, varnames, suffix=None, additional_encoding=None):
         """Write data for the segment to file.
 
@@ -384,6 +769,8 @@ class Segment():
             ds (xarray.Dataset): Segment dataset.
             varnames (str): Name to give the file (e.g. 'temp', 'salt'). 
             suffix (str, optional): Optional suffix to append to the filename (before .nc). Defaults to None.
+
+        With a writer, the file is only complete after writer.flush().
         """
         for v in ds:
             ds[v].encoding['_FillValue']= 1.0e20
@@ -430,30 +817,38 @@ class Segment():
 
         # only pass these encoding keys through to netCDF4
         allowed_keys = {
-            "_FillValue", "dtype", "zlib", "complevel",
+            "_FillValue", "dtype", "zlib", "complevel", "shuffle",
             "chunksizes", "scale_factor", "add_offset"
         }
-        enc = {}
-        # loop over each data variable + time
-        for name in list(ds.data_vars) + ['time']:
-            raw = ds[name].encoding or {}
-            # keep only the allowed keys
-            clean = {k: raw[k] for k in raw if k in allowed_keys}
-            enc[name] = clean
+        # The per-variable encoding depends only on the variables in the file, so keep it per kind
+        # of file; time and the chunk sizes depend on each dataset (e.g. its number of records)
+        key = (varnames, tuple(ds.data_vars))
+        if key not in self._encoding:
+            self._encoding[key] = {
+                name: {k: v for k, v in (ds[name].encoding or {}).items() if k in allowed_keys and k != 'chunksizes'}
+                for name in ds.data_vars
+            }
+        enc = {name: dict(e) for name, e in self._encoding[key].items()}
+        enc['time'] = {k: v for k, v in (ds['time'].encoding or {}).items() if k in allowed_keys}
+        for name in ds.data_vars:
+            chunks = ds[name].encoding.get('chunksizes')
+            if chunks is not None:
+                enc[name]['chunksizes'] = chunks
+            elif ds.sizes.get('time', 1) > 1 and 'time' in ds[name].dims:
+                # One chunk per time record, so sub-daily files are read a record at a time
+                enc[name]['chunksizes'] = record_chunks(ds[name].shape, ds[name].dims, ds[name].dtype.itemsize)
 
         # allow callers to override or add to these encodings
         if additional_encoding is not None:
             enc.update(additional_encoding)
 
-        # finally write out with the cleaned encoding dict
-        ds.to_netcdf(
-            path.join(self.output_dir, fname),
-            mode='w',
-            format='NETCDF4',
-            engine='netcdf4',
-            encoding=enc,
-            unlimited_dims='time'
-        )
+        # finally write out with the cleaned encoding dict, in the background if there is a writer
+        with stage('write'):
+            filename = path.join(self.output_dir, fname)
+            if self.writer is not None:
+                self.writer.submit(ds, filename, encoding=enc, policy=self.output_policy)
+            else:
+                write_netcdf(ds, filename, encoding=enc, policy=self.output_policy)
 
     def expand_dims(self, ds):
         """Add a length-1 dimension to the variables in a boundary dataset or array.
@@ -539,7 +934,7 @@ class Segment():
                 self, usource, vsource, 
                 method='nearest_s2d', periodic=False, write=True, 
                 flood=False, fill='b', xdim='lon', ydim='lat', zdim='z', rotate=True, 
-                time_attrs=None, time_encoding=None, **kwargs):
+                time_attrs=None, time_encoding=None, flood_margin=None, **kwargs):
         """Interpolate velocity onto segment and (optionally) write to file.
 
         Args:
@@ -553,54 +948,33 @@ class Segment():
             xdim (str, optional): Name of the horizontal x dimension, needed if flooding. Defaults to 'lon'.
             ydim (str, optional): Name of the horizontal y dimension, needed if flooding. Defaults to 'lat'.
             zdim (str, optional): Name of the vertical dimension, needed if flooding. Defaults to 'z'.
+            flood_margin (int, optional): If flooding, source points beyond the regridding stencil to flood.
+                Defaults to None, which floods the smallest window that gives the same values near
+                the segment as flooding the whole source (see flood_window), so the cost scales with
+                the segment length. A smaller margin can change values where ocean is farther away.
 
         Returns:
             xarray.Dataset: Dataset of regridded boundary data.
         """
         if flood:
-            usource = flood_missing(usource, xdim=xdim, ydim=ydim, zdim=zdim).load()
-            vsource = flood_missing(vsource, xdim=xdim, ydim=ydim, zdim=zdim).load()
+            # Flood only the part of the source the segment can reach; one window for
+            # u and v keeps their shared regridder
+            with stage('flood'):
+                window = union_window(self.flood_window(usource, xdim, ydim, flood_margin),
+                                      self.flood_window(vsource, xdim, ydim, flood_margin))
+                usource = usource.isel(window)
+                vsource = vsource.isel(window)
+                usource = flood_missing(usource, xdim=xdim, ydim=ydim, zdim=zdim).load()
+                vsource = flood_missing(vsource, xdim=xdim, ydim=ydim, zdim=zdim).load()
 
         # Horizontally interpolate velocity to MOM boundary.
 
-        uregrid = reuse_regrid(
-            usource,
-            self.coords,
-            method=method,
-            locstream_out=True,
-            periodic=periodic,
-            filename=path.join(self.regrid_dir, f'regrid_{self.segstr}_u.nc'),
-            reuse_weights=False
-        )
-        vregrid = reuse_regrid(
-            vsource,
-            self.coords,
-            method=method,
-            locstream_out=True,
-            periodic=periodic,
-            filename=path.join(self.regrid_dir, f'regrid_{self.segstr}_v.nc'),
-            reuse_weights=False
-        )
-#        uregrid = xesmf.Regridder(
-#            usource,
-#            self.coords,
-#            method=method,
-#            locstream_out=True,
-#            periodic=periodic,
-#            filename=path.join(self.regrid_dir, f'regrid_{self.segstr}_u.nc'),
-#            reuse_weights=False
-#        )
-#        vregrid = xesmf.Regridder(
-#            vsource,
-#            self.coords,
-#            method=method,
-#            locstream_out=True,
-#            periodic=periodic,
-#            filename=path.join(self.regrid_dir, f'regrid_{self.segstr}_v.nc'),
-#            reuse_weights=False
-#        )
-        udest = uregrid(usource)
-        vdest = vregrid(vsource)
+        with stage('regrid'):
+            # u and v on the same source grid share one cached regridder
+            uregrid = self.regridder(usource, method, periodic, 'u', xdim, ydim)
+            vregrid = self.regridder(vsource, method, periodic, 'v', xdim, ydim)
+            udest = uregrid(usource)
+            vdest = vregrid(vsource)
 
         # if lat and lon are variables in u/vsource, u/vdest will be dataset
         if isinstance(udest, xarray.Dataset):
@@ -608,31 +982,38 @@ class Segment():
         if isinstance(vdest, xarray.Dataset):
             vdest = vdest.to_array().squeeze()
 
-        # Rotate velocities to be model-relative.
+        # Rotate velocities to be model-relative, using the precomputed cos/sin of the angle
+        # (same as rotate_uv).
         if rotate:
             if self.border in ['south', 'north']:
                 udest = udest.rename({'nxp': 'locations'})
                 vdest = vdest.rename({'nxp': 'locations'})
-                angle = self.coords['angle'].rename({'nxp': 'locations'})
             elif self.border in ['west', 'east']:
                 udest = udest.rename({'nyp': 'locations'})
                 vdest = vdest.rename({'nyp': 'locations'})
-                angle = self.coords['angle'].rename({'nyp': 'locations'})
-            udest, vdest = rotate_uv(udest, vdest, angle)
+            with stage('rotate'):
+                cosa = xarray.DataArray(self.cos_angle, dims=['locations'])
+                sina = xarray.DataArray(self.sin_angle, dims=['locations'])
+                udest, vdest = cosa * udest + sina * vdest, -sina * udest + cosa * vdest
 
         ds_uv = xarray.Dataset({
             f'u_{self.segstr}': udest,
             f'v_{self.segstr}': vdest
         })
 
-        ds_uv = fill_missing(ds_uv, fill=fill)
+        with stage('fill'):
+            ds_uv = fill_missing(ds_uv, fill=fill, inplace=True)
 
         # Need to transpose so that time is first,
         # so that it can be the unlimited dimension
         ds_uv = ds_uv.transpose('time', 'z', 'locations')
 
-        # Add thickness
-        dz = z_to_dz(ds_uv)
+        if self.interfaces is not None:
+            with stage('vremap'):
+                ds_uv = self.remap_vertical(ds_uv)
+
+        # Add thickness; u and v share the same broadcast view
+        dz = self.thickness(ds_uv)
         ds_uv[f'dz_u_{self.segstr}'] = dz
         ds_uv[f'dz_v_{self.segstr}'] = dz
 
@@ -666,7 +1047,7 @@ class Segment():
             method='nearest_s2d', periodic=False, write=True, 
             flood=False, fill='b', xdim='lon', ydim='lat', zdim='z',
             regrid_suffix='t', source_var=None, 
-            time_attrs=None, time_encoding=None, **kwargs):
+            time_attrs=None, time_encoding=None, flood_margin=None, **kwargs):
         """Regrid a tracer onto segment and (optionally) write to file.
 
         Args:
@@ -679,6 +1060,10 @@ class Segment():
             xdim (str, optional): Name of the horizontal x dimension, needed if flooding. Defaults to 'lon'.
             ydim (str, optional): Name of the horizontal y dimension, needed if flooding. Defaults to 'lat'.
             zdim (str, optional): Name of the vertical dimension, needed if flooding. Defaults to 'z'.
+            flood_margin (int, optional): If flooding, source points beyond the regridding stencil to flood.
+                Defaults to None, which floods the smallest window that gives the same values near
+                the segment as flooding the whole source (see flood_window), so the cost scales with
+                the segment length. A smaller margin can change values where ocean is farther away.
             regrid_suffix (str, optional): Suffix to add to xesmf weight file name. Useful when regridding multiple tracers from different datasets. 
                 Defaults to 't'.
             source_var (str, optional): If tsource is a dataset, this is the variable to regrid.
@@ -687,25 +1072,25 @@ class Segment():
         Returns:
             xarray.Dataset: Dataset of regridded boundary data.
         """
+        if flood:
+            # Flood only the part of the source the segment can reach
+            with stage('flood'):
+                tsource = self.source_window(tsource, xdim, ydim, flood_margin, source_var)
         if source_var is None:
             name = tsource.name
             if flood:
-                tsource = flood_missing(tsource, xdim=xdim, ydim=ydim, zdim=zdim).load()
+                with stage('flood'):
+                    tsource = flood_missing(tsource, xdim=xdim, ydim=ydim, zdim=zdim).load()
         else:
             name =  source_var
             if flood:
-                tsource[name] = flood_missing(tsource[name], xdim=xdim, ydim=ydim, zdim=zdim).load()
-
-        regrid = reuse_regrid(
-            tsource,
-            self.coords,
-            method=method,
-            locstream_out=True,
-            periodic=periodic,
-            filename=path.join(self.regrid_dir, f'regrid_{self.segstr}_{regrid_suffix}.nc'),
-            reuse_weights=False
-        )
-        tdest = regrid(tsource)
+                with stage('flood'):
+                    tsource = tsource.copy()
+                    tsource[name] = flood_missing(tsource[name], xdim=xdim, ydim=ydim, zdim=zdim).load()
+
+        with stage('regrid'):
+            regrid = self.regridder(tsource, method, periodic, regrid_suffix, xdim, ydim)
+            tdest = regrid(tsource)
 
         if not isinstance(tdest, xarray.Dataset):
             tdest.name = name
@@ -714,19 +1099,23 @@ class Segment():
         xname = [x for x in tdest.dims][-1]
         tdest = tdest.rename({xname: 'locations'})
 
-        if 'z' in tsource.coords:
-            tdest = fill_missing(tdest, fill=fill)
-            # Need to transpose so that time is first,
-            # so that it can be the unlimited dimension
-            tdest = tdest.transpose('time', 'z', 'locations')
-            dz = z_to_dz(tdest)
-            tdest[f'dz_{name}_{self.segstr}'] = dz
-            tdest['z'] = np.arange(len(tdest['z']))
-        else:
-            tdest = fill_missing(tdest, zdim=None, fill=fill)
-            # Need to transpose so that time is first,
-            # so that it can be the unlimited dimension
-            tdest = tdest.transpose('time', 'locations')
+        with stage('fill'):
+            if 'z' in tsource.coords:
+                tdest = fill_missing(tdest, fill=fill, inplace=True)
+                # Need to transpose so that time is first,
+                # so that it can be the unlimited dimension
+                tdest = tdest.transpose('time', 'z', 'locations')
+                if self.interfaces is not None:
+                    with stage('vremap'):
+                        tdest = self.remap_vertical(tdest)
+                dz = self.thickness(tdest)
+                tdest[f'dz_{name}_{self.segstr}'] = dz
+                tdest['z'] = np.arange(len(tdest['z']))
+            else:
+                tdest = fill_missing(tdest, zdim=None, fill=fill, inplace=True)
+                # Need to transpose so that time is first,
+                # so that it can be the unlimited dimension
+                tdest = tdest.transpose('time', 'locations')
 
         tdest = self.expand_dims(tdest)
 
@@ -747,13 +1136,146 @@ class Segment():
         
         return tdest
 
+    def flood_window(self, source, xdim='lon', ydim='lat', margin=None, name=None):
+        """Window of a source field to flood for this segment.
+
+        Args:
+            source: xarray DataArray or Dataset with 'lon' and 'lat'.
+            xdim (str, optional): Name of the horizontal x dimension. Defaults to 'lon'.
+            ydim (str, optional): Name of the horizontal y dimension. Defaults to 'lat'.
+            margin (int, optional): Source points beyond the regridding stencil to include.
+                None sizes the window from the flood's reach (see flood_window), so its flood
+                gives the same values near the segment as flooding the whole source. Defaults to None.
+            name (str, optional): Field of a Dataset source. Defaults to its only data variable.
+
+        Returns:
+            dict: slices keyed by xdim and ydim, for use with isel.
+        """
+        lon, lat = self.coords['lon'].values, self.coords['lat'].values
+        if margin is None:
+            return flood_window(source, lon, lat, xdim, ydim, name)
+        return halo_window(source, lon, lat, xdim, ydim, margin)
+
+    def source_window(self, source, xdim='lon', ydim='lat', margin=None, name=None):
+        """Cut a source field to the window to flood for this segment (see flood_window).
+
+        Returns:
+            The windowed source.
+        """
+        return source.isel(self.flood_window(source, xdim, ydim, margin, name))
+
+    def _flood_tidal(self, source, xdim, ydim, margin=None, chunk=1, workers=1):
+        """Flood a tidal source over land near the segment, a few constituents at a time.
+
+        The source is first cut to the window to flood for the segment (see flood_window),
+        so the global atlas is never flooded or read whole. Constituents are flooded in
+        chunks, each written into the result as it finishes. flood_kara holds the GIL for
+        most of its work, so chunks run in parallel in worker processes, not threads.
+
+        Args:
+            source (xarray.Dataset): tidal field with one data variable plus lon and lat.
+            xdim (str): Name of the horizontal x dimension.
+            ydim (str): Name of the horizontal y dimension.
+            margin (int, optional): Source points beyond the regridding stencil to flood.
+                Defaults to None, which sizes the window from the flood's reach.
+            chunk (int, optional): Number of constituents flooded together. Defaults to 1.
+            workers (int, optional): Number of processes flooding chunks in parallel. Defaults to 1.
+
+        Returns:
+            xarray.Dataset: flooded, windowed copy of source.
+        """
+        with stage('flood'):
+            name = find_datavar(source)
+            source = self.source_window(source, xdim, ydim, margin, name).copy()
+            da = source[name]
+            axis = da.dims.index('constituent')
+            n = da.sizes['constituent']
+            chunks = [slice(i, min(i + chunk, n)) for i in range(0, n, chunk)]
+            parts = [da.isel(constituent=c) for c in chunks]
+            flooded = np.empty(da.shape, dtype='float64')
+            index = [slice(None)] * da.ndim
+
+            if workers > 1 and len(chunks) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    results = pool.map(_flood_constituents, parts, [xdim] * len(parts), [ydim] * len(parts))
+                    for c, values in zip(chunks, results):
+                        index[axis] = c
+                        flooded[tuple(index)] = values
+            else:
+                for c, part in zip(chunks, parts):
+                    index[axis] = c
+                    flooded[tuple(index)] = _flood_constituents(part, xdim, ydim)
+            source[name] = (da.dims, flooded)
+            return source
+
+    def _regrid_tidal_components(self, sources, method, periodic, regrid_suffix, xdim='nx', ydim='ny'):
+        """Regrid several tidal component datasets that share one source grid in a single pass.
+
+        The components are gathered into one dataset, and its weights are applied to every
+        component and constituent in one call; missing data is then filled for all of them
+        in one pass over a stacked array. The regridder is the segment's cached one (see
+        regridder), so elevation and velocity on the same source grid share their weights.
+
+        Args:
+            sources (list): xarray Datasets, each with one data variable plus optional lon and lat.
+            method (str): Method recognized by xesmf to use to regrid.
+            periodic (bool): Whether the source grid is periodic (passed to xesmf).
+            regrid_suffix (str): Suffix to add to xesmf weight file name.
+            xdim (str, optional): Name of the horizontal x dimension. Defaults to 'nx'.
+            ydim (str, optional): Name of the horizontal y dimension. Defaults to 'ny'.
+
+        Returns:
+            (numpy.ndarray <component, constituent, locations>, xarray.DataArray template of one component)
+        """
+        with stage('regrid'):
+            stacked = sources[0].copy()
+            keys = [find_datavar(sources[0])]
+            for i, src in enumerate(sources[1:], start=1):
+                name = find_datavar(src)
+                key = name if name not in stacked else f'{name}_{i}'
+                stacked[key] = src[name]
+                keys.append(key)
+
+            regrid = self.regridder(stacked, method, periodic, regrid_suffix, xdim, ydim)
+            dest = regrid(stacked)
+
+            xname = [x for x in dest[keys[0]].dims][-1]
+            das = [dest[k].rename({xname: 'locations'}).transpose('constituent', 'locations') for k in keys]
+            data = np.stack([da.values for da in das])
+        with stage('fill'):
+            # Fill missing data before converting to complex
+            _fill_array(data, data.ndim - 1, None, 'b', zero=False)
+        return data, das[0]
+
+    def _tidal_dataset(self, fields, template, time):
+        """Build a <time, constituent, locations> boundary dataset from tidal amplitude/phase arrays."""
+        coords = {'constituent': template['constituent']} if 'constituent' in template.coords else None
+        ds_ap = xarray.Dataset({
+            name: xarray.DataArray(values, dims=('constituent', 'locations'), coords=coords)
+            for name, values in fields.items()
+        })
+
+        # Add time coordinate and transpose so that time is first,
+        # so that it can be the unlimited dimension
+        ds_ap, _ = xarray.broadcast(ds_ap, time)
+        ds_ap = ds_ap.transpose('time', 'constituent', 'locations')
+
+        ds_ap = self.expand_dims(ds_ap)
+
+        ds_ap['lon'] = (('locations', ), self.coords['lon'].data)
+        ds_ap['lat'] = (('locations', ), self.coords['lat'].data)
+
+        return self.rename_dims(ds_ap)
+
     def regrid_tidal_elevation(
                 self, resource, imsource, time, 
                 method='nearest_s2d', periodic=False, write=True, 
-                flood=False, xdim='nx', ydim='ny', **kwargs):
+                flood=False, xdim='nx', ydim='ny',
+                flood_margin=None, constituent_chunk=1, flood_workers=1, **kwargs):
         """Regrid tidal elevation onto segment and (optionally) write to file.
         It is assumed that real (resource) and imaginary (imsource) components of the 
         constituents have the same coordinates.
+        Both components and all constituents are regridded together with one set of weights.
 
         Args:
             resource (xarray.DataArray): Real component of tidal elevation on source grid.
@@ -765,64 +1287,31 @@ class Segment():
             flood (bool, optional): As the first step of regridding, horizontally flood the source data. Defaults to False.
             xdim (str, optional): Name of the horizontal x dimension, needed if flooding. Defaults to 'nx'.
             ydim (str, optional): Name of the horizontal y dimension, needed if flooding. Defaults to 'ny'.
+            flood_margin (int, optional): If flooding, source points beyond the regridding stencil to flood.
+                Defaults to None, which floods the smallest window that gives the same values near the
+                segment as flooding the whole source (see flood_window).
+            constituent_chunk (int, optional): Number of constituents flooded at a time. Defaults to 1.
+            flood_workers (int, optional): Number of processes flooding constituent chunks. Defaults to 1.
             **kwargs: additional keyword arguments passed to Segment.to_netcdf().
 
         Returns:
             xarray.Dataset: Dataset of regridded boundary data.
         """
         if flood:
-            rename = find_datavar(resource)
-            imname = find_datavar(imsource)
-            # Don't want to do this lazily, but there is a weird dimension mismatch error 
-            # when using .compute() or .load(), so use .values.
-            # Also, use "constituent" as the time dimension.
-            resource[rename] = (resource[rename].dims, flood_missing(resource[rename], xdim=xdim, ydim=ydim, tdim='constituent').values)
-            imsource[imname] = (imsource[imname].dims, flood_missing(imsource[imname], xdim=xdim, ydim=ydim, tdim='constituent').values)
-
-        # Horizontally interpolate elevation components
-        regrid = reuse_regrid(
-            resource,
-            self.coords,
-            method=method,
-            locstream_out=True,
-            periodic=periodic,
-            filename=path.join(self.regrid_dir, f'regrid_{self.segstr}_tidal_elev.nc'),
-            reuse_weights=False
-        )
-        redest = regrid(resource)
-        imdest = regrid(imsource)
-
-        # Fill missing data.
-        # Need to do this first because complex would get converted to real
-        redest = fill_missing(redest, zdim=None)['hRe']
-        imdest = fill_missing(imdest, zdim=None)['hIm']
+            flood_kws = dict(margin=flood_margin, chunk=constituent_chunk, workers=flood_workers)
+            resource = self._flood_tidal(resource, xdim, ydim, **flood_kws)
+            imsource = self._flood_tidal(imsource, xdim, ydim, **flood_kws)
 
-        # todo: consolidate this
-        xname = [x for x in redest.dims][-1]
-        redest = redest.rename({xname: 'locations'})
-        imdest = imdest.rename({xname: 'locations'})
-
-        # Convert complex
-        cplex = redest + 1j * imdest
+        # Horizontally interpolate real and imaginary components together
+        (re, im), template = self._regrid_tidal_components(
+            [resource, imsource], method, periodic, 'tidal_elev', xdim, ydim)
 
         # Convert to real amplitude and phase.
-        ds_ap = xarray.Dataset({
-            f'zamp_{self.segstr}': np.abs(cplex)
-        })
-        # np.angle doesn't return dataarray
-        ds_ap[f'zphase_{self.segstr}'] =  (('constituent', 'locations'), -1 * np.angle(cplex))  # radians
-
-        # Add time coordinate and transpose so that time is first,
-        # so that it can be the unlimited dimension
-        ds_ap, _ = xarray.broadcast(ds_ap, time)
-        ds_ap = ds_ap.transpose('time', 'constituent', 'locations')
-
-        ds_ap = self.expand_dims(ds_ap)
-
-        ds_ap['lon'] = (('locations', ), self.coords['lon'].data)
-        ds_ap['lat'] = (('locations', ), self.coords['lat'].data)
-
-        ds_ap = self.rename_dims(ds_ap)
+        cplex = re + 1j * im
+        ds_ap = self._tidal_dataset({
+            f'zamp_{self.segstr}': np.abs(cplex),
+            f'zphase_{self.segstr}': -1 * np.angle(cplex)  # radians
+        }, template, time)
 
         if write:
             self.to_netcdf(ds_ap, 'tz', **kwargs)
@@ -832,12 +1321,15 @@ class Segment():
     def regrid_tidal_velocity(
             self, uresource, uimsource, vresource, vimsource, time, 
             method='nearest_s2d', periodic=False, write=True, 
-            flood=False, xdim='nx', ydim='ny', **kwargs):
+            flood=False, xdim='nx', ydim='ny',
+            flood_margin=None, constituent_chunk=1, flood_workers=1, **kwargs):
         """Regrid tidal velocity onto segment and (optionally) write to file.
         It is assumed that real and imaginary components of the 
         individual u or v velocities have the same coordinates, 
         but the u and v components may have separate coordinates
         [although currently they must have the same names if flooding].
+        Real and imaginary components of all constituents are regridded together,
+        with one set of weights for u and v if they share a grid.
 
         Args:
             uresource (xarray.DataArray): Real component of tidal u velocity on source grid.
@@ -851,118 +1343,59 @@ class Segment():
             flood (bool, optional): As the first step of regridding, horizontally flood the source data. Defaults to False.
             xdim (str, optional): Name of the horizontal x dimension, needed if flooding. Defaults to 'nx'.
             ydim (str, optional): Name of the horizontal y dimension, needed if flooding. Defaults to 'ny'.
+            flood_margin (int, optional): If flooding, source points beyond the regridding stencil to flood.
+                Defaults to None, which floods the smallest window that gives the same values near the
+                segment as flooding the whole source (see flood_window).
+            constituent_chunk (int, optional): Number of constituents flooded at a time. Defaults to 1.
+            flood_workers (int, optional): Number of processes flooding constituent chunks. Defaults to 1.
             **kwargs: additional keyword arguments passed to Segment.to_netcdf().
 
         Returns:
             xarray.Dataset: Dataset of regridded boundary data.
         """
-        urename = find_datavar(uresource)
-        uimname = find_datavar(uimsource)
-        vrename = find_datavar(vresource)
-        vimname = find_datavar(vimsource)
-
         if flood:
-            print('Flooding')
-            # Don't want to do this lazily, but there is a weird dimension mismatch error 
-            # when using .compute() or .load(), so use .values.
-            # Use "constituent" as the time dimension.
-            uresource[urename] = (uresource[urename].dims, flood_missing(uresource[urename], xdim=xdim, ydim=ydim, tdim='constituent').values)
-            uimsource[uimname] = (uimsource[uimname].dims, flood_missing(uimsource[uimname], xdim=xdim, ydim=ydim, tdim='constituent').values)
-            #TODO: BUG: should be vresource and vimsource 
-            vresource[vrename] = (vresource[vrename].dims, flood_missing(vresource[vrename], xdim=xdim, ydim=ydim, tdim='constituent').values)
-            vimsource[vimname] = (vimsource[vimname].dims, flood_missing(vimsource[vimname], xdim=xdim, ydim=ydim, tdim='constituent').values)
-
-        print('Setting up regridders')
-        regrid_u = reuse_regrid(
-            uresource,
-            self.coords,
-            method=method,
-            locstream_out=True,
-            periodic=periodic,
-            filename=path.join(self.regrid_dir, f'regrid_{self.segstr}_tidal_u.nc'),
-            reuse_weights=False
+            flood_kws = dict(margin=flood_margin, chunk=constituent_chunk, workers=flood_workers)
+            uresource = self._flood_tidal(uresource, xdim, ydim, **flood_kws)
+            uimsource = self._flood_tidal(uimsource, xdim, ydim, **flood_kws)
+            vresource = self._flood_tidal(vresource, xdim, ydim, **flood_kws)
+            vimsource = self._flood_tidal(vimsource, xdim, ydim, **flood_kws)
+
+        # Interpolate real and imaginary parts to segment, sharing weights where grids match
+        same_grid = all(
+            c in uresource and c in vresource and np.array_equal(uresource[c].values, vresource[c].values)
+            for c in ['lon', 'lat']
         )
-
-        regrid_v = reuse_regrid(
-            vresource,
-            self.coords,
-            method=method,
-            locstream_out=True,
-            periodic=periodic,
-            filename=path.join(
-                self.regrid_dir, f'regrid_{self.segstr}_tidal_v.nc'),
-            reuse_weights=False
-        )
-
-        print('Regridding')
-        # Interpolate each real and imaginary parts to segment.
-        uredest = regrid_u(uresource)[urename]
-        uimdest = regrid_u(uimsource)[uimname]
-        vredest = regrid_v(vresource)[vrename]
-        vimdest = regrid_v(vimsource)[vimname]
-
-        # todo: consolidate this
-        xname = [x for x in uredest.dims][-1]
-        uredest = uredest.rename({xname: 'locations'})
-        uimdest = uimdest.rename({xname: 'locations'})
-        vredest = vredest.rename({xname: 'locations'})
-        vimdest = vimdest.rename({xname: 'locations'})
-        
-        print('Refilling missing data')
-        # Fill missing data.
-        # Need to do this first because complex would get converted to real
-        uredest = fill_missing(uredest, zdim=None)
-        uimdest = fill_missing(uimdest, zdim=None)
-        vredest = fill_missing(vredest, zdim=None)
-        vimdest = fill_missing(vimdest, zdim=None)
-
-        # Convert to complex, remaining separate for u and v.
-        ucplex = uredest + 1j * uimdest
-        vcplex = vredest + 1j * vimdest
-
-        print('Rotating')
-        # Convert complex u and v to ellipse,
-        # rotate ellipse from earth-relative to model-relative,
-        # and convert ellipse back to amplitude and phase.
-        # There is probably a complicated trig identity for this? But
-        # this works too. 
-        if self.border in ['south', 'north']:
-            angle = self.coords['angle'].rename({'nxp': 'locations'})
-        elif self.border in ['west', 'east']:
-            angle = self.coords['angle'].rename({'nyp': 'locations'})
-        SEMA, ECC, INC, PHA = ap2ep(ucplex, vcplex)
-
-        # Rotate to the model grid by adjusting the inclination.
-        # Requries that angle is in radians.
-        # INC is np array but angle is xarray
-        INC -= angle.data[np.newaxis, :]
-        ua, va, up, vp = ep2ap(SEMA, ECC, INC, PHA)
-
-        ds_ap = xarray.Dataset({
-            f'uamp_{self.segstr}': ua,
-            f'vamp_{self.segstr}': va
-        })
-        # up, vp aren't dataarrays
-        ds_ap[f'uphase_{self.segstr}'] =  (('constituent', 'locations'), up)  # radians
-        ds_ap[f'vphase_{self.segstr}'] =  (('constituent', 'locations'), vp)  # radians
-
-        ds_ap, _ = xarray.broadcast(ds_ap, time)
-
-        # Need to transpose so that time is first,
-        # so that it can be the unlimited dimension
-        ds_ap = ds_ap.transpose('time', 'constituent', 'locations')
-
-        # Some things may have become missing during the transformation
-        ds_ap = fill_missing(ds_ap, zdim=None)
-
-        ds_ap = self.expand_dims(ds_ap)
-        ds_ap['lon'] = (('locations', ), self.coords['lon'].data)
-        ds_ap['lat'] = (('locations', ), self.coords['lat'].data)
-
-        ds_ap = self.rename_dims(ds_ap)
+        if same_grid:
+            (ure, uim, vre, vim), template = self._regrid_tidal_components(
+                [uresource, uimsource, vresource, vimsource], method, periodic, 'tidal_uv', xdim, ydim)
+        else:
+            (ure, uim), template = self._regrid_tidal_components(
+                [uresource, uimsource], method, periodic, 'tidal_u', xdim, ydim)
+            (vre, vim), _ = self._regrid_tidal_components(
+                [vresource, vimsource], method, periodic, 'tidal_v', xdim, ydim)
+
+        # Rotate the complex velocities from earth-relative to model-relative.
+        # Rotating the complex amplitudes as vectors is the same as converting to
+        # a tidal ellipse (ap2ep), reducing its inclination by the angle and converting
+        # back (ep2ap), but done in one pass without the intermediate ellipse arrays.
+        with stage('rotate'):
+            ucplex = ure + 1j * uim
+            vcplex = vre + 1j * vim
+            urot = self.cos_angle * ucplex + self.sin_angle * vcplex
+            vcplex *= self.cos_angle
+            vcplex -= self.sin_angle * ucplex
+            fields = np.stack([np.abs(urot), np.abs(vcplex), -np.angle(urot), -np.angle(vcplex)])
+        with stage('fill'):
+            # Some things may have become missing during the transformation
+            _fill_array(fields, fields.ndim - 1, None, 'b', zero=False)
+        ds_ap = self._tidal_dataset({
+            f'uamp_{self.segstr}': fields[0],
+            f'vamp_{self.segstr}': fields[1],
+            f'uphase_{self.segstr}': fields[2],  # radians
+            f'vphase_{self.segstr}': fields[3]  # radians
+        }, template, time)
 
         if write:
-            print('Writing')
             self.to_netcdf(ds_ap, 'tu', **kwargs)
             
         return ds_ap
@@ -0,0 +1,100 @@
+# author: 'Jing Chen'
+# description: 'Checkpoint/resume manifest for MOM6 boundary condition runs'
+# created: '2025-08-05'
+import hashlib
+import json
+import os
+from datetime import datetime
+from os import path
+
+
+def input_fingerprint(file_path):
+    """Fingerprint of an input file (or directory such as a Zarr store) from its path, size and mtime.
+    Hashing the contents of GLORYS inputs would cost as much as regridding them,
+    so a changed size or modification time is taken to mean changed data.
+    For a directory, every file below it counts (e.g. the chunks of a Zarr store).
+    """
+    st = os.stat(file_path)
+    size, mtime = st.st_size, st.st_mtime_ns
+    if path.isdir(file_path):
+        for root, _, files in os.walk(file_path):
+            for name in files:
+                est = os.stat(path.join(root, name))
+                size += est.st_size
+                mtime = max(mtime, est.st_mtime_ns)
+    key = f"{path.abspath(file_path)}:{size}:{mtime}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def file_checksum(file_path, blocksize=1 << 20):
+    """SHA-256 checksum of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RunManifest():
+    """Record of completed boundary outputs, used to resume interrupted runs.
+
+    Each completed (date, segment, variable) is stored as its own small JSON entry,
+    so concurrent jobs writing different days or segments never contend for one file
+    and a crash can at worst lose the entry being written.
+
+    Attributes:
+        root (str): directory holding the manifest entries.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _entry_path(self, date, seg_num, variable):
+        return path.join(self.root, f"{variable}_{seg_num:03d}_{date:%Y%m%d}.json")
+
+    def is_complete(self, date, seg_num, variable, inputs, output, params=None):
+        """Check whether an output was completed from the same inputs and is intact.
+
+        Args:
+            date (datetime): Day of the output.
+            seg_num (int): Segment number.
+            variable (str): Variable name ('thetao', 'uv', ...).
+            inputs (list): Input files the output was generated from.
+            output (str): Output file.
+            params (dict, optional): Settings that affect the output; a change makes it stale.
+
+        Returns:
+            bool: False if the output is missing, corrupted or stale.
+        """
+        entry_file = self._entry_path(date, seg_num, variable)
+        if not path.exists(entry_file) or not path.exists(output):
+            return False
+        try:
+            with open(entry_file, 'r') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if entry.get('params') != (params or {}):
+            return False
+        if entry.get('inputs') != {f: input_fingerprint(f) for f in inputs if path.exists(f)}:
+            return False
+        return entry.get('checksum') == file_checksum(output)
+
+    def record(self, date, seg_num, variable, inputs, output, params=None):
+        """Record a completed output, replacing any previous entry atomically."""
+        entry = {
+            'date': f"{date:%Y-%m-%d}",
+            'segment': seg_num,
+            'variable': variable,
+            'output': output,
+            'checksum': file_checksum(output),
+            'inputs': {f: input_fingerprint(f) for f in inputs if path.exists(f)},
+            'params': params or {},
+            'completed': f"{datetime.now():%Y-%m-%dT%H:%M:%S}",
+        }
+        entry_file = self._entry_path(date, seg_num, variable)
+        tmp_file = f"{entry_file}.tmp{os.getpid()}"
+        with open(tmp_file, 'w') as file:
+            json.dump(entry, file, indent=1)
+        os.replace(tmp_file, entry_file)
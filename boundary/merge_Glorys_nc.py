@@ -1,127 +1,399 @@
+#!/usr/bin/env python3
+"""
+Combine daily GLORYS PHY downloads (thetao, so, uovo and MOL sea level) into the
+GLOBAL_ANALYSISFORECAST_PHY_YYYY-MM-DD.nc files read by write_day.
+
+The lat/lon index slices are computed once per source grid and shared by every
+day in the range; days are merged in parallel worker processes.
+
+How to use
+./merge_Glorys_nc.py --config glorys_merge.yaml
+./merge_Glorys_nc.py --config glorys_merge.yaml --first_date 2024-09-26 --last_date 2024-09-28 --workers 3
+./merge_Glorys_nc.py --config glorys_merge.yaml --first_date 2024-09-26 --plot grid_spacing.png
+
+Set zarr_store in the config to append all days to one chunked Zarr store
+instead of writing one NetCDF file per day.
+"""
+
 # author: 'Jing Chen'
 # description: 'Combine GLORYS PHY fields into one NetCDF file'
 # created: '2025-08-05'
-import xarray as xr
-import numpy as np
-import matplotlib.pyplot as plt
+
+import argparse
+import glob
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 from pathlib import Path
 
-# =============================================================================
-# 1) Define file paths and geographic bounds
-# =============================================================================
-date_str   = "20240926"
-input_dir  = Path(f"/work/Jing.Chen/Glorys_ic_bc/Download/{date_str}")
-output_file = Path(
-    f"/work/Jing.Chen/Glorys_ic_bc/Glorys_merged_PHY/"
-    f"GLOBAL_ANALYSISFORECAST_PHY_{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}.nc"
-)
-
-thetao_fn = input_dir / f"glo12_rg_6h-i_{date_str}-00h_3D-thetao_hcst_R20241009.nc"
-so_fn     = input_dir / f"glo12_rg_6h-i_{date_str}-00h_3D-so_hcst_R20241009.nc"
-uovo_fn   = input_dir / f"glo12_rg_6h-i_{date_str}-00h_3D-uovo_hcst_R20241009.nc"
-ssh_fn    = input_dir / f"MOL_{date_str}_R20241009.nc"
-
-# desired coordinate bounds
-lat_bounds = (0.0, 70.0)    # degrees North
-lon_bounds = (-120.0, -20.0)  # degrees East (negative = West)
-
-# =============================================================================
-# 2) Determine integer‐index slice from thetao’s native grid
-# =============================================================================
-ds_thetao = xr.open_dataset(thetao_fn, decode_times=True, mask_and_scale=True)
-lat_vals  = ds_thetao.latitude.values
-lon_vals  = ds_thetao.longitude.values
-
-ilat0 = np.searchsorted(lat_vals, lat_bounds[0], side="left")
-ilat1 = np.searchsorted(lat_vals, lat_bounds[1], side="right")
-ilon0 = np.searchsorted(lon_vals, lon_bounds[0], side="left")
-ilon1 = np.searchsorted(lon_vals, lon_bounds[1], side="right")
-
-print(f"Latitude index slice:  {ilat0} … {ilat1-1}  → "
-      f"{lat_vals[ilat0]:.6f}° … {lat_vals[ilat1-1]:.6f}°")
-print(f"Longitude index slice: {ilon0} … {ilon1-1}  → "
-      f"{lon_vals[ilon0]:.6f}° … {lon_vals[ilon1-1]:.6f}°")
-
-# =============================================================================
-# 3) Subset thetao and capture its “true” coords
-# =============================================================================
-ds_thetao_sub = ds_thetao.isel(
-    latitude = slice(ilat0, ilat1),
-    longitude= slice(ilon0, ilon1)
-)
-lat_grid = ds_thetao_sub.latitude
-lon_grid = ds_thetao_sub.longitude
-
-# =============================================================================
-# 4) Subset + re‐assign coords for so and uovo
-# =============================================================================
-ds_so_sub = (
-    xr.open_dataset(so_fn, decode_times=True, mask_and_scale=True)
-      .isel(latitude = slice(ilat0, ilat1),
-            longitude= slice(ilon0, ilon1))
-      .assign_coords(latitude=lat_grid, longitude=lon_grid)
-)
-
-ds_uovo_sub = (
-    xr.open_dataset(uovo_fn, decode_times=True, mask_and_scale=True)
-      .isel(latitude = slice(ilat0, ilat1),
-            longitude= slice(ilon0, ilon1))
-      .assign_coords(latitude=lat_grid, longitude=lon_grid)
-)
-
-# =============================================================================
-# 5) Subset SSH: pick first time & surface depth, then assign coords & time
-# =============================================================================
-ds_ssh_raw = xr.open_dataset(ssh_fn, decode_times=False, mask_and_scale=True)
-zos = (
-    ds_ssh_raw["sea_surface_height"]
-      .isel(time=0, depth=0, drop=True)
-      .rename("zos")
-)
-ds_ssh_sub = (
-    zos.isel(latitude = slice(ilat0, ilat1),
-             longitude= slice(ilon0, ilon1))
-       .expand_dims(time=1)
-       .assign_coords(time=ds_thetao_sub.time,
-                      latitude=lat_grid,
-                      longitude=lon_grid)
-       .to_dataset()
-)
-
-# =============================================================================
-# 6) Merge and write out final NetCDF
-# =============================================================================
-ds_combined = xr.merge([
-    ds_thetao_sub,
-    ds_so_sub,
-    ds_uovo_sub,
-    ds_ssh_sub
-])
-ds_combined.to_netcdf(output_file)
-print(f"Wrote merged file → {output_file}")
-
-# =============================================================================
-# 7) Verify grid‐spacing is uniform by computing diffs and plotting
-# =============================================================================
-lat = ds_combined.latitude.values
-lon = ds_combined.longitude.values
-dlat = np.diff(lat)
-dlon = np.diff(lon)
-
-print("Unique Δlatitude:", np.unique(np.round(dlat,8)))
-print("Unique Δlongitude:", np.unique(np.round(dlon,8)))
-
-fig, (ax1, ax2) = plt.subplots(2,1, figsize=(8,6))
-ax1.scatter(np.arange(dlat.size), dlat, s=10, marker='.', color='tab:blue')
-ax1.set_ylabel('ΔLatitude (°)')
-ax1.set_title('Latitude Grid Spacing')
-ax1.grid(True)
-
-ax2.scatter(np.arange(dlon.size), dlon, s=10, marker='.', color='tab:green')
-ax2.set_xlabel('Index (between consecutive points)')
-ax2.set_ylabel('ΔLongitude (°)')
-ax2.set_title('Longitude Grid Spacing')
-ax2.grid(True)
-
-plt.tight_layout()
-plt.show()
+import numpy as np
+import xarray as xr
+import yaml
+
+# Index slices keyed by source grid, so each worker process computes them at most once.
+_SLICE_CACHE = {}
+
+# Default Zarr chunking: one time record, groups of levels, horizontal tiles.
+# Boundary strips and single levels then read only the tiles they touch.
+ZARR_CHUNKS = {'time': 1, 'depth': 10, 'latitude': 256, 'longitude': 256}
+ZARR_KEEP_ENCODING = {'dtype', '_FillValue', 'units', 'calendar', 'scale_factor', 'add_offset'}
+
+
+def load_config(config_file):
+    """Load configuration from a YAML file."""
+    with open(config_file, 'r') as file:
+        return yaml.safe_load(file)
+
+
+def find_source_files(input_dir, date_str, revision=None):
+    """Locate the four GLORYS files downloaded for one day.
+
+    Args:
+        input_dir (str): Directory holding the downloads for the day.
+        date_str (str): Date as 'YYYYMMDD'.
+        revision (str, optional): Revision suffix without the leading R (e.g. '20241009').
+            If None, the latest revision on disk is used (or the unsuffixed file).
+
+    Returns:
+        dict: paths keyed by 'thetao', 'so', 'uovo' and 'ssh'.
+    """
+    patterns = {
+        'thetao': f"glo12_rg_6h-i_{date_str}-00h_3D-thetao_hcst",
+        'so':     f"glo12_rg_6h-i_{date_str}-00h_3D-so_hcst",
+        'uovo':   f"glo12_rg_6h-i_{date_str}-00h_3D-uovo_hcst",
+        'ssh':    f"MOL_{date_str}",
+    }
+    files = {}
+    for key, stem in patterns.items():
+        if revision is not None:
+            candidates = glob.glob(str(Path(input_dir) / f"{stem}_R{revision}.nc"))
+        else:
+            candidates = glob.glob(str(Path(input_dir) / f"{stem}*.nc"))
+        if not candidates:
+            raise FileNotFoundError(f"No {key} file for {date_str} in {input_dir}")
+        # R-suffixes are dates, so the lexically last file is the latest revision
+        files[key] = Path(sorted(candidates)[-1])
+    return files
+
+
+def grid_key(ds):
+    """Cheap signature identifying a source lat/lon grid."""
+    lat = ds.latitude.values
+    lon = ds.longitude.values
+    return (lat.size, float(lat[0]), float(lat[-1]), lon.size, float(lon[0]), float(lon[-1]))
+
+
+def index_slices(lat_vals, lon_vals, lat_bounds, lon_bounds):
+    """Integer-index slices covering the requested bounds on a monotonic grid."""
+    ilat0 = np.searchsorted(lat_vals, lat_bounds[0], side="left")
+    ilat1 = np.searchsorted(lat_vals, lat_bounds[1], side="right")
+    ilon0 = np.searchsorted(lon_vals, lon_bounds[0], side="left")
+    ilon1 = np.searchsorted(lon_vals, lon_bounds[1], side="right")
+    return slice(int(ilat0), int(ilat1)), slice(int(ilon0), int(ilon1))
+
+
+def source_slices(ds, lat_bounds, lon_bounds):
+    """Return (lat slice, lon slice) for the grid of ds, computing them once per grid."""
+    key = (grid_key(ds), tuple(lat_bounds), tuple(lon_bounds))
+    if key not in _SLICE_CACHE:
+        lat_vals = ds.latitude.values
+        lon_vals = ds.longitude.values
+        lat_slice, lon_slice = index_slices(lat_vals, lon_vals, lat_bounds, lon_bounds)
+        print(f"Latitude index slice:  {lat_slice.start} … {lat_slice.stop-1}  → "
+              f"{lat_vals[lat_slice.start]:.6f}° … {lat_vals[lat_slice.stop-1]:.6f}°")
+        print(f"Longitude index slice: {lon_slice.start} … {lon_slice.stop-1}  → "
+              f"{lon_vals[lon_slice.start]:.6f}° … {lon_vals[lon_slice.stop-1]:.6f}°")
+        _SLICE_CACHE[key] = (lat_slice, lon_slice)
+    return _SLICE_CACHE[key]
+
+
+def output_path(config, date):
+    """Path of the merged file for a date, matching the name write_day expects."""
+    prefix = config.get('output_prefix', 'GLOBAL_ANALYSISFORECAST_PHY')
+    return Path(config['output_dir']) / f"{prefix}_{date:%Y-%m-%d}.nc"
+
+
+def open_merged_day(date, config, decode_times=True):
+    """Open the GLORYS files for one day as a single subset, coordinate-aligned dataset.
+
+    Nothing is read beyond coordinates; closing the returned dataset closes the sources.
+    This is also the in-memory source used by write_day and the IC writer
+    when they read the raw downloads directly.
+
+    By default only the first record of each field is kept (00h), with SSH on the time
+    axis of the 3D fields, also when the files were downloaded with --sub_daily.
+    With sub_daily: true in the config, every SSH record (hourly) is kept, as zos on its
+    own 'time_ssh' axis, next to all records of the 3D fields (6-hourly).
+
+    Args:
+        date (datetime): Day to open.
+        config (dict): Merge configuration (see glorys_merge.yaml). Only input_dir,
+            revision, lat_bounds and lon_bounds are used.
+        decode_times (bool, optional): Decode the time coordinate. Defaults to True.
+
+    Returns:
+        xarray.Dataset: Lazy dataset with thetao, so, uo, vo and zos.
+    """
+    date_str = f"{date:%Y%m%d}"
+    input_dir = config['input_dir'].format(date=date_str)
+    files = find_source_files(input_dir, date_str, config.get('revision'))
+    lat_bounds = config.get('lat_bounds', (0.0, 70.0))
+    lon_bounds = config.get('lon_bounds', (-120.0, -20.0))
+
+    ds_thetao = xr.open_dataset(files['thetao'], decode_times=decode_times, mask_and_scale=True)
+    ds_so = xr.open_dataset(files['so'], decode_times=decode_times, mask_and_scale=True)
+    ds_uovo = xr.open_dataset(files['uovo'], decode_times=decode_times, mask_and_scale=True)
+    sub_daily = config.get('sub_daily', False)
+    ds_ssh_raw = xr.open_dataset(files['ssh'], decode_times=decode_times and sub_daily, mask_and_scale=True)
+    sources = (ds_thetao, ds_so, ds_uovo, ds_ssh_raw)
+
+    lat_slice, lon_slice = source_slices(ds_thetao, lat_bounds, lon_bounds)
+
+    if not sub_daily:
+        # A daily run uses the 00h record of the 3D fields, the only one in a daily download;
+        # downloads made with --sub_daily hold all four 6-hourly records, so keep the first
+        ds_thetao, ds_so, ds_uovo = (ds.isel(time=slice(0, 1)) for ds in (ds_thetao, ds_so, ds_uovo))
+
+    # Subset thetao and capture its "true" coords
+    ds_thetao_sub = ds_thetao.isel(latitude=lat_slice, longitude=lon_slice)
+    lat_grid = ds_thetao_sub.latitude
+    lon_grid = ds_thetao_sub.longitude
+
+    # Subset + re-assign coords for so and uovo
+    ds_so_sub = (
+        ds_so.isel(latitude=lat_slice, longitude=lon_slice)
+             .assign_coords(latitude=lat_grid, longitude=lon_grid)
+    )
+    ds_uovo_sub = (
+        ds_uovo.isel(latitude=lat_slice, longitude=lon_slice)
+               .assign_coords(latitude=lat_grid, longitude=lon_grid)
+    )
+
+    if sub_daily:
+        # Keep every SSH record, on its own time axis
+        ds_ssh_sub = (
+            ds_ssh_raw["sea_surface_height"]
+              .isel(depth=0, drop=True)
+              .rename("zos")
+              .rename({'time': 'time_ssh'})
+              .isel(latitude=lat_slice, longitude=lon_slice)
+              .assign_coords(latitude=lat_grid, longitude=lon_grid)
+              .to_dataset()
+        )
+    else:
+        # Subset SSH: pick first time & surface depth, then assign coords & time
+        zos = (
+            ds_ssh_raw["sea_surface_height"]
+              .isel(time=0, depth=0, drop=True)
+              .rename("zos")
+        )
+        ds_ssh_sub = (
+            zos.isel(latitude=lat_slice, longitude=lon_slice)
+               .expand_dims(time=1)
+               .assign_coords(time=ds_thetao_sub.time,
+                              latitude=lat_grid,
+                              longitude=lon_grid)
+               .to_dataset()
+        )
+
+    ds_combined = xr.merge([ds_thetao_sub, ds_so_sub, ds_uovo_sub, ds_ssh_sub])
+    ds_combined.set_close(lambda: [ds.close() for ds in sources])
+    return ds_combined
+
+
+def merge_day(date, config):
+    """Subset and merge the GLORYS files for one day and write the merged NetCDF.
+
+    Args:
+        date (datetime): Day to merge.
+        config (dict): Merge configuration (see glorys_merge.yaml).
+
+    Returns:
+        pathlib.Path: Path of the merged file.
+    """
+    output_file = output_path(config, date)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with open_merged_day(date, config) as ds_combined:
+        ds_combined.to_netcdf(output_file)
+    print(f"Wrote merged file → {output_file}")
+    return output_file
+
+
+def append_zarr(ds, store, chunks=None):
+    """Write one day of merged data into a time-appendable Zarr store.
+
+    The first day creates the store; later days are appended along time,
+    or overwrite their own time records if the day is already in the store.
+
+    Args:
+        ds (xarray.Dataset): Merged data for one day.
+        store (str): Path of the Zarr store.
+        chunks (dict, optional): Chunk sizes by dimension name. Defaults to ZARR_CHUNKS.
+    """
+    chunks = ZARR_CHUNKS if chunks is None else chunks
+    ds = ds.chunk({k: v for k, v in chunks.items() if k in ds.dims})
+    # NetCDF storage encodings (contiguous, chunksizes, zlib, ...) do not apply to Zarr
+    for v in ds.variables:
+        ds[v].encoding = {k: val for k, val in ds[v].encoding.items() if k in ZARR_KEEP_ENCODING}
+
+    if not Path(store).exists():
+        ds.to_zarr(store, mode='w-')
+        return
+
+    with xr.open_zarr(store) as existing:
+        times = existing.time.values
+    idx = np.nonzero(np.isin(times, ds.time.values))[0]
+    if idx.size == 0:
+        ds.to_zarr(store, append_dim='time')
+    else:
+        # Rewrite the records of a day that is already in the store
+        region = ds.drop_vars([v for v in ds.variables if 'time' not in ds[v].dims])
+        region.to_zarr(store, region={'time': slice(int(idx[0]), int(idx[-1]) + 1)})
+
+
+def merge_zarr(dates, config):
+    """Merge days into the Zarr store named by config['zarr_store'].
+
+    Days are appended in date order by this process so that the time axis
+    stays monotonic; chunks within a day are written in parallel by dask.
+    """
+    if config.get('sub_daily'):
+        # Zarr appends along one dimension; SSH on its own time axis would not be appended
+        raise ValueError("sub_daily data cannot be appended to a Zarr store; write daily NetCDF files instead")
+    store = config['zarr_store']
+    Path(store).parent.mkdir(parents=True, exist_ok=True)
+    for date in dates:
+        with open_merged_day(date, config) as ds_combined:
+            append_zarr(ds_combined, store, config.get('zarr_chunks'))
+        stamp = zarr_day_stamp(store, date)
+        stamp.parent.mkdir(exist_ok=True)
+        stamp.write_text(f"{datetime.now():%Y-%m-%dT%H:%M:%S.%f}\n")
+        print(f"Appended {date:%Y-%m-%d} → {store}")
+    return [Path(store)]
+
+
+def zarr_day_stamp(store, date):
+    """Stamp file rewritten by merge_zarr each time a day is merged into the store.
+
+    Appends have no file per day, so run_cycle tracks this stamp as the output
+    of the day's merge task. Run manifests fingerprint this file instead of the
+    whole store, so appending later days does not make the outputs of earlier
+    days look stale.
+    """
+    return Path(store) / '.merged' / f"{date:%Y-%m-%d}"
+
+
+def open_zarr_day(store, date, decode_times=False):
+    """Select one day from a merged Zarr store.
+
+    Args:
+        store: Path of the store, or a dataset already opened with xarray.open_zarr.
+        date (datetime): Day to select.
+        decode_times (bool, optional): Passed to xarray.open_zarr when store is a path.
+
+    Returns:
+        xarray.Dataset: Lazy dataset holding the time records of that day.
+    """
+    if not isinstance(store, xr.Dataset):
+        store = xr.open_zarr(store, decode_times=decode_times)
+    # Decode a copy of the time axis only, so raw time values and encoding are kept
+    times = xr.decode_cf(store[['time']]).time.values
+    day = np.datetime64(f"{date:%Y-%m-%d}", 'D')
+    idx = np.nonzero(times.astype('datetime64[D]') == day)[0]
+    if idx.size == 0:
+        raise KeyError(f"{date:%Y-%m-%d} is not in the Zarr store")
+    return store.isel(time=slice(int(idx[0]), int(idx[-1]) + 1))
+
+
+def merge_range(first_date, last_date, config, workers=1):
+    """Merge every day from first_date to last_date (inclusive).
+
+    Args:
+        first_date (datetime): First day to merge.
+        last_date (datetime): Last day to merge.
+        config (dict): Merge configuration.
+        workers (int, optional): Number of worker processes. Defaults to 1.
+            Ignored when writing to a Zarr store.
+
+    Returns:
+        list: Paths of the merged files, in date order (or the Zarr store).
+    """
+    dates = [first_date + timedelta(days=i) for i in range((last_date - first_date).days + 1)]
+    if config.get('zarr_store'):
+        return merge_zarr(dates, config)
+    if workers <= 1 or len(dates) == 1:
+        return [merge_day(date, config) for date in dates]
+    with ProcessPoolExecutor(max_workers=min(workers, len(dates))) as pool:
+        return list(pool.map(merge_day, dates, [config] * len(dates)))
+
+
+def plot_grid_spacing(merged_file, plot_file=None):
+    """Check that grid spacing is uniform by computing diffs and plotting them.
+
+    matplotlib is imported here so batch merges do not need it.
+
+    Args:
+        merged_file (str): Merged NetCDF file to inspect.
+        plot_file (str, optional): Save the figure here instead of showing it.
+    """
+    with xr.open_dataset(merged_file) as ds:
+        lat = ds.latitude.values
+        lon = ds.longitude.values
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+
+    print("Unique Δlatitude:", np.unique(np.round(dlat, 8)))
+    print("Unique Δlongitude:", np.unique(np.round(dlon, 8)))
+
+    import matplotlib
+    if plot_file is not None:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(8, 6))
+    ax1.scatter(np.arange(dlat.size), dlat, s=10, marker='.', color='tab:blue')
+    ax1.set_ylabel('ΔLatitude (°)')
+    ax1.set_title('Latitude Grid Spacing')
+    ax1.grid(True)
+
+    ax2.scatter(np.arange(dlon.size), dlon, s=10, marker='.', color='tab:green')
+    ax2.set_xlabel('Index (between consecutive points)')
+    ax2.set_ylabel('ΔLongitude (°)')
+    ax2.set_title('Longitude Grid Spacing')
+    ax2.grid(True)
+
+    plt.tight_layout()
+    if plot_file is not None:
+        fig.savefig(plot_file)
+        print(f"Saved grid spacing plot → {plot_file}")
+    else:
+        plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge GLORYS PHY downloads into daily files for write_day")
+    parser.add_argument('--config', type=str, default='glorys_merge.yaml', help="Path to the YAML configuration file")
+    parser.add_argument('--first_date', type=str, help="First day to merge (YYYY-MM-DD). Defaults to first_date in the config")
+    parser.add_argument('--last_date', type=str, help="Last day to merge (YYYY-MM-DD). Defaults to first_date")
+    parser.add_argument('--workers', type=int, help="Number of worker processes. Defaults to workers in the config, or 1")
+    parser.add_argument('--plot', nargs='?', const='', default=None,
+                        help="Plot grid spacing of the first merged file; optionally save to the given path")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+
+    first = args.first_date or config.get('first_date')
+    if first is None:
+        parser.error('Specify --first_date or set first_date in the config.')
+    last = args.last_date or (config.get('last_date') if args.first_date is None else None) or first
+    first_date = datetime.strptime(str(first), '%Y-%m-%d')
+    last_date = datetime.strptime(str(last), '%Y-%m-%d')
+    workers = args.workers or config.get('workers', 1)
+
+    merged = merge_range(first_date, last_date, config, workers=workers)
+
+    if args.plot is not None and merged and not config.get('zarr_store'):
+        plot_grid_spacing(merged[0], args.plot or None)
+
+
+if __name__ == '__main__':
+    main()
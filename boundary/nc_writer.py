@@ -0,0 +1,224 @@
+# author: 'Jing Chen'
+# description: 'NetCDF output for MOM6 boundary and initial conditions: compression policy and background writer'
+# created: '2025-08-05'
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from profiling import stage
+
+# Compression and chunking applied when a config has an output_policy section;
+# its keys override these, and 'variables' holds per-variable overrides.
+DEFAULT_POLICY = {
+    'complevel': 4,        # zlib level, 0 disables compression
+    'shuffle': True,       # byte shuffle before compressing
+    'keepbits': None,      # mantissa bits kept for lossy precision trimming (None keeps all)
+    'record_dim': 'time',  # one chunk per record of this dimension
+    'max_chunk_mb': 64,    # largest chunk; bigger records are split along their leading dimensions
+    'variables': {},
+}
+
+
+def is_geometry(name):
+    """True for the segment coordinates and layer thicknesses (dz_*), which define the
+    geometry of a boundary and are always written at full precision, whatever keepbits is.
+    """
+    base = name.split('_segment_')[0]
+    return base in ('lon', 'lat') or base.startswith('dz_')
+
+
+def load_output_policy(config):
+    """Output policy from the output_policy section of a config, or None if it has none."""
+    if not config.get('output_policy'):
+        return None
+    policy = dict(DEFAULT_POLICY)
+    policy.update(config['output_policy'])
+    policy['variables'] = policy.get('variables') or {}
+    return policy
+
+
+def trim_precision(values, keepbits):
+    """Round floating point values to keepbits mantissa bits.
+
+    The discarded bits become zeros, which zlib compresses very well.
+    NaNs are left as they are; other dtypes are returned unchanged.
+    """
+    values = np.asarray(values)
+    if values.dtype == np.float32:
+        nbits, uint = 23, np.uint32
+    elif values.dtype == np.float64:
+        nbits, uint = 52, np.uint64
+    else:
+        return values
+    if keepbits is None or keepbits >= nbits:
+        return values
+    drop = nbits - keepbits
+    bits = np.ascontiguousarray(values).view(uint).copy()
+    # round half up, then clear the dropped bits
+    bits += uint(1 << (drop - 1))
+    bits &= ~uint((1 << drop) - 1)
+    trimmed = bits.view(values.dtype)
+    nan = np.isnan(values)
+    trimmed[nan] = values[nan]
+    return trimmed
+
+
+def record_chunks(shape, dims, itemsize, record_dim='time', max_chunk_mb=64):
+    """Chunk shape holding one record of record_dim, so that reading a time level
+    (as MOM6 does for each boundary update) decompresses exactly one chunk.
+
+    Records larger than max_chunk_mb are split along their leading dimensions.
+    """
+    chunks = [1 if dim == record_dim else size for dim, size in zip(dims, shape)]
+    max_items = max(1, int(max_chunk_mb * 2**20 / itemsize))
+    for i, dim in enumerate(dims):
+        if dim == record_dim:
+            continue
+        items = int(np.prod(chunks))
+        if items <= max_items:
+            break
+        chunks[i] = max(1, (chunks[i] * max_items) // items)
+    return tuple(chunks)
+
+
+def apply_output_policy(ds, encoding, policy):
+    """Apply an output policy to a dataset about to be written.
+
+    Adds zlib compression, shuffle and per-record chunks to the encoding of each data
+    variable, and trims the precision of the physical fields with keepbits set
+    (never the segment coordinates or thicknesses, see is_geometry).
+
+    Args:
+        ds (xarray.Dataset): Dataset to write.
+        encoding (dict): Per-variable encoding; updated entries are copies.
+        policy (dict): Output policy (see DEFAULT_POLICY).
+
+    Returns:
+        (xarray.Dataset, dict): dataset and encoding to write.
+    """
+    encoding = dict(encoding or {})
+    for name in ds.data_vars:
+        da = ds[name]
+        # Boundary variables carry a _segment_NNN suffix that overrides do not need to repeat
+        settings = dict(policy)
+        settings.update(policy['variables'].get(name.split('_segment_')[0], {}))
+        settings.update(policy['variables'].get(name, {}))
+        if (settings.get('keepbits') is not None and np.issubdtype(da.dtype, np.floating)
+                and not is_geometry(name)):
+            ds = ds.assign({name: da.copy(data=trim_precision(da.values, settings['keepbits']))})
+        if settings['complevel'] and da.ndim > 0:
+            enc = dict(encoding.get(name, {}))
+            enc.update(
+                zlib=True,
+                complevel=settings['complevel'],
+                shuffle=settings['shuffle'],
+                chunksizes=record_chunks(da.shape, da.dims, da.dtype.itemsize,
+                                         settings['record_dim'], settings['max_chunk_mb'])
+            )
+            encoding[name] = enc
+    return ds, encoding
+
+
+def write_netcdf(ds, filename, encoding=None, fmt='NETCDF4', policy=None):
+    """Write a boundary dataset, first to a temporary file that is renamed into place,
+    so readers (and the run manifest) never see a partially written file.
+
+    Args:
+        ds (xarray.Dataset): Dataset to write, already loaded into memory.
+        filename (str): Output file.
+        encoding (dict, optional): Per-variable encoding passed to xarray.
+        fmt (str, optional): NetCDF format. Defaults to 'NETCDF4'.
+        policy (dict, optional): Compression/chunking policy (NETCDF4 formats only).
+    """
+    with stage('netcdf'):
+        if policy is not None:
+            ds, encoding = apply_output_policy(ds, encoding, policy)
+        tmp_file = f"{filename}.tmp{os.getpid()}-{threading.get_ident()}"
+        ds.to_netcdf(
+            tmp_file,
+            mode='w',
+            format=fmt,
+            engine='netcdf4',
+            encoding=encoding,
+            unlimited_dims='time'
+        )
+        os.replace(tmp_file, filename)
+    return filename
+
+
+class NetCDFWriter():
+    """Write finished segment datasets from a small pool of workers,
+    so the next variable can be regridded while the previous one is written.
+
+    submit() blocks once max_pending writes are queued or running (backpressure),
+    so finished datasets cannot pile up in memory faster than the filesystem takes them.
+    flush() waits for every submitted write and re-raises the first error; call it at
+    the end of each day before treating that day's files as complete.
+
+    Attributes:
+        workers (int): number of writer threads (or processes).
+        max_pending (int): largest number of writes queued or in progress.
+        processes (bool): write from worker processes instead of threads. netCDF4/HDF5
+            calls are serialized between threads, so processes help only when several
+            files are written at once and the datasets are cheap to pickle.
+    """
+
+    def __init__(self, workers=1, max_pending=None, processes=False):
+        self.workers = workers
+        self.max_pending = max_pending or 2 * workers
+        self.processes = processes
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self._pool = executor(max_workers=workers)
+        self._slots = threading.Semaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._futures = []
+
+    def submit(self, ds, filename, encoding=None, fmt='NETCDF4', policy=None):
+        """Queue a dataset to be written, waiting for a free slot if the queue is full."""
+        ds = ds.load()
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(write_netcdf, ds, filename, encoding, fmt, policy)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def flush(self):
+        """Wait for all submitted writes to finish.
+
+        Returns:
+            list: files written since the last flush.
+
+        Raises:
+            The first exception raised by a write, after all writes have finished.
+        """
+        with self._lock:
+            futures, self._futures = self._futures, []
+        written = []
+        error = None
+        for future in futures:
+            try:
+                written.append(future.result())
+            except Exception as err:
+                error = error or err
+        if error is not None:
+            raise error
+        return written
+
+    def close(self):
+        """Flush outstanding writes and shut down the workers."""
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,127 @@
+# author: 'Jing Chen'
+# description: 'Memory, output size and cost estimates for planning IC and OBC runs'
+# created: '2025-08-05'
+import json
+import math
+import os
+
+import numpy as np
+
+# Fraction of the float64 output size kept by zlib with shuffle (typically a third to a half for ocean data)
+COMPRESSION_RATIO = 0.4
+
+
+def nbytes(shape, itemsize=8):
+    """Bytes of an array of this shape."""
+    return int(np.prod(shape, dtype='float64')) * itemsize
+
+
+def format_bytes(size):
+    """Human readable size, e.g. '1.5 GB'."""
+    for unit in ['B', 'kB', 'MB', 'GB', 'TB']:
+        if abs(size) < 1024 or unit == 'TB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{int(size)} B"
+        size /= 1024
+
+
+def available_memory():
+    """Memory available to this job in bytes (MemAvailable on Linux, else total physical memory)."""
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def cpu_count():
+    """CPUs this process may use."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def recommend_workers(peak_per_worker, memory=None, cpus=None, headroom=0.8):
+    """Largest number of concurrent workers whose peak memory fits in headroom * memory."""
+    memory = available_memory() if memory is None else memory
+    cpus = cpu_count() if cpus is None else cpus
+    if not memory or peak_per_worker <= 0:
+        return cpus
+    return max(1, min(cpus, int(headroom * memory // peak_per_worker)))
+
+
+def recommend_blocks(peak, memory=None, headroom=0.5):
+    """Number of blocks a computation with this peak memory should be split into to fit in headroom * memory."""
+    memory = available_memory() if memory is None else memory
+    if not memory:
+        return 1
+    return max(1, math.ceil(peak / (headroom * memory)))
+
+
+class Plan():
+    """Estimates for one run: peak memory and relative cost per stage, outputs and recommendations.
+
+    Attributes:
+        title (str): what is being planned.
+        inputs (dict): dimensions read from the metadata of the inputs.
+        stages (list): per stage, name, estimated peak memory (bytes) and compute cost (points processed).
+        outputs (dict): estimated size of each kind of output file (bytes).
+        recommendations (dict): suggested settings.
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.inputs = {}
+        self.stages = []
+        self.outputs = {}
+        self.recommendations = {}
+
+    def stage(self, name, memory, cost):
+        self.stages.append({'stage': name, 'peak_memory': int(memory), 'cost': float(cost)})
+
+    @property
+    def peak_memory(self):
+        return max((s['peak_memory'] for s in self.stages), default=0)
+
+    def report(self):
+        total_cost = sum(s['cost'] for s in self.stages) or 1.0
+        return {
+            'title': self.title,
+            'inputs': self.inputs,
+            'stages': [dict(s, relative_cost=s['cost'] / total_cost) for s in self.stages],
+            'peak_memory': self.peak_memory,
+            'outputs': self.outputs,
+            'available_memory': available_memory(),
+            'cpus': cpu_count(),
+            'recommendations': self.recommendations,
+        }
+
+    def summary(self):
+        report = self.report()
+        lines = [f"Plan: {self.title}", "Inputs:"]
+        lines += [f"  {name}: {value}" for name, value in self.inputs.items()]
+        lines.append(f"{'stage':24s} {'peak memory':>14s} {'relative cost':>14s}")
+        for s in report['stages']:
+            lines.append(f"{s['stage']:24s} {format_bytes(s['peak_memory']):>14s} {s['relative_cost']:14.1%}")
+        lines.append(f"{'peak':24s} {format_bytes(report['peak_memory']):>14s}")
+        lines.append("Outputs:")
+        lines += [f"  {name}: {format_bytes(size)}" for name, size in self.outputs.items()]
+        memory = report['available_memory']
+        lines.append(f"Available: {format_bytes(memory) if memory else 'unknown'} memory, {report['cpus']} CPUs")
+        lines.append("Recommended:")
+        lines += [f"  {name}: {value}" for name, value in self.recommendations.items()]
+        return '\n'.join(lines)
+
+    def emit(self, report_file=None):
+        """Print the plan, and write it as JSON if report_file is given."""
+        print(self.summary())
+        if report_file:
+            with open(report_file, 'w') as file:
+                json.dump(self.report(), file, indent=1)
+            print(f"Plan written to {report_file}")
@@ -0,0 +1,187 @@
+# author: 'Jing Chen'
+# description: 'Per-stage wall time, CPU time and memory growth for the IC and OBC pipelines'
+# created: '2025-08-05'
+import atexit
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+# Returned by stage() when profiling is off, so a disabled stage costs one attribute check
+_NULL_STAGE = nullcontext()
+
+
+class StageProfiler():
+    """Accumulate wall time, CPU time and memory for named pipeline stages.
+
+    Stages nest: a stage opened inside another is recorded as 'outer/inner'.
+    Each thread keeps its own nesting, so stages run by writer threads are
+    recorded under their own names. CPU time is for the whole process (all threads),
+    so stages running at the same time in different threads each count the CPU time
+    of the others too. Stages of worker processes are returned with each task's result
+    (see run_profiled) and merged in under 'workers/'.
+
+    Memory is taken from the process high-water mark (the largest RSS so far), which only
+    grows: rss_growth_mb is the most a single call of the stage raised it, i.e. the memory
+    the stage needed beyond any earlier peak, and rss_high_water_mb is the mark itself at
+    the stage's exit, which includes every stage that ran before.
+
+    Attributes:
+        enabled (bool): record stages; when False, stage() does nothing.
+        stages (dict): per stage name, calls, wall and CPU seconds, and rss_growth_mb and
+            rss_high_water_mb in MB.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start = time.perf_counter()
+
+    def stage(self, name):
+        """Context manager timing the enclosed block as the stage `name`."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(name)
+        qualified = '/'.join(stack)
+        wall0, cpu0, rss0 = time.perf_counter(), time.process_time(), rss_high_water_mb()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+            stack.pop()
+            rss = rss_high_water_mb()
+            with self._lock:
+                entry = self.stages.setdefault(qualified, _new_entry())
+                entry['calls'] += 1
+                entry['wall'] += wall
+                entry['cpu'] += cpu
+                entry['rss_growth_mb'] = max(entry['rss_growth_mb'], rss - rss0)
+                entry['rss_high_water_mb'] = max(entry['rss_high_water_mb'], rss)
+
+    def reset(self):
+        """Forget all stages, e.g. those a forked worker inherited from its parent."""
+        with self._lock:
+            self.stages = {}
+        self._local = threading.local()
+
+    def take(self):
+        """Stages recorded since the last reset or take, which are then forgotten."""
+        with self._lock:
+            stages, self.stages = self.stages, {}
+        return stages
+
+    def merge(self, stages, prefix='workers/'):
+        """Add stage totals recorded in another process, under prefix.
+
+        Calls, wall and CPU time add up over workers; the memory figures are the largest of any worker.
+        """
+        with self._lock:
+            for name, other in stages.items():
+                entry = self.stages.setdefault(prefix + name, _new_entry())
+                entry['calls'] += other['calls']
+                entry['wall'] += other['wall']
+                entry['cpu'] += other['cpu']
+                for key in ('rss_growth_mb', 'rss_high_water_mb'):
+                    entry[key] = max(entry[key], other[key])
+
+    def report(self):
+        """Structured report of all stages recorded so far."""
+        with self._lock:
+            stages = {name: dict(entry) for name, entry in self.stages.items()}
+        return {
+            'command': ' '.join(sys.argv),
+            'finished': f"{datetime.now():%Y-%m-%dT%H:%M:%S}",
+            'wall': time.perf_counter() - self._start,
+            'cpu': time.process_time(),
+            'rss_high_water_mb': rss_high_water_mb(),
+            'stages': stages,
+        }
+
+    def summary(self):
+        """Table of stages, slowest first."""
+        report = self.report()
+        lines = [f"{'stage':40s} {'calls':>6s} {'wall [s]':>10s} {'cpu [s]':>10s} "
+                 f"{'RSS growth [MB]':>16s} {'RSS high-water [MB]':>20s}"]
+        for name, entry in sorted(report['stages'].items(), key=lambda item: -item[1]['wall']):
+            lines.append(f"{name:40s} {entry['calls']:6d} {entry['wall']:10.3f} {entry['cpu']:10.3f} "
+                         f"{entry['rss_growth_mb']:16.1f} {entry['rss_high_water_mb']:20.1f}")
+        lines.append(f"{'total':40s} {'':6s} {report['wall']:10.3f} {report['cpu']:10.3f} "
+                     f"{'':16s} {report['rss_high_water_mb']:20.1f}")
+        return '\n'.join(lines)
+
+    def write_report(self, report_file):
+        with open(report_file, 'w') as file:
+            json.dump(self.report(), file, indent=1)
+
+
+def _new_entry():
+    return {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'rss_growth_mb': 0.0, 'rss_high_water_mb': 0.0}
+
+
+def rss_high_water_mb():
+    """High-water mark of the resident set size of this process (the largest so far), in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+PROFILER = StageProfiler()
+
+
+def stage(name):
+    """Time a block as a stage of the shared profiler: `with stage('regrid'): ...`"""
+    return PROFILER.stage(name)
+
+
+def run_profiled(enabled, func, *args, **kwargs):
+    """Run func in a worker process, recording its stages when the parent profiles.
+
+    Submit as pool.submit(run_profiled, PROFILER.enabled, func, ...) and pass the
+    returned stages to merge_stages in the parent.
+
+    Returns:
+        (result, stages): what func returned, and the stages it recorded (empty when disabled).
+    """
+    PROFILER.enabled = enabled
+    PROFILER.reset()
+    result = func(*args, **kwargs)
+    return result, PROFILER.take()
+
+
+def merge_stages(stages):
+    """Add the stages returned by run_profiled to this process's report."""
+    if PROFILER.enabled and stages:
+        PROFILER.merge(stages)
+
+
+def enable_profiling(report_file=None):
+    """Turn on stage profiling, and print a summary (and write report_file as JSON) at exit."""
+    if PROFILER.enabled:
+        return
+    PROFILER.enabled = True
+
+    def finish():
+        print(PROFILER.summary())
+        if report_file:
+            PROFILER.write_report(report_file)
+            print(f"Profile written to {report_file}")
+
+    atexit.register(finish)
+
+
+# MOM6_PROFILE=<report.json> (or 1) profiles any script using these stages
+if os.environ.get('MOM6_PROFILE'):
+    enable_profiling(None if os.environ['MOM6_PROFILE'] == '1' else os.environ['MOM6_PROFILE'])
@@ -0,0 +1,180 @@
+# author: 'Jing Chen'
+# description: 'Source fields and grids shared between worker processes without copies'
+# created: '2025-08-05'
+import os
+import tempfile
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import xarray
+
+# Blocks and memmaps attached in this process, keyed by dataset id, oldest first (see attach)
+_ATTACHED = {}
+# Datasets kept attached per process, e.g. a day's source and a target grid
+MAX_ATTACHED = 4
+
+
+def _open_block(name):
+    """Attach to an existing shared memory block; only the creating process unlinks it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python >= 3.13
+    except TypeError:
+        pass
+    # Before 3.13, attaching registers the block with this process's resource tracker, which
+    # unlinks it (with a leak warning) when the process exits. Unregistering afterwards would
+    # also drop the creator's entry when the tracker is shared, so don't register at all.
+    register = resource_tracker.register
+
+    def register_others(resource, rtype):
+        if rtype != 'shared_memory':
+            register(resource, rtype)
+
+    resource_tracker.register = register_others
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedDataset():
+    """An xarray Dataset held once in shared memory (or memory-mapped scratch files).
+
+    The arrays of the dataset are copied one variable at a time into POSIX shared
+    memory blocks, or into .npy files under scratch_dir when given (for systems where
+    /dev/shm is small). Workers receive only the small `spec` and call attach(spec)
+    for a Dataset of zero-copy, read-only NumPy views of the same memory, so the
+    memory used does not grow with the number of workers. Memory-mapped files are
+    written to a temporary directory under scratch_dir.
+
+    Small 1D coordinates are passed in the spec itself.
+
+    Use as a context manager; the memory is released when the creating process
+    leaves it (or calls close()).
+
+    Attributes:
+        spec (dict): picklable description of the dataset, for attach().
+    """
+
+    def __init__(self, ds, scratch_dir=None):
+        self._blocks = []
+        self._files = []
+        self._dir = None
+        if scratch_dir:
+            os.makedirs(scratch_dir, exist_ok=True)
+            self._dir = tempfile.mkdtemp(prefix='mom6_shared_', dir=scratch_dir)
+        dataset_id = f"mom6_{os.getpid()}_{uuid.uuid4().hex[:12]}"
+        arrays = {}
+        inline = {}
+        try:
+            for name, var in ds.variables.items():
+                if name in ds.dims and var.ndim == 1:
+                    inline[name] = (var.dims, var.values, var.attrs, var.encoding)
+                    continue
+                arrays[name] = self._share(var, f"{dataset_id}_{len(arrays)}")
+        except Exception:
+            self.close()
+            raise
+        self.spec = {
+            'id': dataset_id,
+            'arrays': arrays,
+            'inline': inline,
+            'data_vars': list(ds.data_vars),
+            'attrs': dict(ds.attrs),
+        }
+
+    def _share(self, var, key):
+        values = np.asarray(var.values)
+        entry = {'dims': var.dims, 'shape': values.shape, 'dtype': values.dtype.str,
+                 'attrs': var.attrs, 'encoding': var.encoding}
+        if self._dir is not None:
+            filename = os.path.join(self._dir, f"{key}.npy")
+            target = np.lib.format.open_memmap(filename, mode='w+', dtype=values.dtype, shape=values.shape)
+            self._files.append(filename)
+            target[...] = values
+            target.flush()
+            del target
+            entry['file'] = filename
+        else:
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            self._blocks.append(block)
+            np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[...] = values
+            entry['block'] = block.name
+        return entry
+
+    @property
+    def nbytes(self):
+        """Bytes held in shared memory or scratch files."""
+        return sum(int(np.prod(a['shape'])) * np.dtype(a['dtype']).itemsize for a in self.spec['arrays'].values())
+
+    def close(self):
+        """Release the shared memory and scratch files (creating process only)."""
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        for filename in self._files:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        if self._dir is not None:
+            try:
+                os.rmdir(self._dir)
+            except OSError:
+                pass
+        self._blocks = []
+        self._files = []
+        self._dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(spec):
+    """Dataset of read-only zero-copy views of a SharedDataset, in any process.
+
+    The blocks of the last MAX_ATTACHED datasets stay attached in this process, so
+    repeated calls for the same dataset (e.g. one per tile) cost nothing, and workers
+    reused for the next day release the blocks of earlier days.
+    """
+    dataset_id = spec['id']
+    if dataset_id not in _ATTACHED:
+        while len(_ATTACHED) >= MAX_ATTACHED:
+            detach(next(iter(_ATTACHED)))
+        _ATTACHED[dataset_id] = {}
+    handles = _ATTACHED[dataset_id]
+
+    variables = {}
+    for name, entry in spec['arrays'].items():
+        if name not in handles:
+            if 'file' in entry:
+                handles[name] = np.load(entry['file'], mmap_mode='r')
+            else:
+                handles[name] = _open_block(entry['block'])
+        handle = handles[name]
+        if isinstance(handle, np.ndarray):
+            values = handle
+        else:
+            values = np.ndarray(entry['shape'], dtype=np.dtype(entry['dtype']), buffer=handle.buf)
+            values.flags.writeable = False
+        variables[name] = xarray.Variable(entry['dims'], values, entry['attrs'], entry['encoding'])
+    for name, (dims, values, attrs, encoding) in spec['inline'].items():
+        variables[name] = xarray.Variable(dims, values, attrs, encoding)
+
+    data_vars = {name: variables[name] for name in spec['data_vars']}
+    coords = {name: var for name, var in variables.items() if name not in data_vars}
+    return xarray.Dataset(data_vars, coords=coords, attrs=spec['attrs'])
+
+
+def detach(dataset_id):
+    """Close the blocks of a dataset attached in this process (its views must no longer be in use)."""
+    for handle in _ATTACHED.pop(dataset_id, {}).values():
+        if isinstance(handle, shared_memory.SharedMemory):
+            try:
+                handle.close()
+            except BufferError:
+                # A view is still alive; the block is unmapped when it is collected
+                pass
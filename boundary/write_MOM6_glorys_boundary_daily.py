@@ -17,6 +17,19 @@ Usage:
 1. Process single-day output:
    ./write_glorys_boundary_day.py --config config.yaml --year <YEAR> --month <MONTH> --day <DAY>
 
+   Add --resume to regenerate only outputs that the run manifest does not record as
+   complete, intact and up to date with their inputs.
+
+   Process a range of days in one run, reading the next day while the current one is regridded:
+   ./write_glorys_boundary_day.py --config config.yaml --first_date <YYYY-MM-DD> --last_date <YYYY-MM-DD> [--prefetch 1]
+
+   With a 'domains' list in the config, boundaries for several grids are generated from one read of each day.
+   With segment_workers set in the config, segments are written in that many processes,
+   which read each day from one copy in shared memory.
+
+   Estimate memory, output sizes and cost of a run without running it (add a file name to save the plan as JSON):
+   ./write_glorys_boundary_day.py --config config.yaml --first_date <YYYY-MM-DD> --last_date <YYYY-MM-DD> --plan [plan.json]
+
 2. Concatenate multiple days of results with optional timestamp adjustment:
    ./write_glorys_boundary_day.py --config config.yaml --ncrcat_years [--adjust_timestamps]
 
@@ -31,6 +44,10 @@ Run on a system with NCO tools installed, e.g., `module load nco/5.0.1` on HPC s
 
 import argparse
 import os
+import queue
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from subprocess import run
 from os import path
@@ -38,7 +55,17 @@ from os import path
 import xarray
 import numpy as np
 import yaml
-from boundary import Segment
+from boundary import Segment, load_border_strips
+from manifest import RunManifest
+from nc_writer import NetCDFWriter, load_output_policy
+from profiling import PROFILER, enable_profiling, merge_stages, run_profiled, stage
+from shared_arrays import SharedDataset, attach
+from planning import COMPRESSION_RATIO, Plan, format_bytes, recommend_workers, available_memory
+from merge_Glorys_nc import find_source_files, open_merged_day, open_zarr_day, zarr_day_stamp
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, '../initial'))
+from depths import vgrid_to_interfaces
 
 # Suppress xarray warnings
 import warnings
@@ -49,37 +76,267 @@ def load_config(config_file):
     with open(config_file, 'r') as file:
         return yaml.safe_load(file)
 
-def write_day(date, glorys_dir, segments, variables, output_prefix):
-    """Process and regrid data for a specific day."""
-    filename = f"{output_prefix}_{date.year}-{date.month:02d}-{date.day:02d}.nc"
-    file_path = path.join(glorys_dir, filename)
+def open_glorys(date, glorys_dir, output_prefix, store=None, raw=None):
+    """Open the merged GLORYS data for a day, with coordinates renamed to lat, lon and z.
+
+    Args:
+        date (datetime): Day to open.
+        glorys_dir (str): Directory of the daily merged NetCDF files.
+        output_prefix (str): Prefix of the daily merged NetCDF files.
+        store (xarray.Dataset, optional): Merged Zarr store opened with xarray.open_zarr.
+            If given, the day is read from the store instead of a daily file.
+        raw (dict, optional): Location and bounds of the raw GLORYS downloads
+            (input_dir, revision, lat_bounds, lon_bounds, as in glorys_merge.yaml).
+            If given, the four downloads are subset and aligned lazily in memory
+            instead of reading a merged file.
+
+    Returns:
+        xarray.Dataset, or None if there is no data for the day. Close it when done, to release
+        the files of the day; a day read from a store is closed with the store instead.
+    """
+    if raw is not None:
+        try:
+            glorys = open_merged_day(date, raw, decode_times=False)
+        except FileNotFoundError as err:
+            print(f"{err}. Skipping.")
+            return None
+    elif store is not None:
+        try:
+            glorys = open_zarr_day(store, date)
+        except KeyError as err:
+            print(f"{err}. Skipping.")
+            return None
+    else:
+        filename = f"{output_prefix}_{date.year}-{date.month:02d}-{date.day:02d}.nc"
+        file_path = path.join(glorys_dir, filename)
+
+        if not path.exists(file_path):
+            print(f"File does not exist: {file_path}. Skipping.")
+            return None
+
+        glorys = xarray.open_dataset(file_path, decode_times=False)
+
+    renamed = glorys.rename({'latitude': 'lat', 'longitude': 'lon', 'depth': 'z'})
+    if store is None or raw is not None:
+        # Renaming drops the close callback of the files
+        renamed.set_close(glorys.close)
+    return renamed
+
+def source_inputs(date, config):
+    """Files the boundary data for a day is generated from, for the run manifest."""
+    inputs = [config['hgrid']]
+    if config.get('glorys_raw'):
+        raw = config['glorys_raw']
+        date_str = f"{date:%Y%m%d}"
+        try:
+            inputs += [str(f) for f in find_source_files(
+                raw['input_dir'].format(date=date_str), date_str, raw.get('revision')).values()]
+        except FileNotFoundError:
+            pass
+    elif config.get('glorys_zarr'):
+        # The day's own merge stamp, so appending other days to the store leaves the day up to date;
+        # stores merged before stamps were written are fingerprinted as a whole
+        stamp = zarr_day_stamp(config['glorys_zarr'], date)
+        inputs.append(str(stamp) if stamp.exists() else config['glorys_zarr'])
+    else:
+        output_prefix = config.get('_OUTPUT_PREFIX', 'GLOBAL_ANALYSISFORECAST_PHY')
+        inputs.append(path.join(config['glorys_dir'], f"{output_prefix}_{date:%Y-%m-%d}.nc"))
+    return inputs
 
-    if not path.exists(file_path):
-        print(f"File does not exist: {file_path}. Skipping.")
-        return
+def pending_jobs(date, segments, variables, manifest=None, inputs=None, resume=False):
+    """List the (segment, variable, output file) jobs still to be done for a day.
 
-    glorys = (
-        xarray.open_dataset(file_path, decode_times=False)
-        .rename({'latitude': 'lat', 'longitude': 'lon', 'depth': 'z'})
-    )
+    With resume=True, outputs that the manifest shows as complete, intact and up to
+    date with the inputs are left out.
+    """
+    suffix = f"{date:%Y%m%d}"
+    jobs = []
+    for segment in segments:
+        for variable in variables:
+            output = path.join(segment.output_dir, f"{variable}_{segment.num:03d}_{suffix}.nc")
+            if resume and manifest is not None and manifest.is_complete(
+                    date, segment.num, variable, inputs or [], output, params=manifest_params(segment)):
+                print(f"Already complete: {output}")
+            else:
+                jobs.append((segment, variable, output))
+    return jobs
+
+def source_variables(variables):
+    """GLORYS variables needed to produce the given boundary variables."""
+    names = []
+    for variable in variables:
+        names += ['uo', 'vo'] if variable == 'uv' else [variable]
+    return names
+
+def output_variables(config):
+    """Names of the boundary files written for each segment and day: the consolidated
+    file name if consolidate is set in the config, otherwise one file per variable.
+    """
+    if config.get('consolidate'):
+        return [config.get('consolidated_name', 'obc')]
+    return config['variables']
+
+def regrid_variable(segment, glorys, variable, suffix, time_attrs=None, time_encoding=None, write=True):
+    """Regrid one boundary variable ('uv' or a tracer) onto a segment.
+
+    Returns:
+        xarray.Dataset: the segment dataset, or None for an unknown variable.
+    """
+    if variable == 'uv':
+        print(f"Processing {segment.border} {variable}")
+        return segment.regrid_velocity(glorys['uo'], glorys['vo'], suffix=suffix, flood=False, write=write,
+                                       time_attrs=time_attrs, time_encoding=time_encoding )
+    elif variable in ['thetao', 'so', 'zos']:
+        print(f"Processing {segment.border} {variable}")
+        source = glorys[variable]
+        if 'time_ssh' in source.dims:
+            # Sub-daily SSH has its own (hourly) time axis
+            time_attrs, time_encoding = glorys['time_ssh'].attrs, glorys['time_ssh'].encoding
+            source = source.rename({'time_ssh': 'time'})
+        # All time records are regridded with one application of the weights
+        return segment.regrid_tracer(source, suffix=suffix, flood=False, write=write,
+                                     time_attrs=time_attrs, time_encoding=time_encoding)
+    return None
+
+def write_day(date, glorys_dir, segments, variables, output_prefix, store=None, raw=None,
+              manifest=None, inputs=None, resume=False, glorys=None, consolidate=None, jobs=None):
+    """Process and regrid data for a specific day.
+
+    With consolidate set to a file name (e.g. 'obc'), all variables of a segment are
+    written together in one file, {consolidate}_NNN_YYYYMMDD.nc, instead of one file each.
+
+    If a RunManifest is given, each completed (segment, variable) output is recorded in it
+    together with the input fingerprints; with resume=True, outputs that the manifest shows
+    as complete, intact and up to date with the inputs are not regenerated.
+    If jobs is given (as listed by pending_jobs), only those are done and the manifest
+    is not checked again.
+    If glorys is given (e.g. already read by a DayPrefetcher), it is used instead of opening the day
+    (and left open); a day opened here is closed before returning.
+    Segments with a NetCDFWriter are flushed before returning, so the day's files are complete.
+
+    Returns:
+        list: the (segment, variable, output file) jobs written.
+    """
+    inputs = inputs or []
+
+    if jobs is None:
+        jobs = pending_jobs(date, segments, [consolidate] if consolidate else variables, manifest, inputs, resume)
+    if not jobs:
+        return []
+
+    if glorys is not None:
+        return _write_jobs(date, jobs, variables, glorys, manifest, inputs, consolidate)
+    with stage('read'):
+        glorys = open_glorys(date, glorys_dir, output_prefix, store=store, raw=raw)
+    if glorys is None:
+        return []
+    with glorys:
+        return _write_jobs(date, jobs, variables, glorys, manifest, inputs, consolidate)
+
+def _write_jobs(date, jobs, variables, glorys, manifest, inputs, consolidate):
+    """Regrid and write the jobs of a day from its GLORYS data (see write_day)."""
+    suffix = f"{date:%Y%m%d}"
 
     # Capture time attributes and encoding
     time_attrs = glorys['time'].attrs if 'time' in glorys.coords else None
     time_encoding = glorys['time'].encoding if 'time' in glorys.coords else None
 
-    for segment in segments:
-        for variable in variables:
-            if variable == 'uv':
-                print(f"Processing {segment.border} {variable}")
-                segment.regrid_velocity(glorys['uo'], glorys['vo'], suffix=f"{date:%Y%m%d}", flood=False,
-                                        time_attrs=time_attrs, time_encoding=time_encoding )
-            elif variable in ['thetao', 'so', 'zos']:
-                print(f"Processing {segment.border} {variable}")
-                segment.regrid_tracer(glorys[variable], suffix=f"{date:%Y%m%d}", flood=False,
-                                      time_attrs=time_attrs, time_encoding=time_encoding)
-
-def concatenate_files(nsegments, output_dir, variables, ncrcat_names, first_date, last_date, adjust_timestamps=False):
-    """Concatenate annual files using ncrcat."""
+    done = []
+    for segment, variable, output in jobs:
+        with stage(variable):
+            if consolidate:
+                # Regrid every variable, then write them in one pass with shared coordinates
+                parts = [regrid_variable(segment, glorys, name, suffix, time_attrs, time_encoding, write=False)
+                         for name in variables]
+                parts = [part for part in parts if part is not None]
+                if not parts:
+                    continue
+                if len({part.sizes['time'] for part in parts}) > 1:
+                    raise ValueError("consolidate needs every variable on the same time axis; "
+                                     "sub-daily SSH must be written to its own file")
+                segment.to_netcdf(xarray.merge(parts, compat='override', combine_attrs='override'),
+                                  variable, suffix=suffix)
+            elif regrid_variable(segment, glorys, variable, suffix, time_attrs, time_encoding) is None:
+                continue
+            done.append((segment, variable, output))
+
+    # With a background writer the files only exist once the day's writes are flushed
+    writers = {segment.writer for segment, _, _ in done if segment.writer is not None}
+    with stage('flush'):
+        for writer in writers:
+            writer.flush()
+    if manifest is not None:
+        with stage('manifest'):
+            for segment, variable, output in done:
+                manifest.record(date, segment.num, variable, inputs, output, params=manifest_params(segment))
+    return done
+
+class DayPrefetcher():
+    """Read GLORYS days in a background thread while earlier days are regridded.
+
+    Iterating yields (date, dataset) in order, with the needed fields already loaded
+    into memory. The reader stays at most `depth` days ahead of the day being processed,
+    so at most depth + 1 days are held in memory. Days with no data yield None.
+
+    Attributes:
+        dates (list): days to read, in order.
+        open_day: function taking a date and returning a lazy dataset (or None).
+        names (list): variables to load from each day.
+        depth (int): number of days to read ahead.
+    """
+
+    def __init__(self, dates, open_day, names, depth=1):
+        self.dates = dates
+        self.open_day = open_day
+        self.names = names
+        self.depth = depth
+        self._queue = queue.Queue()
+        # One slot for the day being processed plus one per day read ahead
+        self._slots = threading.Semaphore(depth + 1)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+
+    def _read(self):
+        for date in self.dates:
+            self._slots.acquire()
+            if self._stop.is_set():
+                break
+            try:
+                with stage('read'):
+                    opened = self.open_day(date)
+                    glorys = None
+                    if opened is not None:
+                        with opened:
+                            glorys = opened[self.names].load()
+                self._queue.put((date, glorys, None))
+            except Exception as err:
+                self._queue.put((date, None, err))
+                break
+        self._queue.put(None)
+
+    def __iter__(self):
+        self._thread.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                date, glorys, err = item
+                if err is not None:
+                    raise err
+                yield date, glorys
+                # Day done: free its slot so the reader can start another
+                self._slots.release()
+        finally:
+            self._stop.set()
+            self._slots.release()
+
+def concatenate_files(nsegments, output_dir, variables, ncrcat_names, first_date, last_date, adjust_timestamps=False,
+                      segment_ids=None):
+    """Concatenate annual files using ncrcat.
+
+    segment_ids restricts the concatenation to those segments (default: 1..nsegments).
+    """
     if not ncrcat_names:
         ncrcat_names = variables[:]
 
@@ -87,7 +344,7 @@ def concatenate_files(nsegments, output_dir, variables, ncrcat_names, first_date
                  for i in range((last_date - first_date).days + 1)]
 
     for variable, var_name in zip(variables, ncrcat_names):
-        for seg_id in range(1, nsegments + 1):
+        for seg_id in (segment_ids or range(1, nsegments + 1)):
             input_files = [
                 path.join(output_dir, f"{variable}_{seg_id:03d}_{date}.nc")
                 for date in date_list
@@ -143,39 +400,363 @@ def adjust_file_timestamps(file_path):
             ds.to_netcdf(file_path)
             print(f"Timestamps adjusted for {file_path}")
 
-def process_single_day(config, year, month, day):
-    """Process data for a single day."""
+def model_interfaces(config):
+    """Interface depths of the model layers from vgrid_file, or None to keep the source levels."""
+    if not config.get('vgrid_file'):
+        return None
+    with xarray.open_dataarray(config['vgrid_file']) as vgrid:
+        return vgrid_to_interfaces(vgrid.load())
+
+def manifest_params(segment):
+    """Settings of a segment that change its outputs, recorded in the run manifest."""
+    params = {'border': segment.border}
+    if segment.interfaces is not None:
+        params['layers'] = len(segment.interfaces) - 1
+    if segment.output_policy is not None:
+        params['output_policy'] = segment.output_policy
+    return params
+
+# Keys an entry of 'domains' may set; the source, variables and writer settings are shared
+DOMAIN_KEYS = ['name', 'hgrid', 'output_dir', 'manifest_dir', 'segments', 'vgrid_file', 'output_policy',
+               'consolidate', 'consolidated_name', 'ncrcat_years', 'ncrcat_names']
+
+def domain_configs(config):
+    """Configurations of the target grids of a run.
+
+    With a 'domains' list in the config, each entry overrides the target keys (hgrid,
+    output_dir, segments, ...) of the top-level config. The GLORYS source is shared,
+    so each day is read once and regridded onto every domain. Without it, the run
+    has the single domain of the config itself.
+
+    Returns:
+        list: one configuration per domain.
+    """
+    domains = config.get('domains')
+    if not domains:
+        return [config]
+    configs = []
+    for i, domain in enumerate(domains):
+        unknown = set(domain) - set(DOMAIN_KEYS)
+        if unknown:
+            raise ValueError(f"Domain {domain.get('name', i + 1)} sets {sorted(unknown)}; "
+                             f"only {DOMAIN_KEYS} can differ between domains")
+        # Each domain keeps its own manifest, under its output_dir unless it sets manifest_dir
+        merged = {k: v for k, v in config.items() if k not in ('domains', 'manifest_dir')}
+        merged.update(domain)
+        merged.setdefault('name', f"domain{i + 1}")
+        configs.append(merged)
+    output_dirs = [path.abspath(domain['output_dir']) for domain in configs]
+    if len(set(output_dirs)) < len(output_dirs):
+        raise ValueError("Every domain needs its own output_dir")
+    return configs
+
+def consolidated_name(config):
+    """File name of consolidated outputs, or None when each variable has its own file."""
+    return config.get('consolidated_name', 'obc') if config.get('consolidate') else None
+
+def setup_run(config, segment_ids=None, resume=None):
+    """Build the segments and run manifest of every domain, and the source store, shared by every day of a run.
+
+    With write_workers > 0 in the config, all segments share a NetCDFWriter that writes
+    their files in the background (write_pending bounds the writes in flight); the caller
+    closes it. Segment workers write their own files, so with segment_workers > 0 there is none.
+    An output_policy section sets compression, chunking and precision trimming.
+    With vgrid_file set, the 3D fields are remapped onto the model layers.
+
+    Returns:
+        (domains, store, writer, resume): domains is a list of (domain config, segments, manifest);
+            writer is the NetCDFWriter, or None.
+    """
+    workers = config.get('write_workers', 1) if config.get('segment_workers', 0) == 0 else 0
+    writer = NetCDFWriter(workers, max_pending=config.get('write_pending')) if workers > 0 else None
+
+    domains = []
+    for domain in domain_configs(config):
+        seg_configs = [
+            seg_config for seg_config in domain['segments']
+            if segment_ids is None or seg_config['id'] in segment_ids
+        ]
+        if not seg_configs:
+            continue
+        # Read only the border rows/columns of the supergrid
+        strips = load_border_strips(domain['hgrid'], [seg_config['border'] for seg_config in seg_configs])
+        policy = load_output_policy(domain)
+        interfaces = model_interfaces(domain)
+        segments = [
+            Segment(seg_config['id'], seg_config['border'], strips[seg_config['border']],
+                    output_dir=domain['output_dir'], writer=writer, output_policy=policy,
+                    interfaces=interfaces)
+            for seg_config in seg_configs
+        ]
+        manifest = RunManifest(domain.get('manifest_dir', path.join(domain['output_dir'], '.manifest')))
+        domains.append((domain, segments, manifest))
+
+    # A chunked Zarr store is opened once and read chunk-aligned, instead of a file per day
+    store = xarray.open_zarr(config['glorys_zarr'], decode_times=False) if config.get('glorys_zarr') else None
+
+    if resume is None:
+        resume = config.get('resume', False)
+    return domains, store, writer, resume
+
+# Segments of a segment worker process, by (domain index, segment id), built once by init_segment_worker
+_WORKER = {}
+
+def init_segment_worker(config, segment_ids=None):
+    """Build the segments of every domain once in a segment worker process.
+
+    The worker writes its files itself (no writer threads) and never opens the source:
+    each day arrives as a shared dataset from process_date_range.
+    """
+    domains, _, _, _ = setup_run(dict(config, write_workers=0, glorys_zarr=None), segment_ids)
+    for index, (domain, segments, _) in enumerate(domains):
+        for segment in segments:
+            _WORKER[index, segment.num] = (segment, consolidated_name(domain))
+
+def write_segment_day(date, domain_index, segment_num, spec, variables):
+    """Regrid and write one segment for a day in a segment worker, reading the day from shared memory.
+
+    Returns:
+        list: the (variable, output file) pairs written, for the manifest kept by the parent.
+    """
+    segment, consolidate = _WORKER[domain_index, segment_num]
+    with stage('segment'):
+        done = write_day(date, None, [segment], variables, None, glorys=attach(spec), consolidate=consolidate)
+    return [(variable, output) for _, variable, output in done]
+
+def process_single_day(config, year, month, day, segment_ids=None, resume=None):
+    """Process data for a single day, optionally for only the segments with the given ids.
+
+    Completed outputs are recorded in a run manifest (manifest_dir in the config, by default
+    .manifest under output_dir). With resume (or resume: true in the config), outputs already
+    recorded as complete and up to date are skipped.
+    """
     specific_date = datetime(year, month, day)
-    print(f"Processing data for {specific_date}...")
+    process_date_range(config, specific_date, specific_date, segment_ids, resume, prefetch=0)
+
+def process_date_range(config, first_date, last_date, segment_ids=None, resume=None, prefetch=1):
+    """Process every day from first_date to last_date (inclusive) in one run.
+
+    Segments are built once, and the next `prefetch` days are read in a background
+    thread while the current day is regridded and written (prefetch=0 reads each day
+    just before processing it). With several domains (see domain_configs), each day
+    is read once and then regridded onto every domain.
 
+    With segment_workers > 0 in the config, segments are regridded and written in that
+    many worker processes. Each day is placed once in shared memory (or memory-mapped
+    files under shared_scratch_dir), and every worker reads it from there without a copy.
+    """
     glorys_dir = config['glorys_dir']
     output_prefix = config.get('_OUTPUT_PREFIX', 'GLOBAL_ANALYSISFORECAST_PHY')
     variables = config['variables']
-
-    hgrid = xarray.open_dataset(config['hgrid'])
-    segments = [
-        Segment(seg_config['id'], seg_config['border'], hgrid, output_dir=config['output_dir'])
-        for seg_config in config['segments']
+    raw = config.get('glorys_raw')
+
+    domains, store, writer, resume = setup_run(config, segment_ids, resume)
+    try:
+        dates = [first_date + timedelta(days=i) for i in range((last_date - first_date).days + 1)]
+        # Input files of each domain (its hgrid and the day's source), for the run manifests
+        inputs = [{date: source_inputs(date, domain) for date in dates} for domain, _, _ in domains]
+        # Outputs still to produce, per domain and day; listed once, as checking them reads every output
+        jobs = [{date: pending_jobs(date, segments, output_variables(domain), manifest, domain_inputs[date], resume)
+                 for date in dates}
+                for (domain, segments, manifest), domain_inputs in zip(domains, inputs)]
+        # Only read days that still have outputs to produce in some domain
+        dates = [date for date in dates if any(domain_jobs[date] for domain_jobs in jobs)]
+
+        def open_day(date):
+            return open_glorys(date, glorys_dir, output_prefix, store=store, raw=raw)
+
+        if prefetch > 0:
+            days = DayPrefetcher(dates, open_day, source_variables(variables), depth=prefetch)
+        elif len(domains) > 1:
+            # Read the day into memory once, rather than once per domain
+            def read_day(date):
+                with stage('read'):
+                    glorys = open_day(date)
+                    if glorys is None:
+                        return None
+                    with glorys:
+                        return glorys[source_variables(variables)].load()
+            days = ((date, read_day(date)) for date in dates)
+        else:
+            days = ((date, open_day(date)) for date in dates)
+
+        if config.get('segment_workers', 0) > 0:
+            write_days_in_workers(config, segment_ids, days, domains, inputs, jobs)
+            return
+
+        for date, glorys in days:
+            print(f"Processing data for {date}...")
+            if glorys is None:
+                continue
+            # Days read lazily (prefetch=0, one domain) hold their files open until closed
+            with glorys:
+                for (domain, segments, manifest), domain_inputs, domain_jobs in zip(domains, inputs, jobs):
+                    if len(domains) > 1:
+                        print(f"Domain {domain['name']}")
+                    write_day(date, glorys_dir, segments, variables, output_prefix,
+                              manifest=manifest, inputs=domain_inputs[date], resume=resume,
+                              glorys=glorys, consolidate=consolidated_name(domain), jobs=domain_jobs[date])
+    finally:
+        # Flush and join the background writes, also when the run fails
+        if writer is not None:
+            writer.close()
+        if store is not None:
+            store.close()
+
+def write_days_in_workers(config, segment_ids, days, domains, inputs, jobs):
+    """Write the segments of each day in a pool of segment_workers processes (see process_date_range).
+
+    The workers are started once for the run and keep their segments (and regridders)
+    from day to day. The run manifests are kept by this process, which records each
+    output as its worker finishes, and adds the stages each worker recorded to its profile.
+    """
+    variables = config['variables']
+    scratch_dir = config.get('shared_scratch_dir')
+    with ProcessPoolExecutor(config['segment_workers'], initializer=init_segment_worker,
+                             initargs=(config, segment_ids)) as pool:
+        for date, glorys in days:
+            print(f"Processing data for {date}...")
+            if glorys is None:
+                continue
+            with stage('share'), glorys:
+                shared = SharedDataset(glorys[source_variables(variables)], scratch_dir)
+            with shared:
+                futures = {}
+                for index, ((domain, segments, manifest), domain_inputs, domain_jobs) in enumerate(
+                        zip(domains, inputs, jobs)):
+                    for segment in segments:
+                        pending = [variable for job_segment, variable, _ in domain_jobs[date] if job_segment is segment]
+                        if not pending:
+                            continue
+                        # A consolidated file needs every variable; otherwise only the pending ones
+                        todo = variables if consolidated_name(domain) else pending
+                        future = pool.submit(run_profiled, PROFILER.enabled, write_segment_day, date, index, segment.num, shared.spec, todo)
+                        futures[future] = (segment, manifest, domain_inputs[date])
+                for future in as_completed(futures):
+                    segment, manifest, day_inputs = futures[future]
+                    outputs, stages = future.result()
+                    merge_stages(stages)
+                    with stage('manifest'):
+                        for variable, output in outputs:
+                            manifest.record(date, segment.num, variable, day_inputs, output,
+                                            params=manifest_params(segment))
+
+def plan_boundary(config, first_date, last_date, segment_ids=None, prefetch=1):
+    """Estimate memory, output sizes and cost of a boundary run from metadata only.
+
+    Only the dimensions of the first day's GLORYS data and of ocean_hgrid.nc are read.
+    Estimates assume float64 results and unflooded regridding of the full source,
+    as in write_day; they are meant for sizing jobs, not as exact figures.
+    Costs are in points processed (building a regridder counted as n log n in the
+    source points), so only their relative sizes are meaningful.
+
+    Returns:
+        Plan
+    """
+    variables = config['variables']
+    store = xarray.open_zarr(config['glorys_zarr'], decode_times=False) if config.get('glorys_zarr') else None
+    glorys = open_glorys(first_date, config.get('glorys_dir'), config.get('_OUTPUT_PREFIX', 'GLOBAL_ANALYSISFORECAST_PHY'),
+                         store=store, raw=config.get('glorys_raw'))
+    if glorys is None:
+        raise FileNotFoundError(f"No GLORYS data for {first_date:%Y-%m-%d}")
+    # Only metadata is needed, so the source is closed straight away
+    names = source_variables(variables)
+    sizes = dict(glorys.sizes)
+    nbytes = {name: glorys[name].nbytes for name in names}
+    glorys.close()
+    if store is not None:
+        store.close()
+    with xarray.open_dataset(config['hgrid']) as hgrid:
+        nxp, nyp = hgrid.sizes['nxp'], hgrid.sizes['nyp']
+    seg_configs = [
+        seg_config for seg_config in config['segments']
+        if segment_ids is None or seg_config['id'] in segment_ids
     ]
-
-    write_day(specific_date, glorys_dir, segments, variables, output_prefix)
+    lengths = {seg['id']: nxp if seg['border'] in ['south', 'north'] else nyp for seg in seg_configs}
+
+    nt, nz = sizes.get('time', 1), sizes['z']
+    interfaces = model_interfaces(config)
+    # Levels written to the boundary files
+    nz_out = nz if interfaces is None else len(interfaces) - 1
+    nsrc = sizes['lat'] * sizes['lon']
+    day_bytes = sum(nbytes.values())
+    field_bytes = max(nbytes.values())
+    ndays = (last_date - first_date).days + 1
+
+    # Data variables written per boundary file: uv has u, v and their thicknesses,
+    # 3D tracers the tracer and its thickness, zos a single 2D field
+    def output_bytes(variable, nloc):
+        if variable == 'uv':
+            return 4 * nt * nz_out * nloc * 8
+        if variable == 'zos':
+            return sizes.get('time_ssh', nt) * nloc * 8
+        return 2 * nt * nz_out * nloc * 8
+
+    files = {(seg_id, variable): output_bytes(variable, nloc) for seg_id, nloc in lengths.items() for variable in variables}
+    largest_file = max(files.values())
+    pending = config.get('write_pending') or 2 * max(config.get('write_workers', 1), 1)
+    # ESMF keeps the source grid centres, corners and mask while building weights
+    esmf_grid = 8 * nsrc * 8
+    held = (prefetch + 1) * day_bytes
+
+    plan = Plan(f"OBC {first_date:%Y-%m-%d} to {last_date:%Y-%m-%d}, {len(lengths)} segments, {', '.join(variables)}")
+    plan.inputs = {
+        'glorys': sizes,
+        'glorys bytes per day': format_bytes(day_bytes),
+        'hgrid': {'nyp': nyp, 'nxp': nxp},
+        'segments': {f"{seg_id:03d}": nloc for seg_id, nloc in lengths.items()},
+        'output levels': nz_out,
+        'days': ndays,
+    }
+    plan.stage('read', held, day_bytes / 4)
+    plan.stage('regrid', held + esmf_grid + 2 * field_bytes * 2 + largest_file,
+               sum(nsrc * np.log2(nsrc) + nt * nz * lengths[seg_id] for seg_id, _ in files))
+    plan.stage('fill', held + 2 * largest_file, sum(size / 8 for size in files.values()))
+    plan.stage('write', held + pending * largest_file, sum(size / 8 for size in files.values()))
+
+    per_day = sum(files.values())
+    for (seg_id, variable), size in files.items():
+        plan.outputs[f"{variable}_{seg_id:03d} per day"] = size
+    plan.outputs['all files per day'] = per_day
+    plan.outputs[f"all files for {ndays} days"] = per_day * ndays
+    if config.get('output_policy'):
+        plan.outputs[f"all files for {ndays} days, compressed (rough)"] = per_day * ndays * COMPRESSION_RATIO
+
+    memory = available_memory()
+    fits_prefetch = memory is None or 2 * day_bytes + esmf_grid + 4 * field_bytes < 0.8 * memory
+    # Segment workers share the day's source; each holds only its own regridding buffers
+    worker_peak = esmf_grid + 2 * field_bytes * 2 + largest_file
+    plan.recommendations = {
+        'prefetch': 1 if fits_prefetch else 0,
+        'write_workers': 2 if len(files) > 8 else 1,
+        'segment_workers': min(len(lengths), recommend_workers(
+            worker_peak, memory=None if memory is None else max(memory - held, worker_peak))),
+        'parallel days (run_cycle workers)': recommend_workers(plan.peak_memory),
+    }
+    return plan
 
 def concatenate_annual_files(config, adjust_timestamps):
-    """Concatenate files for the entire date range."""
+    """Concatenate files for the entire date range.
+
+    With consolidate set, the daily consolidated files of each segment are joined into one
+    file per segment for the whole range (ncrcat_names is then not used).
+    With several domains, the files of each domain are concatenated in its output_dir.
+    """
     first_date = datetime.strptime(config['first_date'], '%Y-%m-%d')
     last_date = datetime.strptime(config['last_date'], '%Y-%m-%d')
 
     print(f"Concatenating files from {first_date} to {last_date}...")
     
-    concatenate_files(
-        len(config['segments']),
-        config['output_dir'],
-        config['variables'],
-        config.get('ncrcat_names', []),
-        first_date,
-        last_date,
-        adjust_timestamps
-    )
+    for domain in domain_configs(config):
+        concatenate_files(
+            len(domain['segments']),
+            domain['output_dir'],
+            output_variables(domain),
+            [] if domain.get('consolidate') else domain.get('ncrcat_names', []),
+            first_date,
+            last_date,
+            adjust_timestamps
+        )
 
 def main():
     parser = argparse.ArgumentParser(description="Generate OBC from GLORYS")
@@ -183,18 +764,50 @@ def main():
     parser.add_argument('--year', type=int, help="Year for single-day processing")
     parser.add_argument('--month', type=int, help="Month for single-day processing")
     parser.add_argument('--day', type=int, help="Day for single-day processing")
+    parser.add_argument('--first_date', type=str, help="First day of a multi-day run (YYYY-MM-DD)")
+    parser.add_argument('--last_date', type=str, help="Last day of a multi-day run (YYYY-MM-DD). Defaults to first_date")
+    parser.add_argument('--prefetch', type=int, default=1, help="Days to read ahead in a multi-day run (0 disables)")
     parser.add_argument('--ncrcat_years', action='store_true', help="Enable annual concatenation mode")
     parser.add_argument('--adjust_timestamps', action='store_true', help="Adjust timestamps during concatenation")
+    parser.add_argument('--resume', action='store_true', help="Skip outputs the run manifest records as complete and up to date")
+    parser.add_argument('--profile', type=str, nargs='?', const='', default=None,
+                        help="Report wall/CPU time and peak memory per stage at exit (and write it to this JSON file)")
+    parser.add_argument('--plan', type=str, nargs='?', const='', default=None,
+                        help="Only estimate memory, output sizes and cost of the run from metadata "
+                             "(and write the plan to this JSON file)")
     args = parser.parse_args()
 
+    if args.profile is not None:
+        enable_profiling(args.profile or None)
+
     config = load_config(args.config)
 
-    if args.ncrcat_years:
+    if args.plan is not None:
+        if args.first_date:
+            first_date = datetime.strptime(args.first_date, '%Y-%m-%d')
+            last_date = datetime.strptime(args.last_date or args.first_date, '%Y-%m-%d')
+        elif args.year and args.month and args.day:
+            first_date = last_date = datetime(args.year, args.month, args.day)
+        else:
+            first_date = datetime.strptime(config['first_date'], '%Y-%m-%d')
+            last_date = datetime.strptime(config['last_date'], '%Y-%m-%d')
+        domains = domain_configs(config)
+        for domain in domains:
+            report_file = args.plan or None
+            if report_file and len(domains) > 1:
+                report_file = f"{path.splitext(report_file)[0]}_{domain['name']}.json"
+            plan_boundary(domain, first_date, last_date, prefetch=args.prefetch).emit(report_file)
+    elif args.ncrcat_years:
         concatenate_annual_files(config, args.adjust_timestamps)
     elif args.year and args.month and args.day:
-        process_single_day(config, args.year, args.month, args.day)
+        process_single_day(config, args.year, args.month, args.day, resume=args.resume or None)
+    elif args.first_date:
+        first_date = datetime.strptime(args.first_date, '%Y-%m-%d')
+        last_date = datetime.strptime(args.last_date or args.first_date, '%Y-%m-%d')
+        process_date_range(config, first_date, last_date, resume=args.resume or None, prefetch=args.prefetch)
     else:
-        print("Error: Specify either --ncrcat_years or a specific date (--year, --month, --day).")
+        print("Error: Specify either --ncrcat_years, a specific date (--year, --month, --day), "
+              "or a date range (--first_date, --last_date).")
 
 if __name__ == '__main__':
     main()
@@ -1,4 +1,3 @@
-import copernicusmarine as cm
 import os
 
 # ========================
@@ -15,77 +14,109 @@ lat_min, lat_max =  24,  31
 # Depth range
 depth_min, depth_max = 0, 7000
 
+
+def output_files(date_str, base_dir=base_dir):
+    """Paths of the files download_day writes for a date (yyyymmdd)."""
+    output_dir = os.path.join(base_dir, date_str)
+    return {
+        'thetao': os.path.join(output_dir, f"glo12_rg_6h-i_{date_str}-00h_3D-thetao_hcst.nc"),
+        'so':     os.path.join(output_dir, f"glo12_rg_6h-i_{date_str}-00h_3D-so_hcst.nc"),
+        'uovo':   os.path.join(output_dir, f"glo12_rg_6h-i_{date_str}-00h_3D-uovo_hcst.nc"),
+        'ssh':    os.path.join(output_dir, f"MOL_{date_str}.nc"),
+    }
+
+
+def download_day(date_str, base_dir=base_dir, sub_daily=False):
+    """Download thetao, so, currents and hourly sea level for one date (yyyymmdd).
+
+    The 3D fields are the 00h record only, unless sub_daily is set: then all four
+    6-hourly records of the day are downloaded (00h to 18h).
+    """
+    # Imported here so output_files can be used without the Copernicus toolbox installed
+    import copernicusmarine as cm
+
+    # Build datetime strings
+    hour_str = "00"
+    datetime_str = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}T{hour_str}:00:00"
+    last_str = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}T18:00:00" if sub_daily else datetime_str
+    start_day   = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}T00:00:00"
+    end_day     = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}T23:00:00"
+
+    # Make output folder for this date
+    output_dir = os.path.join(base_dir, date_str)
+    os.makedirs(output_dir, exist_ok=True)
+    files = output_files(date_str, base_dir)
+
+    # --- Temperature (thetao) ---
+    thetao_file = files['thetao']
+    if os.path.exists(thetao_file): os.remove(thetao_file)
+    cm.subset(
+        dataset_id="cmems_mod_glo_phy-thetao_anfc_0.083deg_PT6H-i",
+        variables=["thetao"],
+     #   minimum_longitude=lon_min, maximum_longitude=lon_max,
+     #   minimum_latitude=lat_min, maximum_latitude=lat_max,
+        start_datetime=datetime_str, end_datetime=last_str,
+        minimum_depth=depth_min, maximum_depth=depth_max,
+        output_filename=thetao_file,
+        force_download=True
+    )
+
+    # --- Salinity (so) ---
+    so_file = files['so']
+    if os.path.exists(so_file): os.remove(so_file)
+    cm.subset(
+        dataset_id="cmems_mod_glo_phy-so_anfc_0.083deg_PT6H-i",
+        variables=["so"],
+        #minimum_longitude=lon_min, maximum_longitude=lon_max,
+        #minimum_latitude=lat_min, maximum_latitude=lat_max,
+        start_datetime=datetime_str, end_datetime=last_str,
+        minimum_depth=depth_min, maximum_depth=depth_max,
+        output_filename=so_file,
+        force_download=True
+    )
+
+    # --- Currents (uo + vo together) ---
+    cur_file = files['uovo']
+    if os.path.exists(cur_file): os.remove(cur_file)
+    cm.subset(
+        dataset_id="cmems_mod_glo_phy-cur_anfc_0.083deg_PT6H-i",
+        variables=["uo", "vo"],
+        #minimum_longitude=lon_min, maximum_longitude=lon_max,
+        #minimum_latitude=lat_min, maximum_latitude=lat_max,
+        start_datetime=datetime_str, end_datetime=last_str,
+        minimum_depth=depth_min, maximum_depth=depth_max,
+        output_filename=cur_file,
+        force_download=True
+    )
+
+    # --- Sea level (zos, full day hourly) ---
+    zos_file = files['ssh']
+    if os.path.exists(zos_file): os.remove(zos_file)
+    cm.subset(
+        dataset_id="cmems_mod_glo_phy_anfc_merged-sl_PT1H-i",
+        variables=["sea_surface_height","total_sea_level"],
+        #minimum_longitude=lon_min, maximum_longitude=lon_max,
+        #minimum_latitude=lat_min, maximum_latitude=lat_max,
+        start_datetime=start_day, end_datetime=end_day,
+        output_filename=zos_file,
+        force_download=True
+    )
+
+    print(f"\n✅ All downloads complete for {date_str}")
+    print(f"Saved to: {output_dir}")
+    return files
+
+
 # ========================
 # Script starts
 # ========================
 
-# Ask for date input
-date_str = input("Enter date (yyyymmdd): ").strip()
-
-# Build datetime strings
-hour_str = "00"
-datetime_str = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}T{hour_str}:00:00"
-start_day   = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}T00:00:00"
-end_day     = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}T23:00:00"
-
-# Make output folder for this date
-output_dir = os.path.join(base_dir, date_str)
-os.makedirs(output_dir, exist_ok=True)
-
-# --- Temperature (thetao) ---
-thetao_file = os.path.join(output_dir, f"glo12_rg_6h-i_{date_str}-00h_3D-thetao_hcst.nc")
-if os.path.exists(thetao_file): os.remove(thetao_file)
-cm.subset(
-    dataset_id="cmems_mod_glo_phy-thetao_anfc_0.083deg_PT6H-i",
-    variables=["thetao"],
- #   minimum_longitude=lon_min, maximum_longitude=lon_max,
- #   minimum_latitude=lat_min, maximum_latitude=lat_max,
-    start_datetime=datetime_str, end_datetime=datetime_str,
-    minimum_depth=depth_min, maximum_depth=depth_max,
-    output_filename=thetao_file,
-    force_download=True
-)
-
-# --- Salinity (so) ---
-so_file = os.path.join(output_dir, f"glo12_rg_6h-i_{date_str}-00h_3D-so_hcst.nc")
-if os.path.exists(so_file): os.remove(so_file)
-cm.subset(
-    dataset_id="cmems_mod_glo_phy-so_anfc_0.083deg_PT6H-i",
-    variables=["so"],
-    #minimum_longitude=lon_min, maximum_longitude=lon_max,
-    #minimum_latitude=lat_min, maximum_latitude=lat_max,
-    start_datetime=datetime_str, end_datetime=datetime_str,
-    minimum_depth=depth_min, maximum_depth=depth_max,
-    output_filename=so_file,
-    force_download=True
-)
-
-# --- Currents (uo + vo together) ---
-cur_file = os.path.join(output_dir, f"glo12_rg_6h-i_{date_str}-00h_3D-uovo_hcst.nc")
-if os.path.exists(cur_file): os.remove(cur_file)
-cm.subset(
-    dataset_id="cmems_mod_glo_phy-cur_anfc_0.083deg_PT6H-i",
-    variables=["uo", "vo"],
-    #minimum_longitude=lon_min, maximum_longitude=lon_max,
-    #minimum_latitude=lat_min, maximum_latitude=lat_max,
-    start_datetime=datetime_str, end_datetime=datetime_str,
-    minimum_depth=depth_min, maximum_depth=depth_max,
-    output_filename=cur_file,
-    force_download=True
-)
-
-# --- Sea level (zos, full day hourly) ---
-zos_file = os.path.join(output_dir, f"MOL_{date_str}.nc")
-if os.path.exists(zos_file): os.remove(zos_file)
-cm.subset(
-    dataset_id="cmems_mod_glo_phy_anfc_merged-sl_PT1H-i",
-    variables=["sea_surface_height","total_sea_level"],
-    #minimum_longitude=lon_min, maximum_longitude=lon_max,
-    #minimum_latitude=lat_min, maximum_latitude=lat_max,
-    start_datetime=start_day, end_datetime=end_day,
-    output_filename=zos_file,
-    force_download=True
-)
-
-print(f"\n✅ All downloads complete for {date_str}")
-print(f"Saved to: {output_dir}")
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Download one day of GLORYS fields from CMEMS")
+    parser.add_argument('--date', type=str, help="Date (yyyymmdd); asked for if not given")
+    parser.add_argument('--sub_daily', action='store_true', help="Download all 6-hourly records of the 3D fields")
+    args = parser.parse_args()
+    # Ask for date input
+    date_str = args.date or input("Enter date (yyyymmdd): ").strip()
+    download_day(date_str, sub_daily=args.sub_daily)
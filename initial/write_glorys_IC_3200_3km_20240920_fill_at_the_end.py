@@ -4,6 +4,11 @@ script for preparing model IC (ssh,T,S,u,v) from Glorys data
 How to use
 ./write_glorys_initial.py --config_file glorys_ic.yaml
 ./write_glorys_IC_3200_3km_20240920_fill_at_the_end.py  --config_file  glorys_ic_20240920_3200_3km_fill_at_the_end.yaml
+Estimate memory, output size and cost first, from metadata only:
+./write_glorys_IC_3200_3km_20240920_fill_at_the_end.py  --config_file  glorys_ic_20240920_3200_3km_fill_at_the_end.yaml --plan [plan.json]
+With a 'targets' list in the config, ICs for several grids are written from one read of GLORYS.
+With tiles: [rows, columns] (see the --plan recommendation), large grids are regridded tile by tile
+in tile_workers processes.
 """
 
 # author: 'Jing Chen'
@@ -12,14 +17,14 @@ How to use
 
 import sys
 import os
+import math
 import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from datetime import datetime
 import yaml
 
 import numpy as np
 import xarray
-import xesmf
-
-from HCtFlood import kara as flood
 
 # Get the directory of the current script
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -30,8 +35,19 @@ from depths import vgrid_to_interfaces, vgrid_to_layers
 
 #
 sys.path.append(os.path.join(script_dir, '../boundary'))
-from boundary import rotate_uv
+from boundary import halo_window, rotate_uv
+from merge_Glorys_nc import open_merged_day, open_zarr_day
+from nc_writer import load_output_policy, write_netcdf
+from profiling import PROFILER, enable_profiling, merge_stages, run_profiled, stage
+from diagnostics import Diagnostics
+from planning import COMPRESSION_RATIO, Plan, nbytes, recommend_blocks, recommend_workers
+from shared_arrays import SharedDataset, attach
 
+# Region of GLORYS read for the IC
+LON_RANGE = (-101, -30)
+LAT_RANGE = (15, 52)
+# Source points added around each tile's window in tiled mode
+TILE_HALO = 10
 
 
 def fill_from_deepest_valid(col):
@@ -50,29 +66,136 @@ def fill_from_deepest_valid(col):
 
 
 
-def write_initial(config):
-    # 1) Extract file paths from the new top-level YAML keys
-    temp_file = config["glorys_temperature"]
-    sal_file  = config["glorys_salinity"]
-    ssh_file  = config["glorys_sea_surface_height"]
-    u_file    = config["glorys_zonal_velocity"]
-    v_file    = config["glorys_meridional_velocity"]
+def open_glorys_fields(config, lon_range, lat_range):
+    """Open and subset the GLORYS temperature, salinity, SSH, u and v fields.
 
+    Reads the day given by 'ic_date' from the merged Zarr store named by 'glorys_zarr',
+    or from the raw downloads described by 'glorys_raw' (aligned in memory, no merged
+    file), or otherwise the individual GLORYS files named in the config.
+    Fields keep their original variable names; only coordinates are renamed.
 
-    vgrid_file = config['vgrid_file']
-    grid_file = config['grid_file']
-    output_file = config['output_file']
-    reuse_weights = config.get('reuse_weights', False)
+    Args:
+        config (dict): IC configuration.
+        lon_range (tuple): (lon_min, lon_max) of the region to read.
+        lat_range (tuple): (lat_min, lat_max) of the region to read.
 
-    # 2) Print them for debugging
-    print("Reading from the following GLORYS files:")
-    print(f"  Temperature: {temp_file}")
-    print(f"  Salinity: {sal_file}")
-    print(f"  SSH:       {ssh_file}")
-    print(f"  U (zonal): {u_file}")
-    print(f"  V (merid.):{v_file}")
+    Returns:
+        list: [temperature, salinity, ssh, u, v] DataArrays.
+    """
+    variable_names = config["variable_names"]
+    names = [
+        variable_names["temperature"],
+        variable_names["salinity"],
+        variable_names["sea_surface_height"],
+        variable_names["zonal_velocity"],
+        variable_names["meridional_velocity"],
+    ]
+    region = dict(longitude=slice(*lon_range), latitude=slice(*lat_range))
+
+    if config.get('glorys_zarr') or config.get('glorys_raw'):
+        ic_date = datetime.strptime(str(config['ic_date']), '%Y-%m-%d')
+        if config.get('glorys_zarr'):
+            print(f"Reading {config['ic_date']} from GLORYS Zarr store {config['glorys_zarr']}")
+            # Chunk-aligned partial reads of the region instead of whole files
+            merged = open_zarr_day(config['glorys_zarr'], ic_date, decode_times=True).sel(**region)
+        else:
+            print(f"Reading {config['ic_date']} from GLORYS downloads in {config['glorys_raw']['input_dir']}")
+            # Subset the raw files straight to the IC region
+            raw = dict(config['glorys_raw'], lon_bounds=lon_range, lat_bounds=lat_range)
+            merged = open_merged_day(ic_date, raw, decode_times=True)
+        # Merged data holds surface SSH as 'zos', without a depth dimension
+        merged_names = ['thetao', 'so', 'zos', 'uo', 'vo']
+        fields = [merged[src].rename(dst) for src, dst in zip(merged_names, names)]
+        fields[2] = fields[2].isel(time=0)
+    else:
+        files = [
+            config["glorys_temperature"],
+            config["glorys_salinity"],
+            config["glorys_sea_surface_height"],
+            config["glorys_zonal_velocity"],
+            config["glorys_meridional_velocity"],
+        ]
+        print("Reading from the following GLORYS files:")
+        print(f"  Temperature: {files[0]}")
+        print(f"  Salinity: {files[1]}")
+        print(f"  SSH:       {files[2]}")
+        print(f"  U (zonal): {files[3]}")
+        print(f"  V (merid.):{files[4]}")
+
+        fields = [
+            xarray.open_dataset(f)[name].sel(**region)  # Subset region
+#            .isel(latitude=slice(None, None, 6), longitude=slice(None, None, 12))  # Downsample
+            for f, name in zip(files, names)
+        ]
+        # Select the first time and the surface layer, and drop the depth dimension
+        fields[2] = fields[2].isel(time=0).isel(depth=0, drop=True)
+
+    return [f.rename({"longitude": "lon", "latitude": "lat"}) for f in fields]
+
+
+# Keys an entry of 'targets' may set; the source, vertical grid and variable names are shared
+TARGET_KEYS = ['name', 'grid_file', 'output_file', 'diagnostics_file', 'reuse_weights', 'output_policy', 'verbosity',
+               'tiles', 'tile_workers', 'tile_halo', 'shared_scratch_dir']
+
+
+def ic_targets(config):
+    """Configurations of the target grids of an IC run.
+
+    With a 'targets' list in the config, each entry overrides the target keys
+    (grid_file, output_file, ...) of the top-level config, and gets its own
+    regridder weight files. The source is read, interpolated and flooded once
+    for all of them. Without it, the run has the single target of the config.
+
+    Returns:
+        list: one configuration per target.
+    """
+    targets = config.get('targets')
+    if not targets:
+        return [config]
+    configs = []
+    for i, target in enumerate(targets):
+        unknown = set(target) - set(TARGET_KEYS)
+        if unknown:
+            raise ValueError(f"IC target {target.get('name', i + 1)} sets {sorted(unknown)}; "
+                             f"only {TARGET_KEYS} can differ between targets")
+        merged = {k: v for k, v in config.items() if k != 'targets'}
+        merged.update(target)
+        merged.setdefault('name', f"target{i + 1}")
+        merged['weights_suffix'] = f"_{merged['name']}"
+        configs.append(merged)
+    return configs
 
-    # 3) Retrieve variable names from the unchanged 'variable_names' dict
+
+def write_initial(config):
+    """Write the IC file of every target in the config from one read of GLORYS (see ic_targets)."""
+    source_diag = Diagnostics(config.get('verbosity', 1))
+    glorys, flooded = prepare_source(config, source_diag)
+    for target in ic_targets(config):
+        if target is not config:
+            print(f"IC target {target['name']}: {target['grid_file']} -> {target['output_file']}")
+        # Field statistics per stage: verbosity 0 skips them, 2 adds every variable at every stage
+        diag = Diagnostics(target.get('verbosity', 1), target.get(
+            'diagnostics_file', f"{os.path.splitext(target['output_file'])[0]}.diagnostics.json"))
+        diag.stages.update({name: dict(stats) for name, stats in source_diag.stages.items()})
+        write_target(target, glorys, flooded, diag)
+
+
+def prepare_source(config, diag):
+    """Read GLORYS, interpolate it onto the model layers and flood it over land.
+
+    This is the part of write_initial shared by all targets.
+
+    Returns:
+        (glorys, flooded): the subsampled source, whose grid the regridders are built from,
+            and the flooded fields on the model layers.
+    """
+    # Flooding backend is slow to load, so it is imported only for a real run
+    from HCtFlood import kara as flood
+
+    # 1) Extract file paths from the top-level YAML keys
+    vgrid_file = config['vgrid_file']
+
+    # 2) Retrieve variable names from the unchanged 'variable_names' dict
     variable_names = config["variable_names"]
     temp_var = variable_names["temperature"]           # 'thetao'
     sal_var  = variable_names["salinity"]             # 'so'
@@ -80,86 +203,15 @@ def write_initial(config):
     u_var    = variable_names["zonal_velocity"]        # 'uo'
     v_var    = variable_names["meridional_velocity"]   # 'vo'
 
-#    with xarray.open_dataset(ssh_file) as ds:
-#        print("Original SSH data:")
-#        print(ds[ssh_var])
-#    ds = xarray.open_dataset(ssh_file)
-#    ssh = ds["total_sea_level"]
-#    print("NaN count:", ssh.isnull().sum().values)
-
-#    ssh_roi = ssh.isel(time=0, depth=0).sel(lat=slice(0,60), lon=slice(-100,-34))
-#    print("NaN count in region of interest:", ssh_roi.isnull().sum().values)
-
-#    print("Min:", ssh_roi.min().values)
-#    print("Max:", ssh_roi.max().values)
-
-
-
-
-#    input("Press Enter to continue...")  # Pauses execution
-
-     # 4) Open each NetCDF file and select the original variable name
+    # 3) Open each field and select the original variable name
     #    We do NOT rename to 'temp','sal','ssh','u','v' here.
-    
-    # Define the longitude and latitude range
-    lon_min, lon_max = -101, -30
-    lat_min, lat_max = 15, 52
-
-
-
-
-
-    ds_temp = (
-        xarray.open_dataset(temp_file)[temp_var]
- #       .isel(latitude=slice(None, None, 6), longitude=slice(None, None, 12))  # Downsample
-        .sel(longitude=slice(lon_min, lon_max), latitude=slice(lat_min, lat_max))  # Subset region 
-       .rename({"longitude": "lon", "latitude": "lat"})  # only rename coords
-    )
-
-
-
 
+    # Define the longitude and latitude range
+    lon_min, lon_max = LON_RANGE
+    lat_min, lat_max = LAT_RANGE
 
-
-
-
-    ds_sal = (
-        xarray.open_dataset(sal_file)[sal_var]
-        .sel(longitude=slice(lon_min, lon_max), latitude=slice(lat_min, lat_max))  # Subset region
-#        .isel(latitude=slice(None, None, 6), longitude=slice(None, None, 12))  # Downsample
-        .rename({"longitude": "lon", "latitude": "lat"})
-    )
-
-    ds_ssh = (
-        xarray.open_dataset(ssh_file)[ssh_var]
-        .sel(longitude=slice(lon_min, lon_max), latitude=slice(lat_min, lat_max))  # Subset region
-#        .isel(latitude=slice(None, None, 6), longitude=slice(None, None, 12))  # Downsample
-        .isel(time=0)
-        .isel(depth=0, drop=True)
-#        .sel(depth=0, method="nearest", drop=True)  # Select the surface layer and drop depth dimension
-        .rename({"longitude": "lon", "latitude": "lat"})
-    )
-
-#    print("NaN count in region of interest:", ds_ssh.isnull().sum().values)
-#    print("Min:", ds_ssh.min().values)
-#    print("Max:", ds_ssh.max().values)
-
-#    input("Press Enter to continue...")  # Pauses execution
-
-    ds_u = (
-        xarray.open_dataset(u_file)[u_var]
-        .sel(longitude=slice(lon_min, lon_max), latitude=slice(lat_min, lat_max))  # Subset region
-#        .isel(latitude=slice(None, None, 6), longitude=slice(None, None, 12))  # Downsample
-        .rename({"longitude": "lon", "latitude": "lat"})
-    )
-
-    ds_v = (
-        xarray.open_dataset(v_file)[v_var]
-        .sel(longitude=slice(lon_min, lon_max), latitude=slice(lat_min, lat_max))  # Subset region
-#        .isel(latitude=slice(None, None, 6), longitude=slice(None, None, 12))  # Downsample
-        .rename({"longitude": "lon", "latitude": "lat"})
-    )
-
+    with stage('read'):
+        ds_temp, ds_sal, ds_ssh, ds_u, ds_v = open_glorys_fields(config, (lon_min, lon_max), (lat_min, lat_max))
 
     vgrid = xarray.open_dataarray(vgrid_file)
     z = vgrid_to_layers(vgrid)
@@ -187,51 +239,24 @@ def write_initial(config):
     # Depths below bottom of GLORYS are filled by extrapolating the deepest available value.
 #    revert = glorys.interp(depth=ztarget, kwargs={'fill_value': 'extrapolate'}).ffill('zl', limit=None)
     #Interpolates only within the valid range;Leaves anything outside (e.g., deeper than GLORYS) as NaN;
-    revert = glorys.interp(depth=ztarget) 
+    with stage('vertical_interp'):
+        revert = glorys.interp(depth=ztarget) 
     
     # Flood temperature and salinity over land. 
-    flooded = xarray.merge((
-        flood.flood_kara(revert[v], zdim='zl') for v in [temp_var, sal_var, u_var, v_var]
-    ))
+    with stage('flood'):
+        flooded = xarray.merge((
+            flood.flood_kara(revert[v], zdim='zl') for v in [temp_var, sal_var, u_var, v_var]
+        ))
 
     # flood zos separately to avoid the extra z=0 added by flood_kara.
-#    flooded[ssh_var] = flood.flood_kara(revert[ssh_var]).isel(z=0).drop('z')
-   
-#    print("Before flooding:", revert[ssh_var])
-   # Print number of NaNs before flooding
-    before_nan_count = revert[ssh_var].isnull().sum().values
-    print("NaN count before flooding:", before_nan_count)
-
-    # Flood the data
-    flooded_ssh = flood.flood_kara(revert[ssh_var])
-#    print("After flooding:", flooded_ssh)
-
-    # Print number of NaNs after flooding
-    after_nan_count = flooded_ssh.isnull().sum().values
-    print("NaN count after flooding:", after_nan_count)
-    print("Min after flooding:", flooded_ssh.min().values)
-    print("Max after flooding:", flooded_ssh.max().values)
-
-    surface_ssh=flood.flood_kara(revert[ssh_var]).isel(z=0).drop_vars('z')
-    surface_ssh['time'] = flooded.time
-    print("surface_ssh dims:", surface_ssh.dims)
-    print("surface_ssh shape:", surface_ssh.shape)
- 
-    print("==== flooded.time ====")
-    print(flooded.time)
-    print(flooded.time.values)
-    print(flooded.time.dtype)
-
-    print("==== surface_ssh.time ====")
-    print(surface_ssh.time)
-    print(surface_ssh.time.values)
-    print(surface_ssh.time.dtype)
+    # Flooded once; the statistics before and after come from the diagnostics, not extra floods.
+    diag.check('before_flood', revert[[ssh_var]])
+    diag.check('before_flood', revert[[temp_var, sal_var, u_var, v_var]], level=2)
+    with stage('flood'):
+        flooded_ssh = flood.flood_kara(revert[ssh_var])
 
-#    input("Press Enter to continue...")  # Pauses execution 
-
-
-
- 
+    surface_ssh = flooded_ssh.isel(z=0).drop_vars('z')
+    surface_ssh['time'] = flooded.time
     surface_ssh_da = surface_ssh.to_dataset(name=ssh_var)
 
     # Merge in a way that ignores dimension mismatches:
@@ -239,26 +264,13 @@ def write_initial(config):
         [flooded, surface_ssh_da],
         compat='override'
     )
+    diag.check('flooded', flooded[[ssh_var]])
+    diag.check('flooded', flooded[[temp_var, sal_var, u_var, v_var]], level=2)
+    return glorys, flooded
 
 
-    print("NaN count (after surface selection):", surface_ssh.isnull().sum().values)
-    print("Surafce ssh:", surface_ssh)
-    print("Min surface_ssh:", surface_ssh.min().values)
-    print("Max surface_ssh:", surface_ssh.max().values)
-
-#    input("Press Enter to continue...")  # Pauses execution
-# flooded[ssh_var] = flood.flood_kara(revert[ssh_var]).isel(z=0).drop_vars('z')    
-
-    # Horizontally interpolate the vertically interpolated and flooded data onto the MOM grid. 
-    target_grid = xarray.open_dataset(grid_file)
-    
-    # Adjust GLORYS longitudes to match the ocean_hgrid.nc range
-    target_max_lon = target_grid['x'].max().item()
-    print("Max longitude in ocean_hgrid.nc (target_max_lon):", target_max_lon)
-
-    glorys['lon'] = xarray.where(glorys['lon'] > target_max_lon, glorys['lon'] - 360, glorys['lon'])
-
-    
+def target_points(target_grid):
+    """Tracer (h) points and the full supergrid of a target grid, as regridding destinations."""
     target_t = (
         target_grid
         [['x', 'y']]
@@ -271,52 +283,50 @@ def write_initial(config):
         [['x', 'y']]
         .rename({'y': 'lat', 'x': 'lon'})
     )
-    
-    print("target_t", target_t)
-    print("glorys", glorys)
-    print("target_uv", target_uv)
+    return target_t, target_uv
 
 
+def regrid_fields(glorys, flooded, target_grid, variable_names, regrid_kws, weights_suffix=''):
+    """Regrid the flooded fields onto a target supergrid, rotate the velocities and fill the deep ocean.
 
-    regrid_kws = dict(method='nearest_s2d', reuse_weights=reuse_weights, periodic=False)
+    target_grid may be the whole ocean_hgrid.nc or a tile of it (see regrid_tiled).
 
-    print("t")
-
-
-    glorys_to_t = xesmf.Regridder(glorys, target_t, filename='regrid_glorys_tracers.nc', **regrid_kws)
-    print("uv:")
-    glorys_to_uv = xesmf.Regridder(glorys, target_uv, filename='regrid_glorys_uv.nc', **regrid_kws)
-
-    print("GLORYS lon:", glorys["lon"].min().values, glorys["lon"].max().values)
-    print("GLORYS lat:", glorys["lat"].min().values, glorys["lat"].max().values)
+    Returns:
+        xarray.Dataset: temp, salt, ssh, u and v on (time, zl, yh, yq, xh, xq).
+    """
+    # Regridding backend is slow to load, so it is imported only for a real run
+    import xesmf
 
-    print("Target_t lon:", target_t["lon"].min().values, target_t["lon"].max().values)
-    print("Target_t lat:", target_t["lat"].min().values, target_t["lat"].max().values)
+    temp_var = variable_names["temperature"]
+    sal_var  = variable_names["salinity"]
+    ssh_var  = variable_names["sea_surface_height"]
+    u_var    = variable_names["zonal_velocity"]
+    v_var    = variable_names["meridional_velocity"]
 
-    print("flooded lon:", flooded["lon"].min().values, flooded["lon"].max().values)
-    print("flooded lat:", flooded["lat"].min().values, flooded["lat"].max().values)
+    target_t, target_uv = target_points(target_grid)
 
-    ssh_pre = flooded[ssh_var]
-    print("SSH pre-regrid min/max:", ssh_pre.min().values, ssh_pre.max().values)
+    print("t")
+    with stage('regrid'):
+        glorys_to_t = xesmf.Regridder(glorys, target_t, filename=f'regrid_glorys_tracers{weights_suffix}.nc', **regrid_kws)
+    print("uv:")
+    with stage('regrid'):
+        glorys_to_uv = xesmf.Regridder(glorys, target_uv, filename=f'regrid_glorys_uv{weights_suffix}.nc', **regrid_kws)
 
 #    input("Press Enter to continue...")  # Pauses execution
 
 
-    interped_t = glorys_to_t(flooded[[temp_var, sal_var, ssh_var]])
+    with stage('regrid'):
+        interped_t = glorys_to_t(flooded[[temp_var, sal_var, ssh_var]])
 
     # Interpolate u and v, rotate, then extract individual u and v points
-    interped_uv = glorys_to_uv(flooded[[u_var, v_var]])
-    urot, vrot = rotate_uv(interped_uv[u_var], interped_uv[v_var], target_grid['angle_dx'])
-    uo = urot.isel(nxp=slice(0, None, 2), nyp=slice(1, None, 2)).rename({'nxp': 'xq', 'nyp': 'yh'})
-    uo.name = 'uo'
-    vo = vrot.isel(nxp=slice(1, None, 2), nyp=slice(0, None, 2)).rename({'nxp': 'xh', 'nyp': 'yq'})
-    vo.name = 'vo'
-    
-    interped = (
-        xarray.merge((interped_t, uo, vo))
-        .transpose('time', 'zl', 'yh', 'yq', 'xh', 'xq')
-    )
-
+    with stage('regrid'):
+        interped_uv = glorys_to_uv(flooded[[u_var, v_var]])
+    with stage('rotate'):
+        urot, vrot = rotate_uv(interped_uv[u_var], interped_uv[v_var], target_grid['angle_dx'])
+        uo = urot.isel(nxp=slice(0, None, 2), nyp=slice(1, None, 2)).rename({'nxp': 'xq', 'nyp': 'yh'})
+        uo.name = 'uo'
+        vo = vrot.isel(nxp=slice(1, None, 2), nyp=slice(0, None, 2)).rename({'nxp': 'xh', 'nyp': 'yq'})
+        vo.name = 'vo'
 
     # === Merge interpolated results ===
     interped = (
@@ -356,25 +366,186 @@ def write_initial(config):
 
     # === Apply deep-ocean fill ===
     print("\nApplying deep-ocean fill...")
-    for var in ['temp', 'salt', 'u', 'v']:
-        if var in interped:
-            print(f"Filling deep NaNs for {var}...")
-            interped[var] = xarray.apply_ufunc(
-                fill_from_deepest_valid,
-                interped[var],
-                input_core_dims=[['zl']],
-                output_core_dims=[['zl']],
-                vectorize=True,
-                dask='parallelized',
-                output_dtypes=[interped[var].dtype]
-            )
+    with stage('deep_fill'):
+        for var in ['temp', 'salt', 'u', 'v']:
+            if var in interped:
+                print(f"Filling deep NaNs for {var}...")
+                interped[var] = xarray.apply_ufunc(
+                    fill_from_deepest_valid,
+                    interped[var],
+                    input_core_dims=[['zl']],
+                    output_core_dims=[['zl']],
+                    vectorize=True,
+                    dask='parallelized',
+                    output_dtypes=[interped[var].dtype]
+                )
 
-             # Restore original dim‐order
-            interped[var] = interped[var].transpose(*orig_dims[var])
+                 # Restore original dim‐order
+                interped[var] = interped[var].transpose(*orig_dims[var])
+
+                print("\n--- SHAPES AFTER DEEP FILL ---")
+                da = interped[var]
+                print(f"{var}: dims={da.dims}, shape={da.shape}")
+
+    return interped
+
+
+def tile_bounds(n, parts):
+    """Split range(n) into `parts` contiguous (start, stop) pieces of nearly equal size."""
+    edges = np.linspace(0, n, min(parts, n) + 1).round().astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+def regrid_tile(offsets, glorys, flooded, grid, variable_names, regrid_kws, weights_suffix):
+    """Regrid one tile; run in a worker process by regrid_tiled.
+
+    flooded and grid may be (spec, window) pairs of shared datasets (see shared_arrays);
+    the tile then reads its window as a view of the shared memory instead of a copy.
+    """
+    with stage('tile'):
+        if isinstance(flooded, tuple):
+            flooded = attach(flooded[0]).isel(flooded[1])
+        if isinstance(grid, tuple):
+            grid = attach(grid[0]).isel(grid[1])
+        return offsets, regrid_fields(glorys, flooded, grid, variable_names, regrid_kws, weights_suffix).load()
+
+
+def stitch_tile(stitched, offsets, tile, sizes):
+    """Copy a tile into the stitched fields, allocating them from the first tile.
+
+    Args:
+        stitched (dict): variables of the whole grid, keyed by name; filled in place.
+        offsets (dict): start of the tile along each tiled dimension.
+        tile (xarray.Dataset): result of regrid_fields for the tile.
+        sizes (dict): size of each tiled dimension on the whole grid.
+    """
+    for name, var in tile.variables.items():
+        if not set(var.dims) & set(sizes):
+            # time, zl and other untiled variables are the same in every tile
+            stitched.setdefault(name, var)
+            continue
+        if name not in stitched:
+            shape = [sizes.get(dim, n) for dim, n in zip(var.dims, var.shape)]
+            values = np.full(shape, np.nan, dtype=var.dtype) if np.issubdtype(var.dtype, np.floating) \
+                else np.zeros(shape, dtype=var.dtype)
+            stitched[name] = xarray.Variable(var.dims, values, var.attrs, var.encoding)
+        index = tuple(slice(offsets[dim], offsets[dim] + n) if dim in sizes else slice(None)
+                      for dim, n in zip(var.dims, var.shape))
+        stitched[name].values[index] = var.values
+
+
+def regrid_tiled(glorys, flooded, target_grid, variable_names, regrid_kws, tiles, workers=1, halo=TILE_HALO,
+                 weights_suffix='', scratch_dir=None):
+    """Regrid, rotate and deep-fill the target grid tile by tile, and stitch the tiles together.
+
+    The tracer points are split into tiles[0] x tiles[1] rectangles. Each tile takes the
+    part of the supergrid around it (so the u and v points on its edges are included
+    and shared with its neighbours), the window of the source covering it plus `halo`
+    source points, and its own regridders and weight files. Memory and weight generation
+    then scale with the tile instead of the whole grid. With workers > 1, tiles run in
+    worker processes, at most `workers` at a time, and are stitched as they finish.
+    The workers read the flooded source and the grid from one copy in shared memory
+    (or memory-mapped files under scratch_dir), not from a copy each. The stages they
+    record are added to this process's profile under 'workers/'.
+
+    Returns:
+        xarray.Dataset: the same fields as regrid_fields on the whole grid.
+    """
+    nyh, nxh = (target_grid.sizes['nyp'] - 1) // 2, (target_grid.sizes['nxp'] - 1) // 2
+    sizes = {'yh': nyh, 'yq': nyh + 1, 'xh': nxh, 'xq': nxh + 1}
+    # The regridders only need the source coordinates
+    source_grid = xarray.Dataset(coords={'lon': glorys['lon'], 'lat': glorys['lat']})
+
+    def tile_jobs(shared_source=None, shared_grid=None):
+        for j0, j1 in tile_bounds(nyh, tiles[0]):
+            for i0, i1 in tile_bounds(nxh, tiles[1]):
+                index = dict(nyp=slice(2 * j0, 2 * j1 + 1), nxp=slice(2 * i0, 2 * i1 + 1))
+                grid = target_grid[['x', 'y', 'angle_dx']].isel(index).load()
+                window = halo_window(source_grid, grid['x'].values, grid['y'].values, 'lon', 'lat', margin=halo)
+                offsets = {'yh': j0, 'yq': j0, 'xh': i0, 'xq': i0}
+                tile_source = flooded.isel(window) if shared_source is None else (shared_source.spec, window)
+                tile_grid = grid if shared_grid is None else (shared_grid.spec, index)
+                yield (offsets, source_grid.isel(window), tile_source, tile_grid,
+                       variable_names, regrid_kws, f"{weights_suffix}_tile{j0}_{i0}")
+
+    stitched = {}
+    data_vars = []
+
+    def add(offsets, tile):
+        data_vars.extend(name for name in tile.data_vars if name not in data_vars)
+        stitch_tile(stitched, offsets, tile, sizes)
+
+    def collect(future):
+        result, stages = future.result()
+        merge_stages(stages)
+        add(*result)
+
+    if workers <= 1:
+        for job in tile_jobs():
+            add(*regrid_tile(*job))
+    else:
+        # Keep at most `workers` tiles in flight
+        with SharedDataset(flooded, scratch_dir) as shared_source, \
+                SharedDataset(target_grid[['x', 'y', 'angle_dx']], scratch_dir) as shared_grid, \
+                ProcessPoolExecutor(max_workers=workers) as pool:
+            running = set()
+            for job in tile_jobs(shared_source, shared_grid):
+                if len(running) >= workers:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+                running.add(pool.submit(run_profiled, PROFILER.enabled, regrid_tile, *job))
+            for future in as_completed(running):
+                collect(future)
+
+    return xarray.Dataset(
+        {name: stitched[name] for name in data_vars},
+        coords={name: var for name, var in stitched.items() if name not in data_vars},
+    )
 
-            print("\n--- SHAPES AFTER DEEP FILL ---")
-            da = interped[var]
-            print(f"{var}: dims={da.dims}, shape={da.shape}")
+
+def write_target(config, glorys, flooded, diag):
+    """Regrid the flooded source onto the target grid of config, deep-fill and write the IC file.
+
+    With tiles: [rows, columns] in the config, the target grid is processed in tiles
+    by tile_workers processes (see regrid_tiled); otherwise in one piece.
+    """
+    grid_file = config['grid_file']
+    output_file = config['output_file']
+    reuse_weights = config.get('reuse_weights', False)
+    weights_suffix = config.get('weights_suffix', '')
+    variable_names = config["variable_names"]
+    tiles = config.get('tiles') or [1, 1]
+
+    # Horizontally interpolate the vertically interpolated and flooded data onto the MOM grid. 
+    target_grid = xarray.open_dataset(grid_file)
+    
+    # Adjust GLORYS longitudes to match the ocean_hgrid.nc range
+    target_max_lon = target_grid['x'].max().item()
+    print("Max longitude in ocean_hgrid.nc (target_max_lon):", target_max_lon)
+
+    # On a copy, so that other targets see the original longitudes
+    glorys = glorys.assign_coords(lon=xarray.where(glorys['lon'] > target_max_lon, glorys['lon'] - 360, glorys['lon']))
+
+    target_t, target_uv = target_points(target_grid)
+    print("target_t", target_t)
+    print("glorys", glorys)
+    print("target_uv", target_uv)
+
+    diag.check('grids', xarray.Dataset({
+        'glorys_lon': glorys['lon'].variable, 'glorys_lat': glorys['lat'].variable,
+        'target_t_lon': target_t['lon'].variable, 'target_t_lat': target_t['lat'].variable,
+    }).reset_coords(drop=True), level=2)
+
+    regrid_kws = dict(method='nearest_s2d', reuse_weights=reuse_weights, periodic=False)
+
+    if tiles[0] * tiles[1] > 1:
+        print(f"Regridding in {tiles[0]} x {tiles[1]} tiles with {config.get('tile_workers', 1)} workers")
+        interped = regrid_tiled(glorys, flooded, target_grid, variable_names, regrid_kws, tiles,
+                                workers=config.get('tile_workers', 1), halo=config.get('tile_halo', TILE_HALO),
+                                weights_suffix=weights_suffix, scratch_dir=config.get('shared_scratch_dir'))
+    else:
+        interped = regrid_fields(glorys, flooded, target_grid, variable_names, regrid_kws, weights_suffix)
 
 
 # === Pause ===
@@ -413,48 +584,143 @@ def write_initial(config):
         os.makedirs(output_folder)   
 
     print("Variables in final dataset:", list(interped.data_vars))
-    print("SSH stats:", interped["ssh"].min().values, interped["ssh"].max().values)
+    # SSH is summarized by default, as before; the 3D fields only at verbosity 2
+    diag.check('output', interped[['ssh']])
+    diag.check('output', interped[[v for v in interped.data_vars if v != 'ssh']], level=2)
     #input("Press Enter to continue...")  # Pauses execution
 
 
-    # output results
-    interped.to_netcdf(
-        output_file,
-        format='NETCDF3_64BIT',
-        engine='netcdf4',
-        encoding=encodings,
-        unlimited_dims='time'
-    )
+    # output results; with an output_policy, as compressed NETCDF4 chunked by record
+    with stage('write'):
+        policy = load_output_policy(config)
+        if policy is not None:
+            write_netcdf(interped, output_file, encoding=encodings, fmt='NETCDF4', policy=policy)
+        else:
+            interped.to_netcdf(
+                output_file,
+                format='NETCDF3_64BIT',
+                engine='netcdf4',
+                encoding=encodings,
+                unlimited_dims='time'
+            )
+    diag.write()
+
+
+def plan_initial(config):
+    """Estimate memory, output size and cost of write_initial from metadata only.
+
+    Only the dimensions of the GLORYS fields, the vertical grid and ocean_hgrid.nc are read.
+    Memory is estimated from the float64 arrays each stage of write_initial holds at once;
+    costs are in points processed (deep fill weighted for its per-column Python loop),
+    so only their relative sizes are meaningful.
+
+    Returns:
+        Plan
+    """
+    temp = open_glorys_fields(config, LON_RANGE, LAT_RANGE)[0]
+    nt = temp.sizes.get('time', 1)
+    nz = temp.sizes['depth']
+    # write_initial takes every other source point
+    ny, nx = (temp.sizes['lat'] + 1) // 2, (temp.sizes['lon'] + 1) // 2
+    nzl = xarray.open_dataarray(config['vgrid_file']).size
+    with xarray.open_dataset(config['grid_file']) as grid:
+        nyp, nxp = grid.sizes['nyp'], grid.sizes['nxp']
+    nyh, nxh = (nyp - 1) // 2, (nxp - 1) // 2
+
+    source = 4 * nbytes((nt, nz, ny, nx), temp.dtype.itemsize) + nbytes((nt, ny, nx), temp.dtype.itemsize)
+    field = nbytes((nt, nzl, ny, nx))        # one variable on the model levels, source grid
+    tracer = nbytes((nt, nzl, nyh, nxh))     # one variable on the model grid
+    supergrid = nbytes((nt, nzl, nyp, nxp))  # one velocity component on the supergrid
+    output = 4 * tracer + nbytes((nt, nyh, nxh))
+    weights = 3 * 8 * (nyh * nxh + nyp * nxp)
+
+    plan = Plan(f"IC on {nyh} x {nxh} x {nzl}")
+    plan.inputs = {
+        'glorys': {'time': nt, 'depth': nz, 'lat': temp.sizes['lat'], 'lon': temp.sizes['lon']},
+        'glorys subsampled': {'lat': ny, 'lon': nx},
+        'vgrid layers': nzl,
+        'hgrid': {'nyp': nyp, 'nxp': nxp},
+    }
+    plan.stage('read', source, source / 4)
+    plan.stage('vertical_interp', source + 4 * field, 4 * field / 8)
+    # flood_kara keeps a working copy of the field being flooded
+    plan.stage('flood', source + 8 * field + 2 * field, 10 * 4 * field / 8)
+    plan.stage('regrid', source + 8 * field + weights + 3 * tracer + 2 * supergrid,
+               (ny * nx) * np.log2(ny * nx) * 2 + (3 * tracer + 2 * supergrid) / 8)
+    plan.stage('rotate', 8 * field + 3 * tracer + 4 * supergrid, 2 * supergrid / 8)
+    plan.stage('deep_fill', 2 * output + 2 * supergrid, 20 * 4 * tracer / 8)
+    plan.stage('write', 2 * output, output / 8)
+    plan.outputs[os.path.basename(config['output_file'])] = output
+    if config.get('output_policy'):
+        plan.outputs['compressed (rough)'] = COMPRESSION_RATIO * output
+
+    # Split the model grid into tiles so that one tile's peak fits in half the memory
+    tiles = recommend_blocks(plan.peak_memory)
+    ty = math.ceil(math.sqrt(tiles))
+    tx = math.ceil(tiles / ty)
+    plan.recommendations = {
+        'tiles': [ty, tx],
+        'tile rows x columns': f"{math.ceil(nyh / ty)} x {math.ceil(nxh / tx)}",
+        'tile_workers': recommend_workers(plan.peak_memory / (ty * tx)),
+    }
+    return plan
 
 
 def main():
 
     parser = argparse.ArgumentParser(description='Generate ICs from Glorys.')
     parser.add_argument('--config_file', type=str, default='glorys_ic.yaml' , help='Path to the YAML config file')
+    parser.add_argument('--profile', type=str, nargs='?', const='', default=None,
+                        help='Report wall/CPU time and peak memory per stage at exit (and write it to this JSON file)')
+    parser.add_argument('--verbosity', type=int, default=None,
+                        help='Field statistics: 0 none, 1 SSH and output, 2 every variable at every stage')
+    parser.add_argument('--plan', type=str, nargs='?', const='', default=None,
+                        help='Only estimate memory, output size and cost from metadata (and write the plan to this JSON file)')
     args = parser.parse_args()
 
+    if args.profile is not None:
+        enable_profiling(args.profile or None)
+
     if not args.config_file:
         parser.error('Please provide the path to the YAML config file.')
 
     with open(args.config_file, 'r') as yaml_file:
         config = yaml.safe_load(yaml_file)
 
-    if not all(key in config for key in [
-        'glorys_temperature',
-        'glorys_salinity',
-        'glorys_sea_surface_height',
-        'glorys_zonal_velocity',
-        'glorys_meridional_velocity',
-        'vgrid_file',
-        'grid_file',
-        'output_file'
-    ]):
+    if config.get('glorys_zarr') or config.get('glorys_raw'):
+        source_keys = ['ic_date']
+    else:
+        source_keys = [
+            'glorys_temperature',
+            'glorys_salinity',
+            'glorys_sea_surface_height',
+            'glorys_zonal_velocity',
+            'glorys_meridional_velocity',
+        ]
+    if not all(key in config for key in source_keys + ['vgrid_file']):
         parser.error('Please provide all required parameters in the YAML config file.')
+    try:
+        targets = ic_targets(config)
+    except ValueError as err:
+        parser.error(str(err))
+    if not all(key in target for target in targets for key in ['grid_file', 'output_file']):
+        parser.error('Please provide grid_file and output_file for every target in the YAML config file.')
 
 
  #   if not all(key in config for key in ['glorys_file', 'vgrid_file', 'grid_file', 'output_file']):
  #       parser.error('Please provide all required parameters in the YAML config file.')
 
+    if args.verbosity is not None:
+        config['verbosity'] = args.verbosity
+        for target in config.get('targets') or []:
+            target['verbosity'] = args.verbosity
+    if args.plan is not None:
+        for target in targets:
+            report_file = args.plan or None
+            if report_file and len(targets) > 1:
+                report_file = f"{os.path.splitext(report_file)[0]}_{target['name']}.json"
+            plan_initial(target).emit(report_file)
+        return
     write_initial(config)
 
 if __name__ == '__main__':
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Run a forecast cycle end to end from one YAML file:
+download -> merge -> initial condition and boundary conditions -> concatenation.
+
+The stages are modelled as a task graph keyed by date and segment:
+  download[date] -> merge[date] -> boundary[date, segment] -> concat[segment]
+                                -> initial
+With a Zarr store, the boundary and initial tasks also wait for every merge into
+the store, so no day is read while another is being appended.
+A task is skipped when all of its outputs exist and are newer than its inputs.
+Tasks whose dependencies are finished run concurrently on a local process pool,
+so a cycle takes about as long as its critical path.
+
+How to use
+./run_cycle.py --config cycle.yaml
+./run_cycle.py --config cycle.yaml --dry_run
+./run_cycle.py --config cycle.yaml --workers 8 --force
+
+Use absolute paths in the config; tasks run in worker processes and do not
+change directory.
+"""
+
+# author: 'Jing Chen'
+# description: 'Forecast cycle orchestrator for MOM6 IC/OBC generation from GLORYS'
+# created: '2025-08-05'
+
+import argparse
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta
+from os import path
+
+import yaml
+
+repo_dir = path.dirname(path.dirname(path.abspath(__file__)))
+for subdir in ['boundary', 'initial', 'download_glorys']:
+    sys.path.append(path.join(repo_dir, subdir))
+
+
+def load_config(config_file):
+    """Load configuration from a YAML file."""
+    with open(config_file, 'r') as file:
+        return yaml.safe_load(file)
+
+
+# =============================================================================
+# Stage runners. These run in worker processes, so heavy modules are imported
+# here rather than at the top of the file.
+# =============================================================================
+
+def run_download(date, cfg):
+    from download_cmems import download_day
+    download_day(f"{date:%Y%m%d}", cfg['base_dir'], sub_daily=cfg.get('sub_daily', False))
+
+
+def run_merge(date, cfg):
+    from merge_Glorys_nc import merge_range
+    merge_range(date, date, cfg)
+
+
+def run_initial(cfg):
+    from write_glorys_IC_3200_3km_20240920_fill_at_the_end import write_initial
+    write_initial(cfg)
+
+
+def run_boundary(date, seg_id, cfg):
+    from write_MOM6_glorys_boundary_daily import process_single_day
+    process_single_day(cfg, date.year, date.month, date.day, segment_ids=[seg_id])
+
+
+def run_concat(seg_id, cfg, first_date, last_date):
+    from write_MOM6_glorys_boundary_daily import concatenate_files, output_variables
+    concatenate_files(
+        len(cfg['segments']),
+        cfg['output_dir'],
+        output_variables(cfg),
+        [] if cfg.get('consolidate') else cfg.get('ncrcat_names', []),
+        first_date,
+        last_date,
+        cfg.get('adjust_timestamps', False),
+        segment_ids=[seg_id]
+    )
+
+
+# =============================================================================
+# Task graph
+# =============================================================================
+
+class Task():
+    """One node of the cycle's task graph.
+
+    Attributes:
+        name (str): unique name, e.g. 'boundary[2024-09-26,001]'.
+        func: stage runner called with args in a worker process.
+        args (tuple): arguments for func.
+        deps (list): names of tasks that must finish first.
+        after (list): names of tasks that must also finish first, but whose outputs the task
+            does not read (e.g. appends to a Zarr store the task reads another day from).
+        inputs (list): files the task reads, in addition to the outputs of its deps.
+        outputs (list): files the task writes.
+    """
+
+    def __init__(self, name, func, args=(), deps=None, inputs=None, outputs=None, after=None):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.deps = deps or []
+        self.after = after or []
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+
+
+def up_to_date(outputs, inputs):
+    """True if every output exists and is newer than every existing input."""
+    if not outputs or not all(path.exists(f) for f in outputs):
+        return False
+    newest_input = max((path.getmtime(f) for f in inputs if path.exists(f)), default=0.0)
+    return min(path.getmtime(f) for f in outputs) >= newest_input
+
+
+def cycle_dates(config):
+    first_date = datetime.strptime(str(config['first_date']), '%Y-%m-%d')
+    last_date = datetime.strptime(str(config.get('last_date', config['first_date'])), '%Y-%m-%d')
+    return [first_date + timedelta(days=i) for i in range((last_date - first_date).days + 1)]
+
+
+def build_tasks(config):
+    """Build the task graph for a cycle.
+
+    Args:
+        config (dict): Cycle configuration (see cycle.yaml). The download, merge,
+            initial and boundary sections hold the same keys as each stage's own config;
+            stages without a section are left out of the graph.
+
+    Returns:
+        dict: Tasks keyed by name, in dependency order.
+    """
+    dates = cycle_dates(config)
+    tasks = {}
+
+    def add(task):
+        tasks[task.name] = task
+        return task
+
+    # download[date]
+    download_cfg = config.get('download')
+    downloads = {}
+    if download_cfg is not None:
+        from download_cmems import output_files
+        for date in dates:
+            downloads[date] = add(Task(
+                f"download[{date:%Y-%m-%d}]", run_download, (date, download_cfg),
+                outputs=list(output_files(f"{date:%Y%m%d}", download_cfg['base_dir']).values())
+            ))
+
+    # merge[date]; appends to a Zarr store are chained so the time axis stays ordered
+    merge_cfg = config.get('merge')
+    merges = {}
+    if merge_cfg is not None:
+        from merge_Glorys_nc import find_source_files, output_path, zarr_day_stamp
+        merge_cfg = dict(merge_cfg, first_date=None, last_date=None)
+        zarr_store = merge_cfg.get('zarr_store')
+        previous = None
+        for date in dates:
+            deps = [downloads[date].name] if date in downloads else []
+            inputs = []
+            if not deps:
+                try:
+                    inputs = [str(f) for f in find_source_files(
+                        merge_cfg['input_dir'].format(date=f"{date:%Y%m%d}"), f"{date:%Y%m%d}",
+                        merge_cfg.get('revision')).values()]
+                except FileNotFoundError:
+                    pass
+            if zarr_store:
+                # Appends have no per-day file; merge_zarr stamps each day it appends
+                if previous is not None:
+                    deps.append(previous.name)
+                previous = add(Task(f"merge[{date:%Y-%m-%d}]", run_merge, (date, merge_cfg),
+                                    deps=deps, inputs=inputs, outputs=[str(zarr_day_stamp(zarr_store, date))]))
+                merges[date] = previous
+            else:
+                merges[date] = add(Task(f"merge[{date:%Y-%m-%d}]", run_merge, (date, merge_cfg),
+                                        deps=deps, inputs=inputs, outputs=[str(output_path(merge_cfg, date))]))
+
+    def source_deps(date, cfg):
+        """Tasks producing the GLORYS source a stage reads for date."""
+        if cfg.get('glorys_raw'):
+            return [downloads[date].name] if date in downloads else []
+        return [merges[date].name] if date in merges else []
+
+    def store_writers(cfg):
+        """Every merge into the Zarr store a stage reads: none may still be appending while it reads."""
+        if cfg.get('glorys_raw') or not (merge_cfg and merge_cfg.get('zarr_store')):
+            return []
+        return [task.name for task in merges.values()]
+
+    # initial
+    initial_cfg = config.get('initial')
+    if initial_cfg is not None:
+        initial_cfg = dict(initial_cfg)
+        initial_cfg.setdefault('ic_date', f"{dates[0]:%Y-%m-%d}")
+        file_keys = [k for k in initial_cfg if k.startswith('glorys_') and k not in ('glorys_zarr', 'glorys_raw')]
+        if not file_keys and not initial_cfg.get('glorys_zarr') and not initial_cfg.get('glorys_raw'):
+            # Default to the merge stage's source, read without intermediate files
+            if merge_cfg is not None and merge_cfg.get('zarr_store'):
+                initial_cfg['glorys_zarr'] = merge_cfg['zarr_store']
+            elif merge_cfg is not None:
+                initial_cfg['glorys_raw'] = {k: merge_cfg[k] for k in ('input_dir', 'revision') if k in merge_cfg}
+        from write_glorys_IC_3200_3km_20240920_fill_at_the_end import ic_targets
+        # One task writes every target grid from a single read of the source
+        targets = ic_targets(initial_cfg)
+        ic_date = datetime.strptime(str(initial_cfg['ic_date']), '%Y-%m-%d')
+        inputs = [t['grid_file'] for t in targets] + [initial_cfg['vgrid_file']] + [initial_cfg[k] for k in file_keys]
+        deps = [] if file_keys else source_deps(ic_date, initial_cfg)
+        add(Task("initial", run_initial, (initial_cfg, ), deps=deps, inputs=inputs,
+                 outputs=[t['output_file'] for t in targets],
+                 after=[] if file_keys else store_writers(initial_cfg)))
+
+    # boundary[date, segment] -> concat[segment], for each domain
+    boundary_cfg = config.get('boundary')
+    if boundary_cfg is not None:
+        from write_MOM6_glorys_boundary_daily import domain_configs
+        boundary_cfg = dict(boundary_cfg, first_date=f"{dates[0]:%Y-%m-%d}", last_date=f"{dates[-1]:%Y-%m-%d}")
+        if merge_cfg is not None and not boundary_cfg.get('glorys_raw'):
+            if merge_cfg.get('zarr_store'):
+                boundary_cfg.setdefault('glorys_zarr', merge_cfg['zarr_store'])
+            else:
+                boundary_cfg.setdefault('glorys_dir', merge_cfg['output_dir'])
+        domains = domain_configs(boundary_cfg)
+        for domain_cfg in domains:
+            # Tasks of a domain run one domain each; names carry the domain when there are several
+            prefix = f"{domain_cfg['name']}," if len(domains) > 1 else ''
+            output_dir = domain_cfg['output_dir']
+            variables = domain_cfg['variables']
+            if domain_cfg.get('consolidate'):
+                variables = [domain_cfg.get('consolidated_name', 'obc')]
+            for seg_config in domain_cfg['segments']:
+                seg_id = seg_config['id']
+                daily = []
+                for date in dates:
+                    daily.append(add(Task(
+                        f"boundary[{prefix}{date:%Y-%m-%d},{seg_id:03d}]", run_boundary, (date, seg_id, domain_cfg),
+                        deps=source_deps(date, domain_cfg), inputs=[domain_cfg['hgrid']],
+                        outputs=[path.join(output_dir, f"{v}_{seg_id:03d}_{date:%Y%m%d}.nc") for v in variables],
+                        after=store_writers(domain_cfg)
+                    )))
+                if domain_cfg.get('ncrcat_years', True):
+                    names = variables if domain_cfg.get('consolidate') else domain_cfg.get('ncrcat_names') or variables
+                    add(Task(
+                        f"concat[{prefix}{seg_id:03d}]", run_concat, (seg_id, domain_cfg, dates[0], dates[-1]),
+                        deps=[t.name for t in daily],
+                        outputs=[path.join(output_dir, f"{n}_{seg_id:03d}.nc") for n in names]
+                    ))
+
+    return tasks
+
+
+def task_inputs(task, tasks):
+    return task.inputs + [f for d in task.deps for f in tasks[d].outputs]
+
+
+def plan(tasks, force=False):
+    """Report which tasks would run, assuming every task that runs rewrites its outputs."""
+    will_run = set()
+    for task in tasks.values():
+        stale = force or any(d in will_run for d in task.deps) or not up_to_date(task.outputs, task_inputs(task, tasks))
+        if stale:
+            will_run.add(task.name)
+        print(f"{'run ' if stale else 'skip'}  {task.name}")
+    print(f"{len(will_run)} of {len(tasks)} tasks to run")
+
+
+def run_tasks(tasks, workers=1, force=False):
+    """Run the task graph on a local process pool.
+
+    Returns:
+        dict: final state of each task ('done', 'skipped', 'failed' or 'blocked').
+
+    Raises:
+        RuntimeError: if tasks wait on dependencies that are not in the graph or form a cycle.
+    """
+    state = {}
+    pending = list(tasks)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            waiting = len(pending)
+            for name in list(pending):
+                task = tasks[name]
+                dep_states = [state.get(d) for d in task.deps + task.after]
+                if any(s in ('failed', 'blocked') for s in dep_states):
+                    state[name] = 'blocked'
+                    pending.remove(name)
+                    print(f"Blocked: {name}")
+                elif all(s in ('done', 'skipped') for s in dep_states):
+                    pending.remove(name)
+                    if not force and up_to_date(task.outputs, task_inputs(task, tasks)):
+                        state[name] = 'skipped'
+                        print(f"Up to date: {name}")
+                    else:
+                        print(f"Starting: {name}")
+                        running[pool.submit(task.func, *task.args)] = name
+            if not running:
+                if len(pending) == waiting:
+                    # Nothing can start and nothing will finish: the remaining dependencies never resolve
+                    unresolved = {name: [d for d in tasks[name].deps + tasks[name].after if d not in state]
+                                  for name in pending}
+                    raise RuntimeError("Tasks with unresolved dependencies: " + "; ".join(
+                        f"{name} waits on {', '.join(deps)}" for name, deps in unresolved.items()))
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    state[name] = 'done'
+                    print(f"Finished: {name}")
+                except Exception as err:
+                    state[name] = 'failed'
+                    print(f"Failed: {name}: {err!r}")
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a GLORYS to MOM6 IC/OBC forecast cycle")
+    parser.add_argument('--config', type=str, default='cycle.yaml', help="Path to the YAML configuration file")
+    parser.add_argument('--workers', type=int, help="Number of worker processes. Defaults to workers in the config, or 1")
+    parser.add_argument('--force', action='store_true', help="Run every task even if its outputs are up to date")
+    parser.add_argument('--dry_run', action='store_true', help="Only report which tasks would run")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    tasks = build_tasks(config)
+
+    if args.dry_run:
+        plan(tasks, force=args.force)
+        return
+
+    workers = args.workers or config.get('workers', 1)
+    state = run_tasks(tasks, workers=workers, force=args.force)
+
+    counts = {s: sum(1 for v in state.values() if v == s) for s in ('done', 'skipped', 'failed', 'blocked')}
+    print("Cycle summary: " + ", ".join(f"{n} {s}" for s, n in counts.items()))
+    if counts['failed'] or counts['blocked']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
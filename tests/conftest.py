@@ -0,0 +1,47 @@
+# author: 'Jing Chen'
+# description: 'Make the boundary, initial, pipeline and benchmark script modules importable from the tests'
+# created: '2025-08-05'
+import os
+import sys
+
+import numpy as np
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ['boundary', 'initial', 'pipeline', 'benchmarks']:
+    sys.path.insert(0, os.path.join(repo_dir, directory))
+
+
+def kara_flood(arr, xdim='lon', ydim='lat', diagonal=True, **kwargs):
+    """Reference flood in the manner of HCtFlood's flood_kara, for tests without HCtFlood.
+
+    Each sweep fills every missing point that has a neighbour filled (or ocean) in the earlier
+    sweeps with their mean; diagonal=False uses only the four edge neighbours.
+    """
+    dims = arr.dims
+    arr = arr.transpose(..., ydim, xdim)
+    values = arr.values.astype('float64')
+    shifts = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dy or dx) and (diagonal or not (dy and dx))]
+    ny, nx = values.shape[-2:]
+    for field in values.reshape((-1, ny, nx)):
+        while np.isnan(field).any():
+            padded = np.pad(field, 1, constant_values=np.nan)
+            neighbours = np.stack([padded[1 + dy:1 + dy + ny, 1 + dx:1 + dx + nx] for dy, dx in shifts])
+            count = (~np.isnan(neighbours)).sum(axis=0)
+            fill = np.isnan(field) & (count > 0)
+            if not fill.any():
+                break
+            field[fill] = (np.nansum(neighbours, axis=0) / np.maximum(count, 1))[fill]
+    return arr.copy(data=values).transpose(*dims)
+
+
+@pytest.fixture(params=[True, False], ids=['diagonal', 'edges'])
+def flood(request, monkeypatch):
+    """Flood with kara_flood in place of HCtFlood, through 8 or 4 neighbours."""
+    import boundary
+
+    def flood_missing(arr, **kwargs):
+        return kara_flood(arr, diagonal=request.param, **kwargs)
+
+    monkeypatch.setattr(boundary, 'flood_missing', flood_missing)
+    return flood_missing
@@ -0,0 +1,37 @@
+# author: 'Jing Chen'
+# description: 'Synthetic sources and supergrids of the benchmarks look like GLORYS and ocean_hgrid'
+# created: '2025-08-05'
+import numpy as np
+
+from bench_pipeline import BENCHMARKS, Case, run_benchmark, synthetic_hgrid, synthetic_source
+
+
+def test_synthetic_source_has_a_coast_and_bathymetry():
+    source = synthetic_source(0.5, extent=10.0, nz=10, nt=2)
+    assert dict(source['thetao'].sizes) == {'time': 2, 'z': 10, 'lat': 20, 'lon': 20}
+    assert dict(source['zos'].sizes) == {'time': 2, 'lat': 20, 'lon': 20}
+    wet = source['thetao'].notnull().isel(time=0)
+    # Land in the west, open ocean in the east
+    assert not wet.isel(lon=0).any()
+    assert wet.isel(z=0, lon=-1).all()
+    # The bottom deepens offshore, so deep levels are missing next to the coast only
+    deep = wet.sel(z=2000.0, method='nearest').sum('lon')
+    assert (deep > 0).all() and (deep < wet.isel(z=0).sum('lon')).all()
+    # SSH is missing on land only
+    assert (source['zos'].isnull().isel(time=0) == ~wet.isel(z=0)).all()
+
+
+def test_synthetic_hgrid_lies_inside_the_source():
+    source = synthetic_source(0.25, extent=4.0, nz=5)
+    hgrid = synthetic_hgrid(0.25, extent=4.0)
+    # A supergrid has two points per model cell plus one
+    assert dict(hgrid.sizes) == {'nyp': 17, 'nxp': 17}
+    assert source.lon.min() < hgrid.x.min() and hgrid.x.max() < source.lon.max()
+    assert source.lat.min() < hgrid.y.min() and hgrid.y.max() < source.lat.max()
+    assert np.allclose(hgrid.angle_dx, np.radians(2.0))
+
+
+def test_run_benchmark_times_each_repeat(tmp_path):
+    case = Case('quarter', 4.0, 5, 1, str(tmp_path))
+    times = run_benchmark(BENCHMARKS['fill_missing'], case, repeat=2)
+    assert len(times) == 2 and all(t >= 0 for t in times)
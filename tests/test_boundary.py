@@ -0,0 +1,231 @@
+# author: 'Jing Chen'
+# description: 'Segment geometry, source windows and flooding defaults of boundary.py'
+# created: '2025-08-05'
+import numpy as np
+import pytest
+import xarray
+
+import boundary
+from boundary import Segment, border_strip, grid_key, halo_window, load_border_strips
+
+
+def supergrid(lon0=-80.0, lat0=20.0, nx=20, ny=16, res=0.1):
+    x, y = np.meshgrid(lon0 + res * np.arange(2 * nx + 1), lat0 + res * np.arange(2 * ny + 1))
+    return xarray.Dataset({'x': (('nyp', 'nxp'), x), 'y': (('nyp', 'nxp'), y),
+                           'angle_dx': (('nyp', 'nxp'), np.zeros_like(x))})
+
+
+def source_field(nz=3):
+    lon = np.arange(-100.0, -50.0, 0.25)
+    lat = np.arange(0.0, 45.0, 0.25)
+    values = np.random.default_rng(0).random((1, nz, lat.size, lon.size))
+    return xarray.DataArray(values, dims=('time', 'z', 'lat', 'lon'), name='thetao',
+                            coords={'lon': lon, 'lat': lat, 'z': np.arange(nz, dtype='float64')})
+
+
+@pytest.fixture
+def segment(tmp_path):
+    return Segment(1, 'south', supergrid(), output_dir=str(tmp_path))
+
+
+class FloodCalled(Exception):
+    pass
+
+
+@pytest.fixture
+def flooded_shapes(monkeypatch):
+    """Record the source each flood_missing call receives, and stop before regridding."""
+    shapes = []
+
+    def record(arr, **kwargs):
+        shapes.append(dict(arr.sizes))
+        raise FloodCalled
+
+    monkeypatch.setattr(boundary, 'flood_missing', record)
+    return shapes
+
+
+def land_source():
+    """source_field with land over the segment, more of it at depth, and an all-land bottom level."""
+    source = source_field(nz=4).copy()
+    lon, lat = np.meshgrid(source['lon'].values, source['lat'].values)
+    values = source.values
+    values[:, 0, (lat >= 19.0) & (lon >= -85.0) & (lon <= -70.0)] = np.nan
+    values[:, 1, (lat >= 16.0) & (lon >= -90.0) & (lon <= -62.0)] = np.nan
+    values[:, 2, (lat >= 12.0) & (lon >= -95.0)] = np.nan
+    values[:, 3] = np.nan
+    return source
+
+
+def test_default_flood_window_matches_whole_source(segment, flood):
+    source = land_source()
+    lon, lat = segment.coords['lon'].values, segment.coords['lat'].values
+    window = segment.flood_window(source)
+    assert window['lon'].stop - window['lon'].start < source.sizes['lon']
+    assert window['lat'].stop - window['lat'].start < source.sizes['lat']
+    # The points the regridding stencil reads, relative to the flood window
+    stencil = halo_window(source, lon, lat, 'lon', 'lat')
+    inner = {dim: slice(stencil[dim].start - window[dim].start, stencil[dim].stop - window[dim].start)
+             for dim in stencil}
+    whole = flood(source).isel(stencil)
+    np.testing.assert_array_equal(flood(source.isel(window)).isel(inner).values, whole.values)
+    # A fixed margin short of the nearest ocean changes the values
+    short = halo_window(source, lon, lat, 'lon', 'lat', margin=1)
+    inner = {dim: slice(stencil[dim].start - short[dim].start, stencil[dim].stop - short[dim].start)
+             for dim in stencil}
+    assert not np.allclose(flood(source.isel(short)).isel(inner).values, whole.values, equal_nan=True)
+
+
+def test_regrid_floods_the_flood_window(segment, flooded_shapes):
+    source = land_source()
+    window = segment.flood_window(source)
+    expected = dict(source.isel(window).sizes)
+    with pytest.raises(FloodCalled):
+        segment.regrid_tracer(source, flood=True)
+    with pytest.raises(FloodCalled):
+        segment.regrid_velocity(source, source.rename('vo'), flood=True)
+    assert flooded_shapes == [expected, expected]
+
+
+def test_flood_margin_overrides_window(segment, flooded_shapes):
+    source = source_field()
+    with pytest.raises(FloodCalled):
+        segment.regrid_tracer(source, flood=True, flood_margin=2)
+    window = halo_window(source, segment.coords['lon'].values, segment.coords['lat'].values, 'lon', 'lat', 2)
+    assert flooded_shapes[-1]['lon'] == window['lon'].stop - window['lon'].start
+    assert flooded_shapes[-1]['lon'] < source.sizes['lon']
+
+
+def test_source_window(segment):
+    source = source_field()
+    windowed = segment.source_window(source, margin=0)
+    lon, lat = segment.coords['lon'].values, segment.coords['lat'].values
+    # The window holds every source point within one grid spacing of the segment
+    assert windowed['lon'].min() <= lon.min() - 0.25 + 1e-9 and windowed['lon'].max() >= lon.max() + 0.25 - 1e-9
+    assert windowed['lat'].min() <= lat.min() - 0.25 + 1e-9 and windowed['lat'].max() >= lat.max() + 0.25 - 1e-9
+    # All ocean: the flood window is just the stencil
+    assert segment.source_window(source).identical(windowed)
+
+
+BORDERS = {'south': {'nyp': 0}, 'north': {'nyp': -1}, 'west': {'nxp': 0}, 'east': {'nxp': -1}}
+
+
+def rotated_supergrid():
+    """supergrid with rotated, stretched coordinates and angle_dx in degrees."""
+    hgrid = supergrid()
+    jj, ii = np.mgrid[0:hgrid.sizes['nyp'], 0:hgrid.sizes['nxp']]
+    return hgrid.assign(x=hgrid['x'] + 0.01 * jj, y=hgrid['y'] + 0.002 * ii ** 1.5,
+                        angle_dx=(('nyp', 'nxp'), 10.0 * np.sin(0.1 * ii + 0.2 * jj), {'units': 'degrees'}))
+
+
+@pytest.mark.parametrize('border', list(BORDERS))
+def test_segment_keeps_only_its_border(tmp_path, border):
+    hgrid = rotated_supergrid()
+    strip = border_strip(hgrid, border)
+    assert strip.identical(hgrid.isel(BORDERS[border]))
+
+    segment = Segment(1, border, hgrid, output_dir=str(tmp_path))
+    assert segment.coords['lon'].values.tolist() == strip['x'].values.tolist()
+    assert segment.coords['lat'].values.tolist() == strip['y'].values.tolist()
+    assert (segment.nx, segment.ny) == ((strip.sizes['nxp'], 1) if 'nxp' in strip.dims else (1, strip.sizes['nyp']))
+    angle = np.radians(strip['angle_dx'].values)
+    assert np.allclose(segment.coords['angle'].values, angle)
+    assert np.array_equal(segment.cos_angle, np.cos(angle)) and np.array_equal(segment.sin_angle, np.sin(angle))
+    # The full grid is left as it was, and not kept by the segment
+    assert hgrid.identical(rotated_supergrid())
+    assert not any(isinstance(value, xarray.Dataset) and 'nyp' in value.dims and 'nxp' in value.dims
+                   for value in vars(segment).values())
+
+
+@pytest.mark.parametrize('border', list(BORDERS))
+def test_border_strips_match_the_full_grid(tmp_path, border):
+    hgrid = rotated_supergrid()
+    hgrid.to_netcdf(tmp_path / 'ocean_hgrid.nc')
+    strips = load_border_strips(str(tmp_path / 'ocean_hgrid.nc'), [border, border])
+    assert list(strips) == [border]
+    assert strips[border].identical(hgrid.isel(BORDERS[border]))
+    # Strips are read into memory, and are their own border strip
+    (tmp_path / 'ocean_hgrid.nc').unlink()
+    assert border_strip(strips[border], border).identical(strips[border])
+
+    from_strip = Segment(1, border, strips[border], output_dir=str(tmp_path))
+    from_grid = Segment(1, border, hgrid, output_dir=str(tmp_path))
+    assert from_strip.coords.identical(from_grid.coords)
+    assert (from_strip.nx, from_strip.ny) == (from_grid.nx, from_grid.ny)
+    assert np.array_equal(from_strip.cos_angle, from_grid.cos_angle)
+    assert np.array_equal(from_strip.sin_angle, from_grid.sin_angle)
+
+
+def test_border_strip_rejects_unknown_borders():
+    with pytest.raises(ValueError, match='Unknown border'):
+        border_strip(supergrid(), 'up')
+
+
+def curvilinear(shift):
+    x, y = np.meshgrid(np.linspace(-90, -60, 12), np.linspace(10, 30, 9))
+    return xarray.Dataset({'tos': (('ny', 'nx'), np.zeros(x.shape))},
+                          coords={'lon': (('ny', 'nx'), x + shift * y), 'lat': (('ny', 'nx'), y)})
+
+
+def test_grid_key_tells_curvilinear_grids_apart():
+    first, second = curvilinear(0.0), curvilinear(0.1)
+    assert grid_key(first, 'nx', 'ny') != grid_key(second, 'nx', 'ny')
+    # Same grid, other variables and values
+    same = curvilinear(0.0).assign(tos=lambda ds: ds['tos'] + 1).rename(tos='sos')
+    assert grid_key(first, 'nx', 'ny') == grid_key(same, 'nx', 'ny')
+    field = source_field()
+    assert grid_key(field) == grid_key(field.isel(z=0)) != grid_key(field.isel(lon=slice(1, None)))
+
+
+def test_halo_window_bounds_and_margin():
+    source = source_field()
+    lon, lat = np.array([-80.1, -79.6]), np.array([20.05, 20.3])
+    window = halo_window(source, lon, lat, 'lon', 'lat')
+    inner = source.isel(window)
+    # One source spacing beyond the targets on each side, and no more
+    assert inner['lon'].values[[0, -1]].tolist() == [-80.25, -79.5]
+    assert inner['lat'].values[[0, -1]].tolist() == [20.0, 20.5]
+    wider = halo_window(source, lon, lat, 'lon', 'lat', margin=2)
+    assert wider['lon'] == slice(window['lon'].start - 2, window['lon'].stop + 2)
+    # Margins stop at the edges of the source
+    edge = halo_window(source, [-100.0], [0.0], 'lon', 'lat', margin=5)
+    assert edge['lon'].start == 0 and edge['lat'].start == 0
+
+
+def test_halo_window_wraps_longitude_and_handles_curvilinear_sources():
+    source = source_field()
+    lon, lat = np.array([-80.1, -79.6]), np.array([20.05, 20.3])
+    window = halo_window(source, lon, lat, 'lon', 'lat')
+    assert halo_window(source, lon + 360.0, lat, 'lon', 'lat') == window
+    x, y = np.meshgrid(source['lon'].values, source['lat'].values)
+    curvilinear_source = xarray.Dataset(coords={'lon': (('ny', 'nx'), x), 'lat': (('ny', 'nx'), y)})
+    assert halo_window(curvilinear_source, lon, lat, 'nx', 'ny') == {'nx': window['lon'], 'ny': window['lat']}
+    # Targets off the source keep the whole source
+    assert halo_window(source, [10.0], [60.0], 'lon', 'lat') == {'lon': slice(0, 200), 'lat': slice(0, 180)}
+
+
+def segment_file(segment, ntime, chunksizes=None):
+    n = segment.nx
+    ds = xarray.Dataset({
+        f'thetao_{segment.segstr}': (('time', f'nz_{segment.segstr}', f'nx_{segment.segstr}'), np.ones((ntime, 3, n))),
+        f'lon_{segment.segstr}': ((f'nx_{segment.segstr}', ), segment.coords['lon'].values),
+        f'lat_{segment.segstr}': ((f'nx_{segment.segstr}', ), segment.coords['lat'].values),
+    }, coords={'time': np.arange(ntime, dtype='float64')})
+    if chunksizes is not None:
+        ds[f'thetao_{segment.segstr}'].encoding['chunksizes'] = chunksizes
+    return ds
+
+
+def test_chunk_encoding_follows_each_dataset(segment):
+    name = f'thetao_{segment.segstr}'
+    segment.to_netcdf(segment_file(segment, 4, chunksizes=(4, 3, segment.nx)), 'thetao', suffix='a')
+    segment.to_netcdf(segment_file(segment, 2), 'thetao', suffix='b')
+    segment.to_netcdf(segment_file(segment, 1), 'thetao', suffix='c')
+    chunks = {}
+    for suffix in 'abc':
+        with xarray.open_dataset(f"{segment.output_dir}/thetao_001_{suffix}.nc") as written:
+            chunks[suffix] = written[name].encoding.get('chunksizes')
+    # Each file keeps its own chunks, or gets one chunk per record, not the first file's
+    assert chunks['a'] == (4, 3, segment.nx)
+    assert chunks['b'] == (1, 3, segment.nx)
+    assert chunks['c'] != (4, 3, segment.nx)
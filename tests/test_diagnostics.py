@@ -0,0 +1,30 @@
+# author: 'Jing Chen'
+# description: 'Streaming field statistics and verbosity levels of Diagnostics'
+# created: '2025-08-05'
+import numpy as np
+import xarray
+
+from diagnostics import Diagnostics, field_stats
+
+
+def test_field_stats_match_numpy():
+    values = np.random.default_rng(0).normal(size=(7, 301))
+    values[values > 1.5] = np.nan
+    stats = field_stats(values, block_size=64)
+    assert stats['min'] == np.nanmin(values) and stats['max'] == np.nanmax(values)
+    assert np.isclose(stats['mean'], np.nanmean(values))
+    assert stats['nan_count'] == np.isnan(values).sum() and stats['size'] == values.size
+
+
+def test_field_stats_all_nan():
+    stats = field_stats(np.full(10, np.nan))
+    assert stats['min'] is None and stats['mean'] is None and stats['nan_count'] == 10
+
+
+def test_verbosity_levels():
+    ds = xarray.Dataset({'ssh': ('x', np.arange(3.0)), 'temp': (('z', 'x'), np.ones((2, 3)))})
+    for verbosity, expected in [(0, set()), (1, {'ssh'}), (2, {'ssh', 'temp'})]:
+        diag = Diagnostics(verbosity)
+        diag.check('output', ds[['ssh']])
+        diag.check('output', ds[['temp']], level=2)
+        assert set(diag.stages.get('output', {})) == expected
@@ -0,0 +1,56 @@
+# author: 'Jing Chen'
+# description: 'fill_missing against the xarray bfill/ffill reference, on in-memory and lazily loaded data'
+# created: '2025-08-05'
+import numpy as np
+import pytest
+import xarray
+
+from boundary import fill_missing
+
+
+def column_data(seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.random((2, 6, 11))
+    values[rng.random(values.shape) < 0.3] = np.nan
+    values[:, -2:, :] = np.nan
+    return xarray.Dataset({'temp': (('time', 'z', 'locations'), values),
+                           'ssh': (('time', 'locations'), values[:, 0, :].copy())})
+
+
+def reference(ds, fill='b'):
+    horizontal = ds.bfill('locations') if fill == 'b' else ds.ffill('locations')
+    return horizontal.ffill('z').fillna(0)
+
+
+@pytest.mark.parametrize('fill', ['b', 'f'])
+def test_matches_xarray(fill):
+    ds = column_data()
+    filled = fill_missing(ds, fill=fill)
+    xarray.testing.assert_identical(filled, reference(ds, fill))
+    # The input is left alone unless inplace
+    assert ds['temp'].isnull().any()
+
+
+def test_inplace_in_memory():
+    ds = column_data()
+    expected = reference(ds)
+    result = fill_missing(ds, inplace=True)
+    assert result is ds
+    xarray.testing.assert_identical(ds, expected)
+
+
+def test_inplace_lazily_loaded(tmp_path):
+    ds = column_data()
+    ds.to_netcdf(tmp_path / 'columns.nc')
+    with xarray.open_dataset(tmp_path / 'columns.nc', cache=False) as lazy:
+        fill_missing(lazy, inplace=True)
+        assert int(lazy['temp'].isnull().sum()) == 0
+        xarray.testing.assert_allclose(lazy, reference(ds))
+
+
+def test_inplace_chunked():
+    pytest.importorskip('dask')
+    ds = column_data().chunk({'time': 1})
+    fill_missing(ds, inplace=True)
+    assert int(ds['temp'].isnull().sum()) == 0
+    xarray.testing.assert_allclose(ds, reference(column_data()))
@@ -0,0 +1,79 @@
+# author: 'Jing Chen'
+# description: 'Run manifest fingerprints, staleness checks and per-day Zarr inputs'
+# created: '2025-08-05'
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+from manifest import RunManifest, input_fingerprint
+from merge_Glorys_nc import zarr_day_stamp
+from write_MOM6_glorys_boundary_daily import manifest_params, source_inputs
+
+
+def touch(file_path, text, mtime_ns=None):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as file:
+        file.write(text)
+    if mtime_ns is not None:
+        os.utime(file_path, ns=(mtime_ns, mtime_ns))
+
+
+def test_directory_fingerprint_sees_nested_chunks(tmp_path):
+    store = tmp_path / 'glorys.zarr'
+    touch(store / 'thetao' / '0.0.0.0', 'abcd', mtime_ns=10**18)
+    before = input_fingerprint(str(store))
+    # Same size, newer chunk two levels down
+    touch(store / 'thetao' / '0.0.0.0', 'dcba', mtime_ns=2 * 10**18)
+    assert input_fingerprint(str(store)) != before
+
+
+def test_zarr_inputs_are_per_day(tmp_path):
+    store = tmp_path / 'glorys.zarr'
+    config = {'hgrid': str(tmp_path / 'ocean_hgrid.nc'), 'glorys_zarr': str(store)}
+    day1, day2 = datetime(2024, 9, 26), datetime(2024, 9, 27)
+    touch(zarr_day_stamp(store, day1), 'merged')
+    inputs = source_inputs(day1, config)
+    assert inputs[-1] == str(zarr_day_stamp(store, day1))
+    fingerprints = [input_fingerprint(f) for f in inputs if os.path.exists(f)]
+    # Appending the next day (chunks and its stamp) leaves the first day's inputs unchanged
+    touch(store / 'thetao' / '1.0.0.0', 'new day')
+    touch(zarr_day_stamp(store, day2), 'merged')
+    assert [input_fingerprint(f) for f in source_inputs(day1, config) if os.path.exists(f)] == fingerprints
+    # A store without stamps is fingerprinted as a whole
+    config['glorys_zarr'] = str(tmp_path / 'old.zarr')
+    assert source_inputs(day1, config)[-1] == config['glorys_zarr']
+
+
+def test_manifest_resume_and_staleness(tmp_path):
+    manifest = RunManifest(str(tmp_path / '.manifest'))
+    date = datetime(2024, 9, 26)
+    source = str(tmp_path / 'source.nc')
+    output = str(tmp_path / 'thetao_001_20240926.nc')
+    touch(source, 'source', mtime_ns=10**18)
+    touch(output, 'output')
+    params = {'border': 'south'}
+    assert not manifest.is_complete(date, 1, 'thetao', [source], output, params)
+    manifest.record(date, 1, 'thetao', [source], output, params)
+    assert manifest.is_complete(date, 1, 'thetao', [source], output, params)
+    # Changed settings, a changed input or a changed output make it stale
+    assert not manifest.is_complete(date, 1, 'thetao', [source], output, {'border': 'north'})
+    touch(output, 'truncated')
+    assert not manifest.is_complete(date, 1, 'thetao', [source], output, params)
+    touch(output, 'output')
+    touch(source, 'source', mtime_ns=2 * 10**18)
+    assert not manifest.is_complete(date, 1, 'thetao', [source], output, params)
+
+
+def test_manifest_params_follow_output_policy():
+    segment = SimpleNamespace(border='south', interfaces=None, output_policy=None)
+    assert manifest_params(segment) == {'border': 'south'}
+    trimmed = SimpleNamespace(border='south', interfaces=None, output_policy={'complevel': 4, 'keepbits': 12})
+    relaxed = SimpleNamespace(border='south', interfaces=None, output_policy={'complevel': 4, 'keepbits': None})
+    assert manifest_params(trimmed) != manifest_params(relaxed)
+
+
+def test_manifest_params_follow_model_layers():
+    levels = SimpleNamespace(border='south', interfaces=None, output_policy=None)
+    layers = SimpleNamespace(border='south', interfaces=[0.0, 2.0, 15.0], output_policy=None)
+    assert manifest_params(layers) == {'border': 'south', 'layers': 2}
+    assert manifest_params(levels) != manifest_params(layers)
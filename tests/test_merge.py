@@ -0,0 +1,113 @@
+# author: 'Jing Chen'
+# description: 'Merging raw GLORYS downloads into daily files'
+# created: '2025-08-05'
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+import xarray
+
+from merge_Glorys_nc import merge_range, open_merged_day, open_zarr_day
+
+DATE = datetime(2024, 9, 26)
+LAT = np.arange(0.0, 11.0)
+LON = np.arange(-30.0, -19.0)
+
+
+def write_downloads(directory, records=1, seed=0, date=DATE):
+    """Small files named and laid out like one day of GLORYS downloads (see download_cmems.py)."""
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    dims = ('time', 'depth', 'latitude', 'longitude')
+
+    def fields(names, hours):
+        shape = (len(hours), 2 if 'sea_surface_height' not in names else 1, LAT.size, LON.size)
+        return xarray.Dataset({name: (dims, rng.random(shape)) for name in names},
+                              coords={'time': ('time', hours, {'units': f'hours since {date:%Y-%m-%d}'}),
+                                      'depth': [0.5, 10.0][:shape[1]], 'latitude': LAT, 'longitude': LON})
+
+    date_str = f"{date:%Y%m%d}"
+    hours = 6.0 * np.arange(records)
+    for key, names in [('thetao', ['thetao']), ('so', ['so']), ('uovo', ['uo', 'vo'])]:
+        fields(names, hours).to_netcdf(directory / f"glo12_rg_6h-i_{date_str}-00h_3D-{key}_hcst.nc")
+    fields(['sea_surface_height'], np.arange(24.0)).to_netcdf(directory / f"MOL_{date_str}.nc")
+    return directory
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {'input_dir': str(tmp_path / 'raw' / '{date}'), 'output_dir': str(tmp_path / 'merged'),
+            'lat_bounds': [2.0, 8.0], 'lon_bounds': [-28.0, -22.0]}
+
+
+@pytest.mark.parametrize('records', [1, 4])
+def test_daily_merge_keeps_the_first_record(tmp_path, config, records):
+    raw = write_downloads(tmp_path / 'raw' / f"{DATE:%Y%m%d}", records)
+    with open_merged_day(DATE, config) as ds, \
+            xarray.open_dataset(raw / f"glo12_rg_6h-i_{DATE:%Y%m%d}-00h_3D-thetao_hcst.nc") as thetao, \
+            xarray.open_dataset(raw / f"MOL_{DATE:%Y%m%d}.nc") as ssh:
+        assert ds.sizes['time'] == 1 and ds.sizes['latitude'] == 7 and ds.sizes['longitude'] == 7
+        window = dict(latitude=slice(2, 9), longitude=slice(2, 9))
+        np.testing.assert_array_equal(ds['thetao'].values, thetao['thetao'].isel(time=[0], **window).values)
+        np.testing.assert_array_equal(ds['zos'].values, ssh['sea_surface_height'].isel(time=[0], depth=0, **window).values)
+        assert ds['time'].values[0] == thetao['time'].values[0]
+
+
+def test_sub_daily_merge_keeps_every_record(tmp_path, config):
+    write_downloads(tmp_path / 'raw' / f"{DATE:%Y%m%d}", records=4)
+    with open_merged_day(DATE, dict(config, sub_daily=True)) as ds:
+        assert ds.sizes['time'] == 4 and ds.sizes['time_ssh'] == 24
+        assert ds['zos'].dims == ('time_ssh', 'latitude', 'longitude')
+
+
+def days(tmp_path, n=3):
+    dates = [DATE + timedelta(days=i) for i in range(n)]
+    for i, date in enumerate(dates):
+        write_downloads(tmp_path / 'raw' / f"{date:%Y%m%d}", seed=i, date=date)
+    return dates
+
+
+def test_merge_range_is_repeatable(tmp_path, config):
+    dates = days(tmp_path)
+    files = merge_range(dates[0], dates[-1], config, workers=2)
+    assert [file.name for file in files] == [f"GLOBAL_ANALYSISFORECAST_PHY_{date:%Y-%m-%d}.nc" for date in dates]
+    first = [xarray.load_dataset(file) for file in files]
+    # Merging again, in one process, rewrites the same files
+    assert merge_range(dates[0], dates[-1], config) == files
+    for file, merged, date in zip(files, first, dates):
+        assert xarray.load_dataset(file).identical(merged)
+        raw = tmp_path / 'raw' / f"{date:%Y%m%d}" / f"glo12_rg_6h-i_{date:%Y%m%d}-00h_3D-thetao_hcst.nc"
+        with xarray.open_dataset(raw) as thetao:
+            window = dict(latitude=slice(2, 9), longitude=slice(2, 9))
+            np.testing.assert_array_equal(merged['thetao'].values, thetao['thetao'].isel(**window).values)
+        with open_merged_day(date, config) as ds:
+            assert ds.load().identical(merged)
+
+
+def test_zarr_merge_is_repeatable(tmp_path, config):
+    pytest.importorskip('zarr')
+    pytest.importorskip('dask')
+    dates = days(tmp_path)
+    config = dict(config, zarr_store=str(tmp_path / 'glorys.zarr'), zarr_chunks={'latitude': 4, 'longitude': 4})
+    merge_range(dates[0], dates[1], config)
+    merge_range(dates[2], dates[2], config)
+    with xarray.open_zarr(config['zarr_store']) as store:
+        first = store.load()
+    assert first.sizes['time'] == 3
+    # Merging days already in the store rewrites their records instead of appending them again
+    merge_range(dates[1], dates[2], config)
+    with xarray.open_zarr(config['zarr_store']) as store:
+        assert store.load().identical(first)
+        for date in dates:
+            with open_merged_day(date, config) as ds:
+                xarray.testing.assert_allclose(open_zarr_day(store, date, decode_times=True).load(), ds.load())
+
+
+def test_raw_source_matches_the_merged_file(tmp_path, config):
+    date = days(tmp_path, 1)[0]
+    merged_file = merge_range(date, date, config)[0]
+    # As write_day reads the raw downloads in memory, and the merged file
+    with open_merged_day(date, config, decode_times=False) as raw, \
+            xarray.open_dataset(merged_file, decode_times=False) as merged:
+        xarray.testing.assert_equal(raw.load(), merged.load())
+        assert raw['time'].attrs['units'] == merged['time'].attrs['units']
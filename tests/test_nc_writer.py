@@ -0,0 +1,138 @@
+# author: 'Jing Chen'
+# description: 'Precision trimming, record chunks and the output policy of the NetCDF writer'
+# created: '2025-08-05'
+import os
+import threading
+
+import numpy as np
+import pytest
+import xarray
+import yaml
+
+import nc_writer
+from nc_writer import (DEFAULT_POLICY, NetCDFWriter, is_geometry, load_output_policy, record_chunks, trim_precision,
+                       write_netcdf)
+
+
+@pytest.mark.parametrize('dtype, keepbits', [('float64', 12), ('float32', 7), ('float64', 30)])
+def test_trim_precision_error_bound(dtype, keepbits):
+    values = np.random.default_rng(0).normal(scale=100, size=1000).astype(dtype)
+    values[::17] = np.nan
+    trimmed = trim_precision(values, keepbits)
+    valid = ~np.isnan(values)
+    assert np.array_equal(np.isnan(trimmed), ~valid)
+    # Rounding to keepbits mantissa bits is accurate to half a unit in the last kept bit
+    assert np.all(np.abs(trimmed[valid] - values[valid]) <= np.abs(values[valid]) * 2.0**-(keepbits + 1))
+    # The dropped bits are zero
+    uint = np.uint64 if dtype == 'float64' else np.uint32
+    nbits = 52 if dtype == 'float64' else 23
+    assert np.all(trimmed[valid].view(uint) & uint((1 << (nbits - keepbits)) - 1) == 0)
+
+
+def test_trim_precision_leaves_other_dtypes():
+    values = np.arange(10)
+    assert trim_precision(values, 3) is values
+    floats = np.linspace(0, 1, 5)
+    assert np.array_equal(trim_precision(floats, None), floats)
+
+
+def test_record_chunks():
+    assert record_chunks((10, 50, 200), ('time', 'z', 'locations'), 8) == (1, 50, 200)
+    # A record above max_chunk_mb is split along its leading dimension
+    chunks = record_chunks((2, 100, 2**20), ('time', 'z', 'locations'), 8, max_chunk_mb=64)
+    assert chunks[0] == 1 and chunks[1] * chunks[2] * 8 <= 64 * 2**20
+
+
+def test_is_geometry():
+    assert is_geometry('lon_segment_001') and is_geometry('lat_segment_002')
+    assert is_geometry('dz_thetao_segment_001') and is_geometry('dz_u_segment_003')
+    assert not is_geometry('thetao_segment_001') and not is_geometry('u_segment_001')
+
+
+def segment_dataset():
+    rng = np.random.default_rng(1)
+    n = 40
+    return xarray.Dataset({
+        'lon_segment_001': (('nx_segment_001',), -98.123456789 + 0.0314159 * np.arange(n)),
+        'lat_segment_001': (('nx_segment_001',), 5.987654321 + 0.0271828 * np.arange(n)),
+        'thetao_segment_001': (('time', 'nz_segment_001', 'nx_segment_001'), 20 + rng.random((2, 5, n))),
+        'dz_thetao_segment_001': (('time', 'nz_segment_001', 'nx_segment_001'),
+                                  np.broadcast_to(1.0 + np.arange(5.)[:, None] / 3, (2, 5, n))),
+    }, coords={'time': [0.5, 1.5]})
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_policy_keeps_segment_geometry(tmp_path, background):
+    ds = segment_dataset()
+    policy = dict(DEFAULT_POLICY, keepbits=12)
+    filename = str(tmp_path / 'thetao_001.nc')
+    if background:
+        with NetCDFWriter(1) as writer:
+            writer.submit(ds, filename, policy=policy)
+    else:
+        write_netcdf(ds, filename, policy=policy)
+    with xarray.open_dataset(filename) as written:
+        for name in ['lon_segment_001', 'lat_segment_001', 'dz_thetao_segment_001']:
+            assert np.array_equal(written[name].values, ds[name].values), name
+        field = written['thetao_segment_001'].values
+        assert not np.array_equal(field, ds['thetao_segment_001'].values)
+        assert np.allclose(field, ds['thetao_segment_001'].values, rtol=2.0**-12)
+        assert written['thetao_segment_001'].encoding['zlib']
+
+
+@pytest.fixture
+def held_writes(monkeypatch):
+    """Writes that record their file name and wait for release before finishing; 'bad' files fail."""
+    release = threading.Event()
+    started = []
+
+    def write(ds, filename, *args):
+        started.append(filename)
+        release.wait(5)
+        if filename == 'bad':
+            raise OSError('disk full')
+        return filename
+
+    monkeypatch.setattr(nc_writer, 'write_netcdf', write)
+    return release, started
+
+
+def test_submit_waits_for_a_free_slot(held_writes):
+    release, started = held_writes
+    ds = xarray.Dataset({'a': ('x', [1.0])})
+    with NetCDFWriter(1, max_pending=2) as writer:
+        writer.submit(ds, 'a')
+        writer.submit(ds, 'b')
+        third = threading.Thread(target=writer.submit, args=(ds, 'c'))
+        third.start()
+        third.join(0.2)
+        # Two writes are queued or running, so the third waits
+        assert third.is_alive()
+        release.set()
+        third.join(5)
+        assert not third.is_alive()
+        assert writer.flush() == ['a', 'b', 'c']
+
+
+def test_flush_raises_a_failed_write(held_writes):
+    release, started = held_writes
+    release.set()
+    ds = xarray.Dataset({'a': ('x', [1.0])})
+    writer = NetCDFWriter(2)
+    for name in ['a', 'bad', 'c']:
+        writer.submit(ds, name)
+    with pytest.raises(OSError, match='disk full'):
+        writer.flush()
+    # Every write ran before the error was raised, and the writer is still usable
+    assert sorted(started) == ['a', 'bad', 'c']
+    writer.submit(ds, 'd')
+    assert writer.flush() == ['d']
+    writer.close()
+
+
+@pytest.mark.parametrize('config', ['boundary/glorys_obc_C3200_3km_large.yaml',
+                                    'initial/glorys_ic_20240920_3200_3km_fill_at_the_end.yaml'])
+def test_shipped_configs_keep_the_default_format(config):
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(repo_dir, config)) as f:
+        assert load_output_policy(yaml.safe_load(f)) is None
@@ -0,0 +1,78 @@
+# author: 'Jing Chen'
+# description: 'Worker and tile recommendations of the IC and OBC plans fit the memory budget'
+# created: '2025-08-05'
+import numpy as np
+import pytest
+import xarray
+
+import planning
+import write_glorys_IC_3200_3km_20240920_fill_at_the_end as write_ic
+from planning import COMPRESSION_RATIO, recommend_blocks, recommend_workers
+
+GB = 1024 ** 3
+
+
+@pytest.mark.parametrize('memory', [4 * GB, 16 * GB, 100 * GB])
+@pytest.mark.parametrize('peak', [0.3 * GB, 1.7 * GB, 3 * GB])
+def test_recommended_workers_fit_the_budget(memory, peak):
+    workers = recommend_workers(peak, memory=memory, cpus=1024)
+    assert workers * peak <= 0.8 * memory
+    # One more worker would not fit
+    assert (workers + 1) * peak > 0.8 * memory
+
+
+def test_recommended_workers_limits():
+    # Never more workers than CPUs, at least one even if it doesn't fit, all CPUs if memory is unknown
+    assert recommend_workers(GB, memory=100 * GB, cpus=4) == 4
+    assert recommend_workers(10 * GB, memory=4 * GB, cpus=4) == 1
+    assert recommend_workers(GB, memory=0, cpus=6) == 6
+    assert recommend_workers(GB, memory=4 * GB, cpus=64, headroom=0.5) == 2
+
+
+@pytest.mark.parametrize('memory', [4 * GB, 16 * GB])
+@pytest.mark.parametrize('peak', [0.5 * GB, 7 * GB, 33 * GB])
+def test_recommended_blocks_fit_the_budget(memory, peak):
+    blocks = recommend_blocks(peak, memory=memory)
+    assert peak / blocks <= 0.5 * memory
+    # The fewest blocks that fit
+    assert blocks == 1 or peak / (blocks - 1) > 0.5 * memory
+
+
+def test_recommended_blocks_without_memory():
+    assert recommend_blocks(33 * GB, memory=0) == 1
+
+
+@pytest.fixture
+def ic_config(tmp_path, monkeypatch):
+    """IC config on a 1/12 degree source and a 1441 x 1441 supergrid, without reading GLORYS."""
+    shape = (1, 50, 445, 853)
+    temp = xarray.DataArray(np.broadcast_to(np.float32(0.0), shape), dims=('time', 'depth', 'lat', 'lon'))
+    monkeypatch.setattr(write_ic, 'open_glorys_fields', lambda config, lon_range, lat_range: [temp] * 5)
+    xarray.DataArray(np.arange(75.0), dims='nz').to_netcdf(tmp_path / 'vgrid.nc')
+    xarray.Dataset({'x': (('nyp', 'nxp'), np.zeros((1441, 1441)))}).to_netcdf(tmp_path / 'hgrid.nc')
+    monkeypatch.setattr(planning, 'cpu_count', lambda: 64)
+    return {'vgrid_file': str(tmp_path / 'vgrid.nc'), 'grid_file': str(tmp_path / 'hgrid.nc'),
+            'output_file': str(tmp_path / 'ic.nc')}
+
+
+@pytest.mark.parametrize('memory', [2 * GB, 8 * GB, 64 * GB])
+def test_initial_tiles_fit_the_budget(ic_config, monkeypatch, memory):
+    monkeypatch.setattr(planning, 'available_memory', lambda: memory)
+    plan = write_ic.plan_initial(ic_config)
+    ty, tx = plan.recommendations['tiles']
+    # Each tile's share of the peak fits in half the memory, and the tile workers together in 80%
+    assert plan.peak_memory / (ty * tx) <= 0.5 * memory
+    workers = plan.recommendations['tile_workers']
+    assert 1 <= workers and workers * plan.peak_memory / (ty * tx) <= 0.8 * memory
+    rows, columns = map(int, plan.recommendations['tile rows x columns'].split(' x '))
+    assert ty * rows >= 720 and tx * columns >= 720
+
+
+def test_initial_compressed_output(ic_config, monkeypatch):
+    monkeypatch.setattr(planning, 'available_memory', lambda: 8 * GB)
+    plan = write_ic.plan_initial(ic_config)
+    # float64 temperature, salinity, u, v on 720 x 720 x 75 cells and SSH
+    assert plan.outputs['ic.nc'] == 8 * (4 * 75 + 1) * 720 * 720
+    assert 'compressed (rough)' not in plan.outputs
+    plan = write_ic.plan_initial(dict(ic_config, output_policy={'default': {'zlib': True}}))
+    assert plan.outputs['compressed (rough)'] == COMPRESSION_RATIO * plan.outputs['ic.nc']
@@ -0,0 +1,83 @@
+# author: 'Jing Chen'
+# description: 'Stage totals of the profiler, per-stage memory growth and stages merged from worker processes'
+# created: '2025-08-05'
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from profiling import PROFILER, StageProfiler, merge_stages, run_profiled, stage
+
+
+def staged_task(value):
+    with stage('task'), stage('inner'):
+        return value * 2
+
+
+@pytest.fixture
+def profiler():
+    enabled, stages = PROFILER.enabled, PROFILER.stages
+    PROFILER.enabled, PROFILER.stages = True, {}
+    yield PROFILER
+    PROFILER.enabled, PROFILER.stages = enabled, stages
+
+
+def entry(calls, wall, cpu, growth, high_water):
+    return {'calls': calls, 'wall': wall, 'cpu': cpu, 'rss_growth_mb': growth, 'rss_high_water_mb': high_water}
+
+
+def test_merge_adds_totals_and_keeps_largest_memory():
+    profiler = StageProfiler(enabled=True)
+    profiler.merge({'a': entry(1, 1.0, 0.5, 3.0, 10.0)})
+    profiler.merge({'a': entry(2, 2.0, 1.0, 4.0, 5.0)})
+    assert profiler.stages == {'workers/a': entry(3, 3.0, 1.5, 4.0, 10.0)}
+
+
+def allocate_then_idle():
+    profiler = StageProfiler(enabled=True)
+    with profiler.stage('allocate'):
+        block = np.ones(2**28 // 8)
+    del block
+    with profiler.stage('after'):
+        pass
+    return profiler.stages
+
+
+def test_memory_growth_is_per_stage():
+    # A fresh process, so no earlier test has already raised the high-water mark
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        stages = pool.submit(allocate_then_idle).result()
+    allocate, after = stages['allocate'], stages['after']
+    # Only the stage that raised the high-water mark reports growth; the mark itself carries over
+    assert allocate['rss_growth_mb'] > 128
+    assert after['rss_growth_mb'] < 16
+    assert after['rss_high_water_mb'] >= allocate['rss_high_water_mb']
+
+
+def test_worker_stages_reach_parent(profiler):
+    with stage('parent'):
+        pass
+    with ProcessPoolExecutor(2) as pool:
+        futures = [pool.submit(run_profiled, PROFILER.enabled, staged_task, value) for value in range(3)]
+        results = []
+        for future in futures:
+            result, stages = future.result()
+            merge_stages(stages)
+            results.append(result)
+    assert results == [0, 2, 4]
+    # Each task reports only its own stages, not the parent's or earlier tasks'
+    assert set(profiler.stages) == {'parent', 'workers/task', 'workers/task/inner'}
+    assert profiler.stages['workers/task']['calls'] == 3
+    assert profiler.stages['parent']['calls'] == 1
+
+
+def test_disabled_worker_returns_no_stages():
+    assert run_profiled(False, staged_task, 1) == (2, {})
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = StageProfiler()
+    with profiler.stage('read'):
+        pass
+    assert profiler.stages == {}
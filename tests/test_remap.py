@@ -0,0 +1,59 @@
+# author: 'Jing Chen'
+# description: 'Conservative vertical remapping of boundary.py'
+# created: '2025-08-05'
+import numpy as np
+import xarray
+
+from boundary import Segment, layer_thickness, remap_columns, remap_matrix
+
+SOURCE = np.array([0.0, 10.0, 30.0, 60.0, 100.0])
+
+
+def test_rows_sum_to_one_inside_the_source_column():
+    weights = remap_matrix(SOURCE, [0.0, 5.0, 25.0, 100.0, 150.0])
+    assert weights.shape == (4, 4)
+    assert np.allclose(weights[:3].sum(axis=1), 1.0)
+    # The last target layer overlaps the source only down to 100 m
+    assert np.allclose(weights[3], [0.0, 0.0, 0.0, 0.0])
+    assert np.allclose(weights[1], [0.25, 0.75, 0.0, 0.0])
+
+
+def test_identical_layers_give_identity():
+    assert np.array_equal(remap_matrix(SOURCE, SOURCE), np.eye(4))
+
+
+def test_column_integral_is_conserved():
+    target = np.array([0.0, 7.0, 19.0, 42.0, 77.0, 100.0])
+    values = np.random.default_rng(0).random((3, 4, 2))
+    remapped = remap_columns(values, remap_matrix(SOURCE, target), axis=1)
+    assert remapped.shape == (3, 5, 2)
+    integral = lambda v, interfaces: np.einsum('izj,z->ij', v, np.diff(interfaces))
+    assert np.allclose(integral(remapped, target), integral(values, SOURCE))
+
+
+def test_nans_are_left_out_of_the_mean():
+    weights = remap_matrix(SOURCE, [0.0, 30.0, 100.0])
+    values = np.array([1.0, 3.0, np.nan, np.nan])
+    remapped = remap_columns(values[:, np.newaxis], weights, axis=0)[:, 0]
+    # 10 m of 1 and 20 m of 3 in the first layer; only NaNs below
+    assert np.isclose(remapped[0], 7.0 / 3.0) and np.isnan(remapped[1])
+    integers = remap_columns(np.arange(4)[:, np.newaxis], weights, axis=0)
+    assert np.allclose(integers[:, 0], weights @ np.arange(4))
+
+
+def test_segment_remaps_columns_onto_the_model_layers(tmp_path):
+    x, y = np.meshgrid(-80 + 0.1 * np.arange(21), 20 + 0.1 * np.arange(17))
+    hgrid = xarray.Dataset({'x': (('nyp', 'nxp'), x), 'y': (('nyp', 'nxp'), y),
+                            'angle_dx': (('nyp', 'nxp'), np.zeros(x.shape))})
+    interfaces = np.array([0.0, 2.0, 15.0, 70.0, 400.0])
+    segment = Segment(1, 'south', hgrid, output_dir=str(tmp_path), interfaces=interfaces)
+    z = np.array([1.0, 10.0, 50.0, 200.0])
+    values = np.random.default_rng(0).random((2, z.size, 5))
+    ds = xarray.Dataset({'temp': (('time', 'z', 'locations'), values)}, coords={'z': z})
+    remapped = segment.remap_vertical(ds, max_depth=400.0)
+    assert np.allclose(remapped['z'], [1.0, 8.5, 42.5, 235.0])
+    # The column integral over the source layers is kept on the model layers
+    assert np.allclose((remapped['temp'].values * np.diff(interfaces)[:, None]).sum(axis=1),
+                       (values * layer_thickness(z, max_depth=400.0)[:, None]).sum(axis=1))
+    # Thicknesses then come from the model layers
+    assert np.array_equal(segment.thickness(remapped).isel(time=0, locations=0), np.diff(interfaces))
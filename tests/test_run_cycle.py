@@ -0,0 +1,82 @@
+# author: 'Jing Chen'
+# description: 'Task graph of the cycle orchestrator: Zarr ordering, domains and unresolved dependencies'
+# created: '2025-08-05'
+import os
+
+import pytest
+
+from merge_Glorys_nc import zarr_day_stamp
+from run_cycle import Task, build_tasks, run_tasks, up_to_date
+
+
+def cycle_config(tmp_path):
+    return {
+        'first_date': '2024-09-26',
+        'last_date': '2024-09-28',
+        'merge': {'input_dir': str(tmp_path / 'raw' / '{date}'), 'zarr_store': str(tmp_path / 'glorys.zarr')},
+        'boundary': {
+            'hgrid': str(tmp_path / 'ocean_hgrid.nc'), 'output_dir': str(tmp_path / 'obc'),
+            'variables': ['thetao', 'zos'], 'segments': [{'id': 1, 'border': 'south'}],
+        },
+    }
+
+
+def test_zarr_readers_wait_for_every_append(tmp_path):
+    tasks = build_tasks(cycle_config(tmp_path))
+    merges = [name for name in tasks if name.startswith('merge[')]
+    assert len(merges) == 3
+    first_day = tasks['boundary[2024-09-26,001]']
+    assert first_day.deps == ['merge[2024-09-26]']
+    assert sorted(first_day.after) == sorted(merges)
+
+
+def test_zarr_merges_use_the_stamps_of_merge_zarr(tmp_path):
+    config = cycle_config(tmp_path)
+    tasks = build_tasks(config)
+    merge = tasks['merge[2024-09-27]']
+    stamp = zarr_day_stamp(config['merge']['zarr_store'], merge.args[0])
+    assert merge.outputs == [str(stamp)]
+    # The stamp merge_zarr writes is what marks the day merged, and removing it re-runs the merge
+    stamp.parent.mkdir(parents=True)
+    stamp.write_text('merged\n')
+    assert up_to_date(merge.outputs, merge.inputs)
+    stamp.unlink()
+    assert not up_to_date(merge.outputs, merge.inputs)
+
+
+def test_raw_readers_need_only_their_day(tmp_path):
+    config = cycle_config(tmp_path)
+    config['boundary']['glorys_raw'] = {'input_dir': config['merge']['input_dir']}
+    tasks = build_tasks(config)
+    assert all(not task.after for name, task in tasks.items() if name.startswith('boundary['))
+
+
+def test_domains_get_their_own_tasks(tmp_path):
+    config = cycle_config(tmp_path)
+    config['boundary']['domains'] = [{'name': 'coarse', 'output_dir': str(tmp_path / 'coarse')},
+                                     {'name': 'fine', 'output_dir': str(tmp_path / 'fine'), 'consolidate': True}]
+    tasks = build_tasks(config)
+    coarse, fine = tasks['boundary[coarse,2024-09-26,001]'], tasks['boundary[fine,2024-09-26,001]']
+    assert coarse.args[2]['name'] == 'coarse' and fine.args[2]['name'] == 'fine'
+    assert coarse.outputs == [str(tmp_path / 'coarse' / f"{v}_001_20240926.nc") for v in ['thetao', 'zos']]
+    assert fine.outputs == [str(tmp_path / 'fine' / 'obc_001_20240926.nc')]
+    assert tasks['concat[fine,001]'].deps == [f"boundary[fine,2024-09-{day},001]" for day in (26, 27, 28)]
+    assert not any(name.startswith('boundary[2024') for name in tasks)
+
+
+def test_unresolved_dependencies_raise():
+    tasks = {
+        'ready': Task('ready', os.getpid),
+        'orphan': Task('orphan', os.getpid, deps=['ready', 'never_scheduled']),
+    }
+    with pytest.raises(RuntimeError, match='orphan waits on never_scheduled'):
+        run_tasks(tasks)
+
+
+def test_failed_dependencies_block():
+    tasks = {
+        'broken': Task('broken', os.listdir, args=('/nonexistent/run_cycle',)),
+        'child': Task('child', os.getpid, deps=['broken']),
+        'waits': Task('waits', os.getpid, after=['child']),
+    }
+    assert run_tasks(tasks) == {'broken': 'failed', 'child': 'blocked', 'waits': 'blocked'}
@@ -0,0 +1,101 @@
+# author: 'Jing Chen'
+# description: 'Round trips of SharedDataset and attach, in shared memory and scratch files'
+# created: '2025-08-05'
+import os
+import pickle
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+import xarray
+
+import shared_arrays
+from shared_arrays import SharedDataset, attach, detach
+
+
+def dataset():
+    rng = np.random.default_rng(0)
+    return xarray.Dataset(
+        {'thetao': (('z', 'lat', 'lon'), rng.random((2, 3, 4)), {'units': 'degC'}),
+         'zos': (('lat', 'lon'), rng.random((3, 4)).astype('float32'))},
+        coords={'lon': np.arange(4.0), 'lat': np.arange(3.0), 'z': [0.5, 1.5],
+                'mask': (('lat', 'lon'), np.ones((3, 4), dtype='int8'))},
+        attrs={'source': 'test'})
+
+
+def summed(spec):
+    ds = attach(spec)
+    return float(ds['thetao'].sum()), ds['zos'].dtype.str
+
+
+@pytest.fixture(params=['shm', 'scratch'])
+def scratch_dir(request, tmp_path):
+    return str(tmp_path / 'scratch') if request.param == 'scratch' else None
+
+
+def test_round_trip(scratch_dir):
+    ds = dataset()
+    with SharedDataset(ds, scratch_dir) as shared:
+        attached = attach(shared.spec)
+        assert attached.identical(ds)
+        assert shared.nbytes == ds['thetao'].nbytes + ds['zos'].nbytes + ds['mask'].nbytes
+        # Views are read-only, so workers can't change the shared copy
+        assert not attached['thetao'].values.flags.writeable
+        with pytest.raises(ValueError):
+            attached['thetao'].values[0, 0, 0] = 1.0
+        # Attaching again reuses the same memory
+        assert np.shares_memory(attach(shared.spec)['zos'].values, attached['zos'].values)
+        del attached
+        detach(shared.spec['id'])
+
+
+def test_workers_see_the_same_data(scratch_dir):
+    ds = dataset()
+    with SharedDataset(ds, scratch_dir) as shared, ProcessPoolExecutor(2) as pool:
+        results = list(pool.map(summed, [shared.spec] * 3))
+    assert results == [(float(ds['thetao'].sum()), '<f4')] * 3
+
+
+def test_close_releases_memory(scratch_dir):
+    shared = SharedDataset(dataset(), scratch_dir)
+    entries = shared.spec['arrays'].values()
+    shared.close()
+    if scratch_dir is None:
+        assert not any(os.path.exists(f"/dev/shm/{entry['block']}") for entry in entries)
+    else:
+        assert os.listdir(scratch_dir) == []
+
+
+def test_attach_keeps_only_recent_datasets(monkeypatch):
+    monkeypatch.setattr(shared_arrays, 'MAX_ATTACHED', 2)
+    monkeypatch.setattr(shared_arrays, '_ATTACHED', {})
+    datasets = [SharedDataset(dataset()) for _ in range(3)]
+    try:
+        for shared in datasets:
+            attach(shared.spec)
+        assert list(shared_arrays._ATTACHED) == [shared.spec['id'] for shared in datasets[1:]]
+    finally:
+        for shared in datasets:
+            detach(shared.spec['id'])
+            shared.close()
+
+
+def test_attaching_process_leaves_the_block_alone(tmp_path):
+    # A fresh interpreter has its own resource tracker, which would unlink whatever it tracks at exit
+    ds = dataset()
+    with SharedDataset(ds) as shared:
+        spec_file = tmp_path / 'spec.pkl'
+        spec_file.write_bytes(pickle.dumps(shared.spec))
+        script = ('import pickle, sys; from shared_arrays import attach; '
+                  'print(float(attach(pickle.load(open(sys.argv[1], "rb")))["thetao"].sum()))')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(shared_arrays.__file__))
+        result = subprocess.run([sys.executable, '-c', script, str(spec_file)],
+                                capture_output=True, text=True, env=env, check=True)
+        assert float(result.stdout) == float(ds['thetao'].sum())
+        assert 'leaked' not in result.stderr
+        blocks = [entry['block'] for entry in shared.spec['arrays'].values()]
+        assert all(os.path.exists(f'/dev/shm/{block}') for block in blocks)
+        assert attach(shared.spec).identical(ds)
+        detach(shared.spec['id'])
@@ -0,0 +1,47 @@
+# author: 'Jing Chen'
+# description: 'Entry points start without loading the regridding, flooding and plotting backends'
+# created: '2025-08-05'
+import os
+import subprocess
+import sys
+
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['xesmf', 'ESMF', 'esmpy', 'HCtFlood', 'matplotlib']
+
+# Importing any of the heavy modules fails, whether or not it is installed
+PROBE = """
+import runpy, sys
+
+class Blocked():
+    def find_spec(self, name, path=None, target=None):
+        if name.split('.')[0] in {heavy!r}:
+            raise ImportError(f"{{name}} imported at startup")
+
+sys.meta_path.insert(0, Blocked())
+{code}
+"""
+
+
+def probe(code):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        os.path.join(repo_dir, directory) for directory in ['boundary', 'initial', 'pipeline']))
+    return subprocess.run([sys.executable, '-c', PROBE.format(heavy=HEAVY_MODULES, code=code)],
+                          capture_output=True, text=True, env=env, cwd=repo_dir)
+
+
+@pytest.mark.parametrize('script', ['boundary/write_MOM6_glorys_boundary_daily.py', 'boundary/merge_Glorys_nc.py',
+                                    'initial/write_glorys_IC_3200_3km_20240920_fill_at_the_end.py'])
+def test_entry_points_start_without_backends(script):
+    result = probe(f"sys.argv = [{script!r}, '--help']\nrunpy.run_path({script!r}, run_name='__main__')")
+    assert result.returncode == 0, result.stderr
+    assert 'usage:' in result.stdout
+
+
+def test_backends_load_when_a_run_needs_them():
+    # The regridder is the first thing that needs xesmf
+    result = probe("import boundary\nboundary.reuse_regrid(None, None)")
+    assert result.returncode != 0
+    assert 'xesmf imported at startup' in result.stderr
@@ -0,0 +1,123 @@
+# author: 'Jing Chen'
+# description: 'Tidal regridding of Segment: ellipse rotation, post-rotation fill, flood windows and shared regridders'
+# created: '2025-08-05'
+import numpy as np
+import pytest
+import xarray
+
+import boundary
+from boundary import Segment, ap2ep, ep2ap, halo_window
+
+
+def nearest_regrid(calls):
+    """Stand-in for reuse_regrid: nearest source point of each segment point, no xesmf needed."""
+    def reuse_regrid(source, coords, **kwargs):
+        calls.append(kwargs['filename'])
+        lon, lat = source['lon'].values.ravel(), source['lat'].values.ravel()
+        nearest = [int(np.argmin((lon - x) ** 2 + (lat - y) ** 2))
+                   for x, y in zip(coords['lon'].values, coords['lat'].values)]
+
+        def regrid(ds):
+            out = {}
+            for name, da in ds.data_vars.items():
+                values = da.transpose('constituent', 'ny', 'nx').values.reshape(da.sizes['constituent'], -1)
+                out[name] = (('constituent', 'locations'), values[:, nearest])
+            return xarray.Dataset(out, coords={'constituent': ds['constituent']})
+        return regrid
+    return reuse_regrid
+
+
+def tidal_source(name, seed, land=True):
+    x, y = np.meshgrid(np.linspace(-82, -76, 25), np.linspace(18, 24, 25))
+    values = np.random.default_rng(seed).normal(size=(3,) + x.shape)
+    if land:
+        values[:, :, :3] = np.nan
+    return xarray.Dataset({name: (('constituent', 'ny', 'nx'), values)},
+                          coords={'lon': (('ny', 'nx'), x), 'lat': (('ny', 'nx'), y), 'constituent': [0, 1, 2]})
+
+
+TIME = xarray.DataArray([0.0], dims='time')
+
+
+@pytest.fixture
+def segment(tmp_path):
+    x, y = np.meshgrid(-80 + 0.1 * np.arange(21), 20 + 0.1 * np.arange(17))
+    hgrid = xarray.Dataset({'x': (('nyp', 'nxp'), x), 'y': (('nyp', 'nxp'), y),
+                            'angle_dx': (('nyp', 'nxp'), np.full(x.shape, 0.3))})
+    return Segment(1, 'south', hgrid, output_dir=str(tmp_path))
+
+
+@pytest.fixture
+def regrid_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(boundary, 'reuse_regrid', nearest_regrid(calls))
+    return calls
+
+
+def test_velocity_matches_ellipse_rotation(segment, regrid_calls):
+    sources = [tidal_source(name, seed, land=False) for seed, name in enumerate(['uRe', 'uIm', 'vRe', 'vIm'])]
+    ds = segment.regrid_tidal_velocity(*sources, time=TIME, write=False)
+    regrid = nearest_regrid([])(sources[0], segment.coords, filename='')
+    u, ui, v, vi = [regrid(src)[name].values for src, name in zip(sources, ['uRe', 'uIm', 'vRe', 'vIm'])]
+    # Baseline: convert to ellipses, reduce the inclination by the grid angle, convert back
+    sema, ecc, inc, pha = ap2ep(u + 1j * ui, v + 1j * vi)
+    inc -= segment.coords['angle'].values[np.newaxis, :]
+    ua, va, up, vp = ep2ap(sema, ecc, inc, pha)
+    seg = segment.segstr
+    np.testing.assert_allclose(ds[f'uamp_{seg}'].isel(time=0).squeeze().values, ua, rtol=1e-10)
+    np.testing.assert_allclose(ds[f'vamp_{seg}'].isel(time=0).squeeze().values, va, rtol=1e-10)
+    # Phases agree modulo 2 pi
+    for name, phase in [('uphase', up), ('vphase', vp)]:
+        diff = ds[f'{name}_{seg}'].isel(time=0).squeeze().values - phase
+        np.testing.assert_allclose(np.angle(np.exp(1j * diff)), 0, atol=1e-8)
+
+
+def test_post_rotation_fill(segment, regrid_calls, monkeypatch):
+    sources = [tidal_source(name, seed) for seed, name in enumerate(['uRe', 'uIm', 'vRe', 'vIm'])]
+    # Missing values that appear only in the rotation are filled from the next location
+    real_angle = np.angle
+
+    def angle_with_gap(z):
+        out = real_angle(z)
+        out[..., 2] = np.nan
+        return out
+
+    monkeypatch.setattr(boundary.np, 'angle', angle_with_gap)
+    ds = segment.regrid_tidal_velocity(*sources, time=TIME, write=False)
+    phase = ds[f'uphase_{segment.segstr}'].values
+    assert not np.isnan(phase).any()
+    np.testing.assert_array_equal(phase[..., 2], phase[..., 3])
+
+
+def test_tidal_jobs_share_regridders(segment, regrid_calls):
+    elevation = [tidal_source('hRe', 0), tidal_source('hIm', 1)]
+    velocity = [tidal_source(name, seed) for seed, name in enumerate(['uRe', 'uIm', 'vRe', 'vIm'])]
+    segment.regrid_tidal_elevation(*elevation, time=TIME, write=False)
+    segment.regrid_tidal_velocity(*velocity, time=TIME, write=False)
+    segment.regrid_tidal_elevation(*elevation, time=TIME, write=False)
+    # One source grid, so one set of weights for every tidal job
+    assert len(regrid_calls) == 1
+
+
+def atlas(name='hRe'):
+    """A tidal atlas much larger than the segment, with land over it."""
+    x, y = np.meshgrid(np.linspace(-100, -60, 161), np.linspace(0, 40, 161))
+    values = np.random.default_rng(0).normal(size=(4,) + x.shape)
+    values[:, (y >= 19.5) & (x >= -84.0) & (x <= -74.0)] = np.nan
+    return xarray.Dataset({name: (('constituent', 'ny', 'nx'), values)},
+                          coords={'lon': (('ny', 'nx'), x), 'lat': (('ny', 'nx'), y), 'constituent': [0, 1, 2, 3]})
+
+
+def test_tidal_flood_window_matches_whole_atlas(segment, flood):
+    source = atlas()
+    window = segment.flood_window(source, 'nx', 'ny')
+    assert window['nx'].stop - window['nx'].start < source.sizes['nx'] // 2
+    flooded = segment._flood_tidal(source, 'nx', 'ny')
+    stencil = halo_window(source, segment.coords['lon'].values, segment.coords['lat'].values, 'nx', 'ny')
+    inner = {dim: slice(stencil[dim].start - window[dim].start, stencil[dim].stop - window[dim].start)
+             for dim in stencil}
+    whole = flood(source['hRe'], xdim='nx', ydim='ny').isel(stencil)
+    np.testing.assert_array_equal(flooded['hRe'].isel(inner).values, whole.values)
+    # Chunks flooded in worker processes give the same result
+    parallel = segment._flood_tidal(source, 'nx', 'ny', chunk=1, workers=2)
+    np.testing.assert_array_equal(parallel['hRe'].values, flooded['hRe'].values)
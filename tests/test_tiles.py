@@ -0,0 +1,92 @@
+# author: 'Jing Chen'
+# description: 'Tiled IC regridding: stitched tiles match the whole grid, and tile workers report their stages'
+# created: '2025-08-05'
+import sys
+import types
+
+import numpy as np
+import pytest
+import xarray
+
+from profiling import PROFILER
+from write_glorys_IC_3200_3km_20240920_fill_at_the_end import regrid_fields, regrid_tiled, tile_bounds
+
+NAMES = {'temperature': 'thetao', 'salinity': 'so', 'sea_surface_height': 'zos',
+         'zonal_velocity': 'uo', 'meridional_velocity': 'vo'}
+NYH, NXH = 13, 17
+
+
+class NearestRegridder():
+    """Nearest source point regridding in place of xesmf.Regridder, for tests without ESMF."""
+
+    def __init__(self, ds_in, ds_out, filename=None, **kwargs):
+        lon, lat = ds_out['lon'], ds_out['lat']
+        self.ix = np.abs(lon.values[..., np.newaxis] - ds_in['lon'].values).argmin(axis=-1)
+        self.iy = np.abs(lat.values[..., np.newaxis] - ds_in['lat'].values).argmin(axis=-1)
+        self.dims = lon.dims
+
+    def __call__(self, ds):
+        def regrid(da):
+            da = da.transpose(..., 'lat', 'lon')
+            return xarray.DataArray(da.values[..., self.iy, self.ix], dims=da.dims[:-2] + self.dims)
+        return xarray.Dataset({name: regrid(da) for name, da in ds.data_vars.items()})
+
+
+@pytest.fixture
+def xesmf(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'xesmf', types.SimpleNamespace(Regridder=NearestRegridder))
+
+
+def source():
+    """Flooded GLORYS fields on the model levels, NaN below a varying deepest level."""
+    rng = np.random.default_rng(0)
+    lon, lat = np.arange(-80.0, -70.0, 0.25), np.arange(15.0, 22.0, 0.25)
+    shape = (1, 4, lat.size, lon.size)
+    deep = np.arange(4)[:, np.newaxis, np.newaxis] >= rng.integers(1, 5, shape[2:])
+    fields = {name: (('time', 'zl', 'lat', 'lon'), np.where(deep, np.nan, rng.random(shape)))
+              for name in ['thetao', 'so', 'uo', 'vo']}
+    fields['zos'] = (('time', 'lat', 'lon'), rng.random(shape[:1] + shape[2:]))
+    flooded = xarray.Dataset(fields, coords={'time': [0.0], 'zl': np.arange(4.0), 'lon': lon, 'lat': lat})
+    return flooded[['lon', 'lat']], flooded
+
+
+def supergrid():
+    """A rotated, stretched supergrid of NYH x NXH tracer cells inside the source."""
+    jj, ii = np.mgrid[0:2 * NYH + 1, 0:2 * NXH + 1]
+    return xarray.Dataset({'x': (('nyp', 'nxp'), -79.0 + 0.19 * ii + 0.023 * jj),
+                           'y': (('nyp', 'nxp'), 16.0 + 0.17 * jj + 0.019 * ii),
+                           'angle_dx': (('nyp', 'nxp'), 0.1 * np.sin(0.3 * ii + 0.2 * jj))})
+
+
+@pytest.mark.parametrize('n, parts', [(13, 3), (17, 4), (5, 5), (3, 7), (1, 2)])
+def test_tile_bounds_cover_the_range(n, parts):
+    bounds = tile_bounds(n, parts)
+    assert len(bounds) == min(n, parts)
+    # Contiguous, without gaps or overlaps, and sizes differ by at most one
+    assert bounds[0][0] == 0 and bounds[-1][1] == n
+    assert all(stop == start for (_, stop), (start, _) in zip(bounds[:-1], bounds[1:]))
+    sizes = [stop - start for start, stop in bounds]
+    assert min(sizes) >= 1 and max(sizes) - min(sizes) <= 1
+
+
+@pytest.mark.parametrize('tiles', [[3, 4], [2, 1], [1, 5], [NYH, NXH]], ids=str)
+@pytest.mark.parametrize('workers, halo', [(1, 0), (1, 10), (2, 0)])
+def test_stitched_tiles_match_the_whole_grid(xesmf, tiles, workers, halo):
+    # 13 x 17 cells in 3 x 4 tiles leaves ragged tiles of 4 and 5 rows and columns
+    glorys, flooded = source()
+    grid = supergrid()
+    whole = regrid_fields(glorys, flooded, grid, NAMES, {})
+    tiled = regrid_tiled(glorys, flooded, grid, NAMES, {}, tiles, workers=workers, halo=halo)
+    assert tiled.identical(whole)
+    # Every point on the seams between tiles was written: only the deep levels are left missing
+    for name in ['temp', 'salt', 'ssh', 'u', 'v']:
+        assert not tiled[name].isel(zl=0, missing_dims='ignore').isnull().any()
+
+
+def test_tile_worker_stages_reach_the_profile(xesmf, monkeypatch):
+    monkeypatch.setattr(PROFILER, 'enabled', True)
+    monkeypatch.setattr(PROFILER, 'stages', {})
+    glorys, flooded = source()
+    regrid_tiled(glorys, flooded, supergrid(), NAMES, {}, [2, 2], workers=2)
+    assert PROFILER.stages['workers/tile']['calls'] == 4
+    assert PROFILER.stages['workers/tile/regrid']['calls'] >= 4
@@ -0,0 +1,264 @@
+# author: 'Jing Chen'
+# description: 'GLORYS days opened by the OBC writer are closed after use'
+# created: '2025-08-05'
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+import xarray
+
+import boundary
+import planning
+import profiling
+import write_MOM6_glorys_boundary_daily
+from write_MOM6_glorys_boundary_daily import DayPrefetcher, open_glorys, plan_boundary, process_date_range, setup_run
+
+PREFIX = 'GLOBAL_ANALYSISFORECAST_PHY'
+DATE = datetime(2024, 9, 26)
+
+
+def open_files(directory):
+    """Files under directory held open by this process."""
+    fds = '/proc/self/fd'
+    held = []
+    for fd in os.listdir(fds):
+        try:
+            target = os.readlink(os.path.join(fds, fd))
+        except OSError:
+            continue
+        if target.startswith(str(directory)):
+            held.append(target)
+    return held
+
+
+@pytest.fixture
+def glorys_dir(tmp_path):
+    if not os.path.isdir('/proc/self/fd'):
+        pytest.skip('needs /proc to list open files')
+    lon = np.arange(-80.0, -70.0, 0.5)
+    lat = np.arange(15.0, 25.0, 0.5)
+    depth = np.array([0.5, 10.0, 50.0])
+    shape = (1, depth.size, lat.size, lon.size)
+    rng = np.random.default_rng(0)
+    ds = xarray.Dataset({name: (('time', 'depth', 'latitude', 'longitude'), rng.random(shape))
+                         for name in ['thetao', 'so', 'uo', 'vo']},
+                        coords={'time': ('time', [0.0], {'units': 'days since 2024-09-26'}),
+                                'depth': depth, 'latitude': lat, 'longitude': lon})
+    ds['zos'] = (('time', 'latitude', 'longitude'), rng.random(shape[:1] + shape[2:]))
+    ds.to_netcdf(tmp_path / f"{PREFIX}_{DATE:%Y-%m-%d}.nc")
+    x, y = np.meshgrid(np.linspace(-78, -72, 13), np.linspace(17, 23, 13))
+    xarray.Dataset({'x': (('nyp', 'nxp'), x), 'y': (('nyp', 'nxp'), y),
+                    'angle_dx': (('nyp', 'nxp'), np.zeros_like(x))}).to_netcdf(tmp_path / 'ocean_hgrid.nc')
+    return tmp_path
+
+
+def test_open_glorys_close_releases_the_file(glorys_dir):
+    glorys = open_glorys(DATE, str(glorys_dir), PREFIX)
+    glorys['thetao'].values
+    assert open_files(glorys_dir)
+    glorys.close()
+    assert not open_files(glorys_dir)
+
+
+def test_prefetcher_closes_each_day(glorys_dir):
+    days = DayPrefetcher([DATE, DATE], lambda date: open_glorys(date, str(glorys_dir), PREFIX), ['thetao', 'zos'])
+    for _, glorys in days:
+        assert glorys['thetao'].shape == (1, 3, 20, 20)
+    assert not open_files(glorys_dir)
+
+
+def test_plan_closes_the_source(glorys_dir):
+    config = {'glorys_dir': str(glorys_dir), 'hgrid': str(glorys_dir / 'ocean_hgrid.nc'),
+              'variables': ['thetao', 'zos', 'uv'], 'segments': [{'id': 1, 'border': 'south'}]}
+    plan = plan_boundary(config, DATE, DATE)
+    assert plan.inputs['glorys']['z'] == 3
+    assert not open_files(glorys_dir)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_plan_workers_fit_the_budget(glorys_dir, monkeypatch, workers):
+    config = {'glorys_dir': str(glorys_dir), 'hgrid': str(glorys_dir / 'ocean_hgrid.nc'),
+              'variables': ['thetao', 'uv'], 'output_policy': {'default': {'zlib': True}},
+              'segments': [{'id': seg_id, 'border': border}
+                           for seg_id, border in enumerate(['south', 'north', 'east', 'west'], 1)]}
+    # The day's source (read stage) is held once; each segment worker adds its regridding buffers
+    plan = plan_boundary(config, DATE, DATE)
+    stages = {s['stage']: s['peak_memory'] for s in plan.stages}
+    held, worker_peak = stages['read'], stages['regrid'] - stages['read']
+    memory = held + (workers + 0.5) * worker_peak / 0.8
+    monkeypatch.setattr(write_MOM6_glorys_boundary_daily, 'available_memory', lambda: memory)
+    monkeypatch.setattr(planning, 'available_memory', lambda: memory)
+    monkeypatch.setattr(planning, 'cpu_count', lambda: 64)
+    plan = plan_boundary(config, DATE, DATE)
+    assert plan.recommendations['segment_workers'] == workers
+    days = plan.recommendations['parallel days (run_cycle workers)']
+    assert days * plan.peak_memory <= 0.8 * memory < (days + 1) * plan.peak_memory
+    total = plan.outputs['all files for 1 days']
+    assert plan.outputs['all files for 1 days, compressed (rough)'] == planning.COMPRESSION_RATIO * total
+
+
+def boundary_config(glorys_dir, **kwargs):
+    return dict({'glorys_dir': str(glorys_dir), 'hgrid': str(glorys_dir / 'ocean_hgrid.nc'),
+                 'output_dir': str(glorys_dir / 'out'), 'variables': ['thetao'],
+                 'segments': [{'id': 1, 'border': 'south'}]}, **kwargs)
+
+
+def test_segment_workers_get_no_parent_writer(glorys_dir):
+    _, _, writer, _ = setup_run(boundary_config(glorys_dir, write_workers=2, segment_workers=2))
+    assert writer is None
+    domains, _, writer, _ = setup_run(boundary_config(glorys_dir, write_workers=2))
+    assert all(segment.writer is writer for segment in domains[0][1])
+    writer.close()
+
+
+def test_failed_run_closes_the_writer(glorys_dir, monkeypatch):
+    closed = []
+
+    class Writer(write_MOM6_glorys_boundary_daily.NetCDFWriter):
+        def close(self):
+            closed.append(self)
+            super().close()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('regrid failed')
+
+    monkeypatch.setattr(write_MOM6_glorys_boundary_daily, 'NetCDFWriter', Writer)
+    monkeypatch.setattr(write_MOM6_glorys_boundary_daily, 'write_day', fail)
+    with pytest.raises(RuntimeError, match='regrid failed'):
+        process_date_range(boundary_config(glorys_dir), DATE, DATE, prefetch=0)
+    assert len(closed) == 1 and closed[0]._pool._shutdown
+    assert not open_files(glorys_dir)
+
+
+@pytest.fixture
+def nearest_regrid(monkeypatch):
+    """Stand-in for reuse_regrid: nearest source point of each segment point, no xesmf needed."""
+    def reuse_regrid(source, coords, **kwargs):
+        ix = np.abs(coords['lon'].values[:, np.newaxis] - source['lon'].values).argmin(axis=1)
+        iy = np.abs(coords['lat'].values[:, np.newaxis] - source['lat'].values).argmin(axis=1)
+        # Output along the segment's own dimension, with its lon and lat, as xesmf does for locstream_out
+        dim = coords['lon'].dims[0]
+
+        def regrid(field):
+            return field.drop_vars(['lon', 'lat']) \
+                .isel(lon=xarray.DataArray(ix, dims=dim), lat=xarray.DataArray(iy, dims=dim)) \
+                .assign_coords(lon=coords['lon'], lat=coords['lat'])
+        return regrid
+
+    monkeypatch.setattr(boundary, 'reuse_regrid', reuse_regrid)
+
+
+@pytest.mark.parametrize('prefetch', [0, 1])
+def test_range_closes_each_day(glorys_dir, nearest_regrid, prefetch):
+    process_date_range(boundary_config(glorys_dir), DATE, DATE, prefetch=prefetch)
+    assert sorted(os.listdir(glorys_dir / 'out')) == ['.manifest', 'thetao_001_20240926.nc']
+    assert not open_files(glorys_dir)
+
+
+@pytest.mark.parametrize('segment_workers', [0, 2])
+def test_consolidated_file_holds_every_variable(glorys_dir, nearest_regrid, segment_workers):
+    variables = ['thetao', 'so', 'zos', 'uv']
+    segments = [{'id': 1, 'border': 'south'}, {'id': 2, 'border': 'east'}]
+    separate = boundary_config(glorys_dir, variables=variables, segments=segments)
+    process_date_range(separate, DATE, DATE, prefetch=0)
+    consolidated = boundary_config(glorys_dir, variables=variables, segments=segments, consolidate=True,
+                                   output_dir=str(glorys_dir / 'consolidated'), segment_workers=segment_workers)
+    process_date_range(consolidated, DATE, DATE, prefetch=0)
+
+    # One file per segment and day, in place of one per variable
+    assert sorted(os.listdir(glorys_dir / 'consolidated')) == ['.manifest', 'obc_001_20240926.nc', 'obc_002_20240926.nc']
+    for seg_id in [1, 2]:
+        with xarray.open_dataset(glorys_dir / 'consolidated' / f"obc_{seg_id:03d}_20240926.nc") as obc:
+            names = set()
+            for variable in variables:
+                with xarray.open_dataset(glorys_dir / 'out' / f"{variable}_{seg_id:03d}_20240926.nc") as single:
+                    names |= set(single.data_vars)
+                    for name in single.data_vars:
+                        xarray.testing.assert_identical(obc[name].variable, single[name].variable)
+            assert set(obc.data_vars) == names
+            # Coordinates are written once, shared by every variable
+            for name in ['time', 'lon_segment_001', 'lat_segment_001']:
+                name = name.replace('001', f"{seg_id:03d}")
+                xarray.testing.assert_identical(obc[name], single[name])
+            assert obc['time'].encoding['units'] == 'days since 2024-09-26'
+
+
+def test_segment_worker_stages_reach_the_profile(glorys_dir, nearest_regrid, monkeypatch):
+    monkeypatch.setattr(profiling.PROFILER, 'enabled', True)
+    monkeypatch.setattr(profiling.PROFILER, 'stages', {})
+    segments = [{'id': 1, 'border': 'south'}, {'id': 2, 'border': 'east'}]
+    process_date_range(boundary_config(glorys_dir, segments=segments, segment_workers=2), DATE, DATE, prefetch=0)
+    assert profiling.PROFILER.stages['workers/segment']['calls'] == 2
+    assert {'share', 'manifest'} <= set(profiling.PROFILER.stages)
+
+
+def hourly_ssh(glorys_dir):
+    """A GLORYS day with hourly SSH on its own time axis, next to one record of the 3D fields."""
+    glorys = open_glorys(DATE, str(glorys_dir), PREFIX).load()
+    zos = xarray.DataArray(np.repeat(glorys['zos'].values, 24, axis=0), dims=('time_ssh', 'lat', 'lon'),
+                           coords={'time_ssh': ('time_ssh', np.arange(24.0), {'units': 'hours since 2024-09-26'}),
+                                   'lat': glorys['lat'], 'lon': glorys['lon']})
+    return glorys.drop_vars('zos').assign(zos=zos)
+
+
+def test_sub_daily_ssh_keeps_every_record(glorys_dir, nearest_regrid):
+    config = boundary_config(glorys_dir, variables=['thetao', 'zos'], write_workers=0)
+    domains, _, _, _ = setup_run(config)
+    write_MOM6_glorys_boundary_daily.write_day(DATE, None, domains[0][1], config['variables'], None,
+                                               glorys=hourly_ssh(glorys_dir))
+    with xarray.open_dataset(glorys_dir / 'out' / 'zos_001_20240926.nc') as zos, \
+            xarray.open_dataset(glorys_dir / 'out' / 'thetao_001_20240926.nc') as thetao:
+        assert zos.sizes['time'] == 24 and thetao.sizes['time'] == 1
+        # One chunk per hourly record
+        assert zos['zos_segment_001'].encoding['chunksizes'][0] == 1
+
+
+def test_consolidate_rejects_sub_daily_ssh(glorys_dir, nearest_regrid):
+    glorys = hourly_ssh(glorys_dir)
+    config = boundary_config(glorys_dir, variables=['thetao', 'zos'], consolidate=True)
+    domains, _, writer, _ = setup_run(config)
+    try:
+        with pytest.raises(ValueError, match='same time axis'):
+            write_MOM6_glorys_boundary_daily.write_day(DATE, None, domains[0][1], config['variables'], None,
+                                                       glorys=glorys, consolidate='obc')
+    finally:
+        writer.close()
+
+
+@pytest.mark.parametrize('segment_workers', [0, 2])
+def test_domains_share_one_read_of_each_day(glorys_dir, nearest_regrid, monkeypatch, segment_workers):
+    variables = ['thetao', 'zos', 'uv']
+    domains = [{'name': 'south', 'output_dir': str(glorys_dir / 'south'), 'segments': [{'id': 1, 'border': 'south'}]},
+               {'name': 'east', 'output_dir': str(glorys_dir / 'east'), 'segments': [{'id': 2, 'border': 'east'}],
+                'consolidate': True}]
+    for domain in domains:
+        alone = dict(domain, output_dir=domain['output_dir'] + '_alone')
+        process_date_range(boundary_config(glorys_dir, variables=variables, **alone), DATE, DATE, prefetch=0)
+    opened = []
+    read = write_MOM6_glorys_boundary_daily.open_glorys
+    monkeypatch.setattr(write_MOM6_glorys_boundary_daily, 'open_glorys',
+                        lambda date, *args, **kwargs: opened.append(date) or read(date, *args, **kwargs))
+    shared = boundary_config(glorys_dir, variables=variables, domains=domains, segment_workers=segment_workers)
+    process_date_range(shared, DATE, DATE, prefetch=0)
+
+    assert opened == [DATE]
+    assert not open_files(glorys_dir)
+    # Each domain gets the files of a run of its own
+    for domain in domains:
+        files = sorted(os.listdir(domain['output_dir']))
+        assert files == sorted(os.listdir(domain['output_dir'] + '_alone'))
+        for name in files:
+            if name.endswith('.nc'):
+                with xarray.open_dataset(os.path.join(domain['output_dir'], name)) as shared, \
+                        xarray.open_dataset(os.path.join(domain['output_dir'] + '_alone', name)) as alone:
+                    xarray.testing.assert_identical(shared, alone)
+
+
+def test_domains_only_change_target_keys(glorys_dir):
+    with pytest.raises(ValueError, match='only'):
+        write_MOM6_glorys_boundary_daily.domain_configs(
+            boundary_config(glorys_dir, domains=[{'output_dir': 'a', 'glorys_dir': 'elsewhere'}]))
+    with pytest.raises(ValueError, match='own output_dir'):
+        write_MOM6_glorys_boundary_daily.domain_configs(
+            boundary_config(glorys_dir, domains=[{'name': 'a'}, {'name': 'b'}]))